@@ -1,9 +1,13 @@
 import streamlit as st
-import pandas as pd
-import re
-import os
-from utils import load_excel_data, get_receipt_image
-from PIL import Image
+import uuid
+import numpy as np
+from utils import get_receipt_image, get_receipt_preview_bytes, PICKER_PAGE_SIZE
+from prefetch import ReceiptPrefetcher, get_prefetch_executor, PREFETCH_COUNT
+from verification_store import get_verification_store, LEASE_BATCH_SIZE, STATUS_UNVERIFIED
+import metrics
+from scoring import live_field_accuracy, FIELD_LABELS
+from validation import PRETICK_ENABLED, TRIAGE_ENABLED
+from shards import open_dataset, count_by_shard
 
 # Set page configuration
 st.set_page_config(
@@ -12,6 +16,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Timing histograms endpoint and rerun log (only when RECEIPT_METRICS=1)
+metrics.serve()
+
 # Custom CSS for portrait image display, full dropdown text และการซูมภาพ
 st.markdown("""
 <style>
@@ -92,8 +99,8 @@ st.markdown("""
 st.markdown("<h1 style='text-align: center; border-bottom: 1px solid rgba(38, 39, 48, 0.1); padding-bottom: 0.3em;'>ระบบตรวจสอบใบเสร็จจาก AI (OpenAI Azure)</h1>", unsafe_allow_html=True)
 
 # Initialize session state variables if they don't exist
-if 'current_index' not in st.session_state:
-    st.session_state.current_index = 0
+if 'current_position' not in st.session_state:
+    st.session_state.current_position = 0
     
 if 'verified_fields' not in st.session_state:
     st.session_state.verified_fields = {
@@ -105,47 +112,261 @@ if 'verified_fields' not in st.session_state:
         'store_name': False
     }
     
-if 'verification_stats' not in st.session_state:
-    st.session_state.verification_stats = {
-        'true1': 0,
-        'true2': 0,
-        'true3': 0,
-        'true4': 0,
-        'true5': 0,
-        'true6': 0,
-        'cancel': 0
-    }
+# Identifies this session when leasing receipts, so parallel reviewers never get the same ones.
+# It is kept in the page URL, so reloading the page takes back the same leases
+# instead of locking them away until they expire.
+if 'reviewer_id' not in st.session_state:
+    st.session_state.reviewer_id = st.query_params.get('reviewer') or uuid.uuid4().hex
+if st.query_params.get('reviewer') != st.session_state.reviewer_id:
+    st.query_params['reviewer'] = st.session_state.reviewer_id
+
+# Background preparation of the next receipts for this session
+if 'prefetcher' not in st.session_state:
+    st.session_state.prefetcher = ReceiptPrefetcher(get_prefetch_executor())
+
+def reset_verified_fields(ticked=None):
+    """Untick every field (or tick just the given ones) for the next receipt."""
+    ticked = ticked or {}
+    st.session_state.verified_fields = {field: bool(ticked.get(field)) for field in st.session_state.verified_fields}
+    # Keyed checkboxes keep their own state across reruns; drop it so they follow verified_fields
+    for field in st.session_state.verified_fields:
+        st.session_state.pop(f'{field}_checkbox', None)
+
+def select_receipt():
+    """Jump to the receipt picked in the dropdown."""
+    selected_position = st.session_state.file_selector
+    if selected_position is not None and selected_position != st.session_state.current_position:
+        st.session_state.current_position = int(selected_position)
+        # The prefetched receipts no longer follow the selected one
+        st.session_state.prefetcher.cancel()
+        reset_verified_fields()
+
+def record_duplicate_verdicts(store, receipts_data, positions, **verdict):
+    """
+    Record the same verdict for duplicates of the current receipt that nobody has reviewed yet.
+
+    Returns:
+        int: Number of receipts recorded
+    """
+    json_files = receipts_data['Source JSON File'].iloc[positions].tolist()
+    verdicts = store.verdicts_for(json_files)
+    recorded = 0
+    # The status read here only skips writes; a verdict recorded since then is kept by only_unverified
+    for json_file, status in zip(verdicts['json_file'], verdicts['status']):
+        if status == STATUS_UNVERIFIED and store.record_verdict(json_file, reviewer=st.session_state.reviewer_id,
+                                                                only_unverified=True, **verdict):
+            recorded += 1
+    return recorded
+
+@st.fragment
+def receipt_picker(dataset, store, current_position):
+    """
+    Search box, page selector and dropdown of receipts still to review.
+
+    Runs as a fragment so typing a search or paging reruns only the picker.
+    Picking a receipt reruns the whole page to show it. With several shards,
+    a shard selector (with the receipts left in each) comes first, and the
+    search covers the selected shard, which is loaded if it isn't already.
+    """
+    # Looked up here rather than passed in: a fragment keeps its arguments
+    # for its reruns, which would hold a positions array (or a shard) per session
+    available_positions = store.unverified_positions(owner=st.session_state.reviewer_id)
+    if len(available_positions) == 0:
+        available_positions = np.arange(len(dataset))
+    
+    # Follow the current receipt's shard until another one is picked
+    current_shard = dataset.shard_at(current_position).name
+    if st.session_state.get('picker_shard_follow') != current_shard \
+            or st.session_state.get('picker_shard') not in [info.name for info in dataset.shards]:
+        st.session_state.picker_shard_follow = current_shard
+        st.session_state.picker_shard = current_shard
+    if len(dataset.shards) > 1:
+        remaining = dict(zip([info.name for info in dataset.shards],
+                             count_by_shard(dataset, available_positions).tolist()))
+        st.selectbox(
+            "ชุดข้อมูล",
+            options=list(remaining),
+            key="picker_shard",
+            format_func=lambda name: f"{name} (เหลือ {remaining[name]} รายการ)",
+            label_visibility="collapsed"
+        )
+    shard = dataset.load(st.session_state.get('picker_shard', current_shard))
+    in_shard = available_positions[(available_positions >= shard.offset)
+                                   & (available_positions < shard.offset + len(shard))]
+    
+    # Search and paging happen on the server; only one page of options is sent
+    search_query = st.text_input(
+        "ค้นหาใบเสร็จ",
+        key="picker_search",
+        placeholder="ค้นหาจากชื่อไฟล์หรือชื่อร้าน",
+        label_visibility="collapsed"
+    )
+    matches = shard.search_index.search(search_query, in_shard - shard.offset) + shard.offset
+    page_count = max(1, -(-len(matches) // PICKER_PAGE_SIZE))
+    
+    # Show the page holding the current receipt whenever it (or the search or shard) changes
+    if st.session_state.get('picker_follow') != (current_position, search_query, shard.name):
+        st.session_state.picker_follow = (current_position, search_query, shard.name)
+        match_slot = int(np.searchsorted(matches, current_position))
+        if match_slot < len(matches) and matches[match_slot] == current_position:
+            st.session_state.picker_page = match_slot // PICKER_PAGE_SIZE + 1
+    st.session_state.picker_page = min(max(st.session_state.get('picker_page', 1), 1), page_count)
+    
+    col_picker = st.columns([4, 1])
+    with col_picker[1]:
+        page = st.number_input(
+            "หน้า",
+            min_value=1,
+            max_value=page_count,
+            key="picker_page",
+            label_visibility="collapsed"
+        )
+    with col_picker[0]:
+        page_options = matches[(page - 1) * PICKER_PAGE_SIZE:page * PICKER_PAGE_SIZE].tolist()
+        if len(page_options) > 0:
+            # Keep the dropdown in step with the current receipt
+            st.session_state.file_selector = current_position if current_position in page_options else None
+            st.selectbox(
+                "เลือกใบเสร็จที่ต้องการตรวจสอบ",
+                options=page_options,
+                index=None,
+                format_func=lambda position: shard.search_index.label(position - shard.offset),
+                key="file_selector",
+                on_change=select_receipt,
+                placeholder="เลือกใบเสร็จที่ต้องการตรวจสอบ",
+                label_visibility="collapsed"
+            )
+        elif search_query.strip():
+            st.write("ไม่พบใบเสร็จที่ตรงกับคำค้นหา")
+        else:
+            st.write("ไม่มีใบเสร็จที่ยังไม่ได้ตรวจสอบ")
+    st.caption(f"{len(matches)} รายการ · หน้า {page}/{page_count}")
+    
+    if st.session_state.current_position != current_position:
+        st.rerun()
+
+@st.fragment
+def verification_fields(display_fields, flagged=()):
+    """
+    The extracted fields with a checkbox per field.
 
-# Keep track of verified receipts
-if 'verified_receipts' not in st.session_state:
-    st.session_state.verified_receipts = set()
+    Runs as a fragment so ticking a field reruns only this panel, not the
+    image or the picker. The ticks are kept in st.session_state.verified_fields
+    for the Yes button. Fields in flagged failed the validation rules and are
+    marked for a closer look.
+    """
+    flag = {field: " ⚠️" if field in flagged else "" for field in display_fields}
+    
+    # Display extracted data with checkboxes
+    tax_id_value = display_fields['tax_id']
+    receipt_number_value = display_fields['receipt_number']
+    date_value = display_fields['date']
+    time_value = display_fields['time']
+    total_amount_value = display_fields['total_amount']
+    store_name_value = display_fields['store_name']
+    
+    # Tax ID
+    col_tax_id = st.columns([0.1, 0.9])
+    with col_tax_id[0]:
+        tax_id = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['tax_id'], key='tax_id_checkbox', label_visibility="collapsed")
+        st.session_state.verified_fields['tax_id'] = tax_id
+    with col_tax_id[1]:
+        st.markdown(f"**Tax ID:** {tax_id_value}{flag['tax_id']}")
+        
+    # Receipt Number
+    col_receipt = st.columns([0.1, 0.9])
+    with col_receipt[0]:
+        receipt_number = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['receipt_number'], key='receipt_number_checkbox', label_visibility="collapsed")
+        st.session_state.verified_fields['receipt_number'] = receipt_number
+    with col_receipt[1]:
+        st.markdown(f"**Receipt Number:** {receipt_number_value}{flag['receipt_number']}")
+        
+    # Date
+    col_date = st.columns([0.1, 0.9])
+    with col_date[0]:
+        date = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['date'], key='date_checkbox', label_visibility="collapsed")
+        st.session_state.verified_fields['date'] = date
+    with col_date[1]:
+        st.markdown(f"**Date:** {date_value}{flag['date']}")
+        
+    # Time
+    col_time = st.columns([0.1, 0.9])
+    with col_time[0]:
+        time = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['time'], key='time_checkbox', label_visibility="collapsed")
+        st.session_state.verified_fields['time'] = time
+    with col_time[1]:
+        st.markdown(f"**Time:** {time_value}{flag['time']}")
+        
+    # Total Amount
+    col_total = st.columns([0.1, 0.9])
+    with col_total[0]:
+        total_amount = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['total_amount'], key='total_amount_checkbox', label_visibility="collapsed")
+        st.session_state.verified_fields['total_amount'] = total_amount
+    with col_total[1]:
+        st.markdown(f"**Total Amount:** {total_amount_value}{flag['total_amount']}")
+        
+    # Store name
+    col_store = st.columns([0.1, 0.9])
+    with col_store[0]:
+        store_name = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['store_name'], key='store_name_checkbox', label_visibility="collapsed")
+        st.session_state.verified_fields['store_name'] = store_name
+    with col_store[1]:
+        st.markdown(f"**Store name:** {store_name_value}{flag['store_name']}")
 
 # Try to load data from Excel file
 try:
-    # Load all receipts data
-    receipts_data = load_excel_data()
+    metrics.start_rerun()
+    
+    # The receipts to review: the shards in data/shards.json, or the single extract workbook
+    dataset = open_dataset()
+    
+    # Review progress is shared by all sessions and survives restarts
+    store = get_verification_store()
+    dataset.register(store)
+    
+    # Hold (and renew) a batch of receipts for this reviewer, highest priority first,
+    # from the shard being reviewed (so the next receipts don't each load another shard)
+    leased_shard = dataset.shard_at(st.session_state.current_position).name
+    leased_positions = [position for _, position in store.lease_batch(st.session_state.reviewer_id, LEASE_BATCH_SIZE,
+                                                                      shard=leased_shard)]
     
-    # Filter out verified receipts from the dropdown options
-    available_receipts = receipts_data.copy()
-    if len(st.session_state.verified_receipts) > 0:
-        available_receipts = receipts_data[~receipts_data['Source JSON File'].isin(st.session_state.verified_receipts)]
+    # Filter out verified receipts and those leased by other reviewers from the dropdown options
+    available_positions = store.unverified_positions(owner=st.session_state.reviewer_id)
     
-    # Reset index if no more receipts to verify or current index is out of range
-    if len(available_receipts) == 0:
+    if len(available_positions) == 0:
         # All receipts have been verified
         st.info("ดำเนินการตรวจสอบใบเสร็จทั้งหมดเรียบร้อยแล้ว กดปุ่ม 'เริ่มต้นใหม่' เพื่อตรวจสอบอีกครั้ง")
         # Use full set for display
-        available_receipts = receipts_data
-        if st.session_state.current_index >= len(receipts_data):
-            st.session_state.current_index = 0
-    elif st.session_state.current_index >= len(available_receipts):
-        st.session_state.current_index = 0
+        available_positions = np.arange(len(dataset))
     
-    # Create file options for dropdown - show full filename
-    file_options = []
-    for i, file in enumerate(available_receipts['Source JSON File']):
-        # เพิ่มหมายเลขและใช้ชื่อไฟล์เต็มโดยไม่ตัด
-        file_options.append(f"{i+1}. {file}")
+    # Stay on the current receipt while it's available; once it has been reviewed
+    # (or leased by another reviewer) move on to the next one, wrapping to the top.
+    # Past the end of a shard, that is the first receipt left in the shards after it.
+    current_slot = int(np.searchsorted(available_positions, st.session_state.current_position))
+    current_available = (current_slot < len(available_positions)
+                         and available_positions[current_slot] == st.session_state.current_position)
+    if TRIAGE_ENABLED and not current_available and leased_positions:
+        # With triage, move on in priority order (the order receipts are leased in)
+        current_slot = int(np.searchsorted(available_positions, leased_positions[0]))
+    if current_slot == len(available_positions):
+        current_slot = 0
+    if len(available_positions) > 0:
+        st.session_state.current_position = int(available_positions[current_slot])
+    current_position = st.session_state.current_position
+    
+    # Only the current receipt's shard is needed in memory
+    shard = dataset.load(dataset.shard_at(current_position).name)
+    receipts_data, triage = shard.data, shard.triage
+    shard_position = current_position - shard.offset
+    if shard.name != leased_shard:
+        # Moved on to another shard: lease from it instead
+        leased_positions = [position for _, position in store.lease_batch(st.session_state.reviewer_id,
+                                                                          LEASE_BATCH_SIZE, shard=shard.name)]
+    
+    # Each receipt starts with nothing ticked, or (with pre-ticking on) the fields that passed the validation rules
+    if st.session_state.get('fields_position') != current_position:
+        st.session_state.fields_position = current_position
+        reset_verified_fields(triage.preticked(shard_position) if triage and PRETICK_ENABLED else None)
     
     # Dropdown for file selection
     with st.container():
@@ -158,56 +379,55 @@ try:
         # แก้ไขสัดส่วนของคอลัมน์ให้กว้างขึ้นเพื่อป้องกันการทับซ้อน
         col_dropdown = st.columns([2, 1])
         with col_dropdown[0]:
-            if len(file_options) > 0:
-                selected_file = st.selectbox(
-                    "เลือกใบเสร็จที่ต้องการตรวจสอบ",
-                    options=file_options,
-                    index=min(st.session_state.current_index, len(file_options)-1),
-                    key="file_selector",
-                    label_visibility="collapsed"
-                )
-                
-                # Update current index when dropdown selection changes
-                selected_match = re.search(r'(\d+)\.', selected_file)
-                if selected_match:
-                    # แปลงเป็น int และเก็บเป็น Python int (ไม่ใช่ numpy.int64)
-                    selected_index = int(selected_match.group(1)) - 1
-                    if selected_index != st.session_state.current_index:
-                        st.session_state.current_index = int(selected_index)  # ใช้ int() เพื่อแปลงเป็น Python int
-                        st.session_state.verified_fields = {
-                            'tax_id': False,
-                            'receipt_number': False,
-                            'date': False,
-                            'time': False,
-                            'total_amount': False,
-                            'store_name': False
-                        }
-                        st.rerun()
-            else:
-                st.write("ไม่มีใบเสร็จที่ยังไม่ได้ตรวจสอบ")
+            receipt_picker(dataset, store, current_position)
         
         # Add reset button to dropdown area
         with col_dropdown[1]:
-            if st.button("เริ่มต้นใหม่", key="reset_button", help="เคลียร์ผลลัพธ์ทั้งหมดและเริ่มตรวจสอบใหม่"):
-                # Reset all stats and verification info
-                st.session_state.verification_stats = {
-                    'true6': 0, 'true5': 0, 'true4': 0, 'true3': 0, 'true2': 0, 'true1': 0, 'cancel': 0
-                }
-                st.session_state.verified_receipts = set()
-                st.session_state.current_index = 0
-                st.session_state.verified_fields = {field: False for field in st.session_state.verified_fields}
-                st.rerun()
+            # Only this reviewer's own verdicts; clearing everyone's is `python verification_store.py reset`
+            if st.button("เริ่มต้นใหม่", key="reset_button", help="ล้างผลการตรวจสอบที่คุณบันทึกในเซสชันนี้และเริ่มตรวจสอบใหม่"):
+                st.session_state.confirm_reset = True
+            if st.session_state.get('confirm_reset'):
+                st.warning("ผลการตรวจสอบที่คุณบันทึกในเซสชันนี้จะถูกล้างทั้งหมด ยืนยันหรือไม่?")
+                confirm_col, keep_col = st.columns(2)
+                if confirm_col.button("ยืนยัน", key="confirm_reset_button"):
+                    store.reset(st.session_state.reviewer_id)
+                    st.session_state.confirm_reset = False
+                    st.session_state.current_position = 0
+                    st.session_state.prefetcher.cancel()
+                    reset_verified_fields()
+                    st.rerun()
+                if keep_col.button("ยกเลิก", key="keep_results_button"):
+                    st.session_state.confirm_reset = False
+                    st.rerun()
                 
         st.markdown("</div>", unsafe_allow_html=True)
     
-    # Get the current receipt data from available receipts
-    if len(available_receipts) > 0:
-        # แปลงเป็น Python int เพื่อป้องกันปัญหา numpy.int64
-        current_index = int(min(st.session_state.current_index, len(available_receipts)-1))
-        current_receipt = available_receipts.iloc[current_index]
+    # Get the current receipt data
+    if len(available_positions) > 0:
+        current_receipt = receipts_data.iloc[shard_position]
         json_filename = current_receipt['Source JSON File']
         img_filename = json_filename.replace('.json', '.jpg')
         
+        # Fields are normalized and formatted once per shard
+        receipt_fields = shard.fields
+        display_fields = receipt_fields[shard_position]
+        
+        # Other receipts of the shard with the same photo (found by dedup.py) and the same extracted
+        # fields share the verdict (positions within the shard)
+        duplicate_positions = [position for position in shard.duplicates.of(shard_position)
+                               if receipt_fields[position] == display_fields]
+        
+        # Use the background prefetch result for this receipt if it's ready
+        prefetched = st.session_state.prefetcher.take(json_filename)
+        
+        # Prepare the next receipts of this shard while this one is being reviewed
+        if triage:
+            upcoming = [position for position in leased_positions if position != current_position][:PREFETCH_COUNT]
+        else:
+            upcoming = available_positions[current_slot + 1:current_slot + 1 + PREFETCH_COUNT]
+        upcoming = [position - shard.offset for position in upcoming if shard.contains(position)]
+        st.session_state.prefetcher.schedule(receipts_data['Source JSON File'].iloc[upcoming].tolist(), shard.image_source)
+        
         # Main content area with three columns
         col1, col2, col3 = st.columns([4, 4, 2])
         
@@ -225,24 +445,37 @@ try:
             )
             
             # Display receipt image in portrait orientation
-            receipt_image = get_receipt_image(json_filename)
-            if receipt_image:
-                # Resize image to be taller than it is wide (force portrait mode)
-                width, height = receipt_image.size
-                if width > height:
-                    # This is a landscape image, rotate it to portrait
-                    # Use 270 degrees instead of 90 to avoid upside-down images
-                    receipt_image = receipt_image.rotate(270, expand=True)
+            # Prefer the pre-rendered, downscaled previews over decoding the original
+            with metrics.span("image_load", prefetched=bool(prefetched and prefetched['images'])):
+                if prefetched and prefetched['images']:
+                    previews = prefetched['images']
+                else:
+                    previews = get_receipt_preview_bytes(json_filename, shard.image_source)
+                receipt_image = None if previews else get_receipt_image(json_filename, shard.image_source)
+            with metrics.span("image_render", source="preview" if previews else "original"):
+                if previews:
+                    with st.expander("คลิกที่นี่เพื่อซูมภาพ", expanded=False):
+                        st.image(previews['zoom'], use_container_width=True, caption="คลิกขวาที่ภาพและเลือก 'Open image in new tab' เพื่อดูภาพขนาดเต็ม")
+                
+                    st.image(previews['view'], use_container_width=False)
+                elif receipt_image:
+                    # Resize image to be taller than it is wide (force portrait mode)
+                    width, height = receipt_image.size
+                    if width > height:
+                        # This is a landscape image, rotate it to portrait
+                        # Use 270 degrees instead of 90 to avoid upside-down images
+                        with metrics.span("image_rotate"):
+                            receipt_image = receipt_image.rotate(270, expand=True)
                 
-                # เพิ่มเครื่องมือซูมภาพด้วย st.expander
-                with st.expander("คลิกที่นี่เพื่อซูมภาพ", expanded=False):
-                    # แสดงภาพขนาดใหญ่ในความละเอียดเต็มเมื่อคลิกที่ expander
-                    st.image(receipt_image, use_container_width=True, caption="คลิกขวาที่ภาพและเลือก 'Open image in new tab' เพื่อดูภาพขนาดเต็ม")
+                    # เพิ่มเครื่องมือซูมภาพด้วย st.expander
+                    with st.expander("คลิกที่นี่เพื่อซูมภาพ", expanded=False):
+                        # แสดงภาพขนาดใหญ่ในความละเอียดเต็มเมื่อคลิกที่ expander
+                        st.image(receipt_image, use_container_width=True, caption="คลิกขวาที่ภาพและเลือก 'Open image in new tab' เพื่อดูภาพขนาดเต็ม")
                 
-                # แสดงภาพในหน้าหลักด้วยความละเอียดต้นฉบับ ไม่กำหนดความกว้าง
-                st.image(receipt_image, use_container_width=False)
-            else:
-                st.warning("ไม่พบรูปภาพใบเสร็จ")
+                    # แสดงภาพในหน้าหลักด้วยความละเอียดต้นฉบับ ไม่กำหนดความกว้าง
+                    st.image(receipt_image, use_container_width=False)
+                else:
+                    st.warning("ไม่พบรูปภาพใบเสร็จ")
             
             # Display image filename
             st.markdown(f"<p style='text-align: center;'>{img_filename}</p>", unsafe_allow_html=True)
@@ -263,79 +496,11 @@ try:
                 unsafe_allow_html=True
             )
             
-            # Display extracted data with checkboxes
+            verification_fields(display_fields, triage.flagged(shard_position) if triage else ())
             
-            # Tax ID
-            tax_id_value = current_receipt['Tax ID'] if pd.notna(current_receipt['Tax ID']) else "ไม่พบข้อมูล"
-            col_tax_id = st.columns([0.1, 0.9])
-            with col_tax_id[0]:
-                tax_id = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['tax_id'], key='tax_id_checkbox', label_visibility="collapsed")
-                st.session_state.verified_fields['tax_id'] = tax_id
-            with col_tax_id[1]:
-                st.markdown(f"**Tax ID:** {tax_id_value}")
-                
-            # Receipt Number
-            receipt_number_value = current_receipt['Receipt Number'] if pd.notna(current_receipt['Receipt Number']) else "ไม่พบข้อมูล"
-            col_receipt = st.columns([0.1, 0.9])
-            with col_receipt[0]:
-                receipt_number = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['receipt_number'], key='receipt_number_checkbox', label_visibility="collapsed")
-                st.session_state.verified_fields['receipt_number'] = receipt_number
-            with col_receipt[1]:
-                st.markdown(f"**Receipt Number:** {receipt_number_value}")
-                
-            # Date
-            date_value = "ไม่พบข้อมูล"
-            if pd.notna(current_receipt['Date']):
-                try:
-                    # Check if the date is already a string
-                    if isinstance(current_receipt['Date'], str):
-                        date_value = current_receipt['Date']
-                    else:
-                        # Try to format as date if it's a datetime object
-                        date_value = current_receipt['Date'].strftime('%Y-%m-%d')
-                except:
-                    # If any error occurs, use the original value as is
-                    date_value = str(current_receipt['Date'])
-            
-            col_date = st.columns([0.1, 0.9])
-            with col_date[0]:
-                date = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['date'], key='date_checkbox', label_visibility="collapsed")
-                st.session_state.verified_fields['date'] = date
-            with col_date[1]:
-                st.markdown(f"**Date:** {date_value}")
-                
-            # Time
-            time_value = current_receipt['Time'] if pd.notna(current_receipt['Time']) else "ไม่พบข้อมูล"
-            col_time = st.columns([0.1, 0.9])
-            with col_time[0]:
-                time = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['time'], key='time_checkbox', label_visibility="collapsed")
-                st.session_state.verified_fields['time'] = time
-            with col_time[1]:
-                st.markdown(f"**Time:** {time_value}")
-                
-            # Total Amount
-            total_amount_value = "ไม่พบข้อมูล"
-            if pd.notna(current_receipt['Total Amount']):
-                try:
-                    total_amount_value = f"{float(current_receipt['Total Amount']):.2f}"
-                except:
-                    total_amount_value = str(current_receipt['Total Amount'])
-                    
-            col_total = st.columns([0.1, 0.9])
-            with col_total[0]:
-                total_amount = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['total_amount'], key='total_amount_checkbox', label_visibility="collapsed")
-                st.session_state.verified_fields['total_amount'] = total_amount
-            with col_total[1]:
-                st.markdown(f"**Total Amount:** {total_amount_value}")
-                
-            # Store name
-            store_name_value = current_receipt['Store name'] if pd.notna(current_receipt['Store name']) else "ไม่พบข้อมูล"
-            col_store = st.columns([0.1, 0.9])
-            with col_store[0]:
-                store_name = st.checkbox("ถูกต้อง", value=st.session_state.verified_fields['store_name'], key='store_name_checkbox', label_visibility="collapsed")
-                st.session_state.verified_fields['store_name'] = store_name
-            with col_store[1]:
-                st.markdown(f"**Store name:** {store_name_value}")
+            if duplicate_positions:
+                st.checkbox(f"บันทึกผลเดียวกันให้ใบเสร็จที่ใช้รูปซ้ำกันอีก {len(duplicate_positions)} รายการ",
+                            value=True, key="apply_to_duplicates")
             
             # Display JSON filename at the bottom
             st.markdown(f"<p style='text-align: center; margin-top: 20px;'>{json_filename}</p>", unsafe_allow_html=True)
@@ -346,20 +511,38 @@ try:
         # Column 3: Verification Summary
         with col3:
             # Count the total number of verified items in each category
+            verification_stats = store.counts()
             st.markdown(
                 f"""
                 <div style='border: 1px solid #FF4B4B; padding: 15px; border-radius: 10px;'>
-                    <p style='margin: 5px;'><b>true6:</b> {st.session_state.verification_stats['true6']}</p>
-                    <p style='margin: 5px;'><b>true5:</b> {st.session_state.verification_stats['true5']}</p>
-                    <p style='margin: 5px;'><b>true4:</b> {st.session_state.verification_stats['true4']}</p>
-                    <p style='margin: 5px;'><b>true3:</b> {st.session_state.verification_stats['true3']}</p>
-                    <p style='margin: 5px;'><b>true2:</b> {st.session_state.verification_stats['true2']}</p>
-                    <p style='margin: 5px;'><b>true1:</b> {st.session_state.verification_stats['true1']}</p>
-                    <p style='margin: 5px;'><b>cancel:</b> {st.session_state.verification_stats['cancel']}</p>
+                    <p style='margin: 5px;'><b>true6:</b> {verification_stats['true6']}</p>
+                    <p style='margin: 5px;'><b>true5:</b> {verification_stats['true5']}</p>
+                    <p style='margin: 5px;'><b>true4:</b> {verification_stats['true4']}</p>
+                    <p style='margin: 5px;'><b>true3:</b> {verification_stats['true3']}</p>
+                    <p style='margin: 5px;'><b>true2:</b> {verification_stats['true2']}</p>
+                    <p style='margin: 5px;'><b>true1:</b> {verification_stats['true1']}</p>
+                    <p style='margin: 5px;'><b>cancel:</b> {verification_stats['cancel']}</p>
                 </div>
                 """, 
                 unsafe_allow_html=True
             )
+            
+            # Per-field accuracy of the extraction over the verified receipts
+            field_accuracy = live_field_accuracy()
+            accuracy_lines = "".join(
+                f"<p style='margin: 5px;'><b>{label}:</b> "
+                f"{'-' if field_accuracy[field] is None else f'{field_accuracy[field]:.0%}'}</p>"
+                for field, label in FIELD_LABELS.items()
+            )
+            st.markdown(
+                f"""
+                <div style='border: 1px solid #ddd; padding: 15px; border-radius: 10px; margin-top: 10px;'>
+                    <p style='margin: 5px;'><b>ความแม่นยำ</b></p>
+                    {accuracy_lines}
+                </div>
+                """,
+                unsafe_allow_html=True
+            )
         
         # Verification buttons
         st.markdown("<br>", unsafe_allow_html=True)  # Add some space
@@ -368,54 +551,34 @@ try:
         with col_buttons[1]:
             if st.button("Yes", key="yes_button", use_container_width=True, 
                         type="primary", help="ยืนยันการตรวจสอบ"):
-                # Calculate number of checked items
-                checked_count = sum(1 for field, checked in st.session_state.verified_fields.items() if checked)
-                
-                # Update verification stats
-                if checked_count > 0:
-                    stat_key = f'true{checked_count}'
-                    if stat_key in st.session_state.verification_stats:
-                        st.session_state.verification_stats[stat_key] += 1
-                
-                # Add this receipt to verified list
-                st.session_state.verified_receipts.add(json_filename)
+                # Store the per-field verdict (updates the trueN stats)
+                if not store.record_verdict(json_filename, st.session_state.verified_fields,
+                                            reviewer=st.session_state.reviewer_id):
+                    st.toast("ใบเสร็จนี้ถูกจองโดยผู้ตรวจสอบคนอื่นแล้ว ผลการตรวจสอบไม่ได้ถูกบันทึก")
+                elif duplicate_positions and st.session_state.get('apply_to_duplicates', True):
+                    recorded = record_duplicate_verdicts(store, receipts_data, duplicate_positions,
+                                                         verified_fields=st.session_state.verified_fields)
+                    if recorded:
+                        st.toast(f"บันทึกผลให้ใบเสร็จที่ใช้รูปซ้ำกันอีก {recorded} รายการ")
                 
                 # Reset verification fields
-                st.session_state.verified_fields = {field: False for field in st.session_state.verified_fields}
-                
-                # Find next unverified receipt and update index
-                if len(st.session_state.verified_receipts) < len(receipts_data):
-                    unverified_receipts = receipts_data[~receipts_data['Source JSON File'].isin(st.session_state.verified_receipts)]
-                    if len(unverified_receipts) > 0:
-                        # Get the index of the first unverified receipt from the original dataframe
-                        next_receipt = unverified_receipts.iloc[0]['Source JSON File']
-                        next_index = receipts_data[receipts_data['Source JSON File'] == next_receipt].index[0]
-                        # แปลงเป็น Python int เพื่อป้องกันปัญหา numpy.int64
-                        st.session_state.current_index = int(next_index)
+                reset_verified_fields()
                 
                 st.rerun()
         
         with col_buttons[2]:
             if st.button("cancel", key="cancel_button", use_container_width=True, 
                         help="ยกเลิกการตรวจสอบ"):
-                # Update cancel stats
-                st.session_state.verification_stats['cancel'] += 1
-                
-                # Add this receipt to verified list (even though it was canceled)
-                st.session_state.verified_receipts.add(json_filename)
+                # Store the receipt as cancelled (updates the cancel stats)
+                if not store.record_verdict(json_filename, cancelled=True, reviewer=st.session_state.reviewer_id):
+                    st.toast("ใบเสร็จนี้ถูกจองโดยผู้ตรวจสอบคนอื่นแล้ว ผลการตรวจสอบไม่ได้ถูกบันทึก")
+                elif duplicate_positions and st.session_state.get('apply_to_duplicates', True):
+                    recorded = record_duplicate_verdicts(store, receipts_data, duplicate_positions, cancelled=True)
+                    if recorded:
+                        st.toast(f"บันทึกผลให้ใบเสร็จที่ใช้รูปซ้ำกันอีก {recorded} รายการ")
                 
                 # Reset verification fields
-                st.session_state.verified_fields = {field: False for field in st.session_state.verified_fields}
-                
-                # Find next unverified receipt and update index
-                if len(st.session_state.verified_receipts) < len(receipts_data):
-                    unverified_receipts = receipts_data[~receipts_data['Source JSON File'].isin(st.session_state.verified_receipts)]
-                    if len(unverified_receipts) > 0:
-                        # Get the index of the first unverified receipt from the original dataframe
-                        next_receipt = unverified_receipts.iloc[0]['Source JSON File']
-                        next_index = receipts_data[receipts_data['Source JSON File'] == next_receipt].index[0]
-                        # แปลงเป็น Python int เพื่อป้องกันปัญหา numpy.int64
-                        st.session_state.current_index = int(next_index)
+                reset_verified_fields()
                 
                 st.rerun()
 
@@ -428,4 +591,7 @@ except Exception as e:
     3. ทำเครื่องหมายที่ช่องที่ข้อมูลถูกต้อง
     4. กด "Yes" เพื่อยืนยันหรือ "cancel" เพื่อยกเลิก
     5. กด "เริ่มต้นใหม่" เพื่อเคลียร์ผลลัพธ์และเริ่มตรวจสอบใหม่
-    """)
\ No newline at end of file
+    """)
+
+finally:
+    metrics.finish_rerun(reviewer=st.session_state.reviewer_id, position=st.session_state.current_position)
@@ -0,0 +1,1364 @@
+"""
+Benchmarks for the receipt review app.
+
+Usage:
+    python benchmark.py dataset [--rows N] [--repeat N]
+    python benchmark.py images [--sizes N,N,...] [--lookups N]
+    python benchmark.py reconcile [--sizes N,N,...] [--lookups N] [--workers N]
+    python benchmark.py previews [--count N]
+    python benchmark.py queue [--receipts N] [--reviewers N,N,...] [--think-ms MS]
+    python benchmark.py fields [--rows N]
+    python benchmark.py rerun [--clicks N] [--script app.py]
+    python benchmark.py triage [--rows N] [--extract PATH] [--db PATH]
+    python benchmark.py dedup [--sizes N,N,...] [--queries N] [--workers N]
+    python benchmark.py export [--rows N,N,...] [--verdicts N]
+    python benchmark.py coldstart [--rows N] [--arrival-ms MS,MS,...] [--repeat N]
+    python benchmark.py shards [--shards N] [--rows N] [--max-loaded N]
+    python benchmark.py remote [--count N] [--rtt-ms MS]
+    python benchmark.py upload [--rows N] [--images N] [--repeat N]
+    python benchmark.py generate [--rows N] [--images N] [--out DIR]
+    python benchmark.py workflow [--rows N,N,...] [--sessions N,N,...] [--actions N] [--think-ms MS]
+
+rerun, workflow and coldstart need websockets, the "bench" extra (uv sync --extra bench).
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import re
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import pandas as pd
+
+import utils
+from verification_store import VerificationStore
+
+SOURCE_WORKBOOK = os.path.join("data", "data_ocr_extract.xlsx")
+
+def _timed(func, repeat):
+    """Run func repeat times and return (median seconds, last result)."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+def _make_workbook(rows, directory):
+    """Write a workbook of the given size by repeating the sample extract."""
+    sample = pd.read_excel(SOURCE_WORKBOOK)
+    copies = -(-rows // len(sample))
+    df = pd.concat([sample] * copies, ignore_index=True).head(rows)
+    df['Source JSON File'] = [f"{i:08d} - {name}" for i, name in enumerate(df['Source JSON File'])]
+    path = os.path.join(directory, "data_ocr_extract.xlsx")
+    df.to_excel(path, index=False)
+    return path
+
+def bench_dataset(args):
+    """Cold (parse XLSX) vs warm (Parquet cache / in-process cache) dataset loads."""
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        excel_path = SOURCE_WORKBOOK
+        if args.rows:
+            excel_path = _make_workbook(args.rows, work_dir)
+        cache_dir = os.path.join(work_dir, "cache")
+
+        def cold():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            return utils.build_dataset_cache(excel_path, cache_dir)
+
+        cold_s, df = _timed(cold, args.repeat)
+        warm_disk_s, _ = _timed(lambda: utils.build_dataset_cache(excel_path, cache_dir), args.repeat)
+
+        utils._load_dataset.clear()
+        signature = utils._file_signature(excel_path)
+        utils._load_dataset(excel_path, *signature, cache_dir)
+        warm_memory_s, _ = _timed(
+            lambda: utils._load_dataset(excel_path, *utils._file_signature(excel_path), cache_dir), args.repeat)
+
+        print(f"rows: {len(df)}")
+        print(f"cold (read_excel + write parquet): {cold_s * 1000:10.2f} ms")
+        print(f"warm (parquet cache):              {warm_disk_s * 1000:10.2f} ms")
+        print(f"warm (in-process cache):           {warm_memory_s * 1000:10.2f} ms")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _legacy_partial_lookup(directory, base_filename):
+    """The original get_receipt_image partial match: one os.listdir per lookup."""
+    return tuple(
+        filename for filename in os.listdir(directory)
+        if filename.lower().endswith(('.jpg', '.jpeg', '.png')) and base_filename in filename
+    )
+
+def bench_images(args):
+    """Partial-match image lookup: os.listdir scan vs ReceiptImageIndex."""
+    rng = random.Random(0)
+    print(f"{'files':>8} {'listdir/lookup':>15} {'index build':>12} {'index/lookup':>13}")
+    for size in [int(value) for value in args.sizes.split(",")]:
+        work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+        try:
+            names = [f"{rng.getrandbits(100):032d} - Reviewer {i % 50}.jpg" for i in range(size)]
+            for name in names:
+                open(os.path.join(work_dir, name), "wb").close()
+            # Half the lookups hit an existing ID, half miss
+            bases = [name.split(" - ")[0] for name in rng.sample(names, min(args.lookups // 2, size))]
+            bases += [f"{rng.getrandbits(100):032d}" for _ in range(args.lookups - len(bases))]
+
+            start = time.perf_counter()
+            expected = [_legacy_partial_lookup(work_dir, base) for base in bases]
+            legacy_s = (time.perf_counter() - start) / len(bases)
+
+            index = utils.ReceiptImageIndex(work_dir)
+            start = time.perf_counter()
+            index.exact("")
+            build_s = time.perf_counter() - start
+            # Second pass measures the steady state the app sees on reruns
+            [index.partial_matches(base) for base in bases]
+            start = time.perf_counter()
+            actual = [index.partial_matches(base) for base in bases]
+            index_s = (time.perf_counter() - start) / len(bases)
+
+            assert [sorted(m) for m in actual] == [sorted(m) for m in expected], "index disagrees with listdir scan"
+            print(f"{size:>8} {legacy_s * 1000:>12.3f} ms {build_s * 1000:>9.2f} ms {index_s * 1e6:>10.2f} us")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def _legacy_missing_image(directory, json_filename, receipts_dir):
+    """What the first view of a receipt without an image used to cost: a partial scan, then a saved placeholder."""
+    base_filename = json_filename.split(' - ')[0]
+    if _legacy_partial_lookup(directory, base_filename):
+        return
+    from PIL import Image, ImageDraw
+
+    placeholder = Image.new('RGB', (600, 800), color=(245, 245, 245))
+    ImageDraw.Draw(placeholder).text((150, 350), f"ID: {base_filename}", fill=(0, 0, 0))
+    placeholder.save(os.path.join(receipts_dir, json_filename.replace('.json', '.jpg')))
+
+def bench_reconcile(args):
+    """Offline reconciliation time, and first-view image lookups with and without its manifest."""
+    import reconcile
+
+    rng = random.Random(0)
+    print(f"{'files':>8} {'reconcile':>10} {'legacy miss':>12} {'manifest hit':>13} {'manifest miss':>14}")
+    for size in [int(value) for value in args.sizes.split(",")]:
+        work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+        try:
+            raw_dir = os.path.join(work_dir, "raw")
+            receipts_dir = os.path.join(work_dir, "receipts")
+            os.makedirs(raw_dir)
+            os.makedirs(receipts_dir)
+            # 90% exact names, 5% images renamed after extraction (partial matches), 5% missing
+            json_files, names = [], []
+            for i in range(size):
+                json_file = f"{rng.getrandbits(100):032d} - Reviewer {i % 50}.json"
+                json_files.append(json_file)
+                roll = rng.random()
+                if roll < 0.9:
+                    names.append(json_file.replace('.json', '.jpg'))
+                elif roll < 0.95:
+                    names.append(json_file.split(' - ')[0] + " - renamed.jpg")
+            for name in names:
+                open(os.path.join(raw_dir, name), "wb").close()
+
+            start = time.perf_counter()
+            mapping = reconcile.match_images(json_files, reconcile.list_images(raw_dir), [], args.workers,
+                                             raw_dir, receipts_dir)
+            reconcile_s = time.perf_counter() - start
+            manifest_path = os.path.join(work_dir, "manifest.parquet")
+            reconcile.write_manifest(mapping, manifest_path, os.stat(raw_dir).st_mtime_ns)
+
+            missing = mapping.loc[mapping['match'] == 'missing', 'json_file'].tolist()[:args.lookups]
+            found = mapping.loc[mapping['match'] != 'missing', 'json_file'].tolist()[:args.lookups]
+            start = time.perf_counter()
+            for json_file in missing:
+                _legacy_missing_image(raw_dir, json_file, receipts_dir)
+            legacy_s = (time.perf_counter() - start) / len(missing)
+
+            manifest = utils.ImageManifest(manifest_path, raw_dir, receipts_dir)
+            manifest.lookup(found[0])
+            start = time.perf_counter()
+            assert all(manifest.lookup(json_file)[1] for json_file in found)
+            hit_s = (time.perf_counter() - start) / len(found)
+            # The legacy placeholders are uploads as far as the manifest can tell; clear them first
+            shutil.rmtree(receipts_dir)
+            start = time.perf_counter()
+            assert all(manifest.lookup(json_file)[0] == 'missing' for json_file in missing)
+            miss_s = (time.perf_counter() - start) / len(missing)
+            print(f"{size:>8} {reconcile_s:>8.2f} s {legacy_s * 1000:>9.2f} ms {hit_s * 1e6:>10.2f} us "
+                  f"{miss_s * 1e6:>11.2f} us")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def _streamlit_image_bytes(image):
+    """Bytes st.image sends for a PIL image (encode, then shrink to the content width)."""
+    from streamlit.elements.lib import image_utils
+    from streamlit.elements.lib.layout_utils import LayoutConfig
+
+    image_format = image_utils._validate_image_format_string(image, "auto")
+    data = image_utils._pil_to_bytes(image, format=image_format, quality=100)
+    return image_utils._ensure_image_size_and_format(data, LayoutConfig(width="content"), image_format)
+
+def bench_previews(args):
+    """Per page view: decode + rotate + encode of the original vs cached preview renditions."""
+    from PIL import Image
+
+    raw_dir = os.path.join("data", "receipts_raw")
+    names = sorted(os.listdir(raw_dir))[:args.count]
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        legacy_s = legacy_bytes = build_s = preview_s = preview_bytes = 0
+        for name in names:
+            path = os.path.join(raw_dir, name)
+
+            start = time.perf_counter()
+            image = Image.open(path)
+            if image.size[0] > image.size[1]:
+                image = image.rotate(270, expand=True)
+            # The page showed the image twice: zoom expander and main view
+            legacy_bytes += 2 * len(_streamlit_image_bytes(image))
+            legacy_s += time.perf_counter() - start
+
+            start = time.perf_counter()
+            utils.build_previews(path, work_dir)
+            build_s += time.perf_counter() - start
+
+            start = time.perf_counter()
+            paths = utils.build_previews(path, work_dir)
+            for rendition in paths.values():
+                with open(rendition, "rb") as f:
+                    preview_bytes += len(f.read())
+            preview_s += time.perf_counter() - start
+
+        count = len(names)
+        print(f"images: {count}")
+        print(f"original per view:       {legacy_s / count * 1000:8.1f} ms {legacy_bytes / count / 1024:8.0f} KB")
+        print(f"preview build (once):    {build_s / count * 1000:8.1f} ms")
+        print(f"preview per view (warm): {preview_s / count * 1000:8.1f} ms {preview_bytes / count / 1024:8.0f} KB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_queue(args):
+    """Simulated reviewers working through the leased queue in parallel."""
+    files = [f"{i:08d} - Reviewer.json" for i in range(args.receipts)]
+    print(f"{'reviewers':>9} {'seconds':>8} {'receipts/s':>11} {'duplicates':>11}")
+    for reviewers in [int(value) for value in args.reviewers.split(",")]:
+        work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+        try:
+            store = VerificationStore(os.path.join(work_dir, "verification.db"))
+            store.sync(files)
+            recorded = []
+            recorded_lock = threading.Lock()
+
+            def review(owner):
+                while True:
+                    batch = store.lease_batch(owner, args.batch)
+                    if not batch:
+                        return
+                    for json_file, _ in batch:
+                        # Time a person spends looking at the receipt
+                        time.sleep(args.think_ms / 1000)
+                        if store.record_verdict(json_file, {'tax_id': True}, reviewer=owner):
+                            with recorded_lock:
+                                recorded.append(json_file)
+
+            threads = [threading.Thread(target=review, args=(f"reviewer-{i}",)) for i in range(reviewers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            assert store.remaining() == 0 and len(set(recorded)) == len(files)
+            print(f"{reviewers:>9} {elapsed:>8.2f} {len(files) / elapsed:>11.1f} {len(recorded) - len(files):>11}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def _legacy_format_fields(receipt):
+    """The original per-row formatting the review page did on every rerun."""
+    def _text(column):
+        return receipt[column] if pd.notna(receipt[column]) else utils.MISSING_VALUE
+
+    date_value = utils.MISSING_VALUE
+    if pd.notna(receipt['Date']):
+        try:
+            if isinstance(receipt['Date'], str):
+                date_value = receipt['Date']
+            else:
+                date_value = receipt['Date'].strftime('%Y-%m-%d')
+        except Exception:
+            date_value = str(receipt['Date'])
+
+    total_amount_value = utils.MISSING_VALUE
+    if pd.notna(receipt['Total Amount']):
+        try:
+            total_amount_value = f"{float(receipt['Total Amount']):.2f}"
+        except Exception:
+            total_amount_value = str(receipt['Total Amount'])
+
+    return {
+        'tax_id': _text('Tax ID'),
+        'receipt_number': _text('Receipt Number'),
+        'date': date_value,
+        'time': _text('Time'),
+        'total_amount': total_amount_value,
+        'store_name': _text('Store name'),
+    }
+
+def bench_fields(args):
+    """Per-row field formatting vs the vectorized normalization pass."""
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        sample = utils.build_dataset_cache(SOURCE_WORKBOOK, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    df = pd.concat([sample] * -(-args.rows // len(sample)), ignore_index=True).head(args.rows)
+
+    start = time.perf_counter()
+    for position in range(len(df)):
+        _legacy_format_fields(df.iloc[position])
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fields = utils.ReceiptFields(df)
+    normalize_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for position in range(len(df)):
+        fields[position]
+    lookup_s = time.perf_counter() - start
+
+    print(f"rows: {len(df)}")
+    print(f"per-row formatting, all rows:   {legacy_s * 1000:10.1f} ms ({legacy_s / len(df) * 1e6:8.2f} us/row)")
+    print(f"vectorized normalization (once): {normalize_s * 1000:9.1f} ms ({normalize_s / len(df) * 1e6:8.2f} us/row)")
+    print(f"precomputed lookup:             {lookup_s * 1000:10.1f} ms ({lookup_s / len(df) * 1e6:8.2f} us/row)")
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+def _scratch_dir(work_dir, data_dir="data"):
+    """
+    Lay out a scratch app directory: the extract and raw images are
+    symlinked from data_dir; the verdict store, caches and receipts/ start
+    out empty, so a run doesn't touch real review progress.
+    """
+    os.makedirs(os.path.join(work_dir, "data"), exist_ok=True)
+    os.makedirs(os.path.join(work_dir, "receipts"), exist_ok=True)
+    for name in ("data_ocr_extract.xlsx", "receipts_raw"):
+        link = os.path.join(work_dir, "data", name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.abspath(os.path.join(data_dir, name)), link)
+
+def _serve(script, work_dir, data_dir="data", launcher=None):
+    """
+    Start the app in a streamlit server rooted at a scratch directory (see _scratch_dir).
+
+    Args:
+        launcher (str): Entry point taking streamlit options, e.g. serve.py,
+            instead of `streamlit run script`
+    """
+    _scratch_dir(work_dir, data_dir)
+    port = _free_port()
+    command = ([sys.executable, os.path.abspath(launcher)] if launcher
+               else [sys.executable, "-m", "streamlit", "run", os.path.abspath(script)])
+    server = subprocess.Popen(
+        command + ["--server.headless", "true", "--server.port", str(port), "--server.fileWatcherType", "none",
+                   "--browser.gatherUsageStats", "false"],
+        cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            urllib.request.urlopen(f"http://localhost:{port}/_stcore/health", timeout=1)
+            return server, port
+        except OSError:
+            if time.monotonic() > deadline or server.poll() is not None:
+                server.kill()
+                raise RuntimeError("streamlit server didn't start")
+            time.sleep(0.05)
+
+def _rss_bytes(pid):
+    """Resident set size of a process, from /proc."""
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class _BrowserSession:
+    """
+    Minimal stand-in for a browser tab: drives reruns over the websocket and
+    counts what the server sends back.
+
+    Image bytes are counted the first time a media URL appears, like a browser
+    cache would. The elements of the last full page run are kept in page.
+    """
+
+    def __init__(self, websocket, port):
+        self.websocket = websocket
+        self.port = port
+        self.widget_states = {}
+        self.seen_media = set()
+        self.page = []
+
+    def widgets(self, kind):
+        """(element, fragment id) pairs of one widget type on the current page."""
+        return [(element, fragment_id) for element, fragment_id in self.page if element.WhichOneof("type") == kind]
+
+    async def rerun(self, fragment_id="", once=()):
+        """
+        Send a rerun with the current widget states and wait until the page settles.
+
+        Args:
+            fragment_id (str): Rerun only this fragment
+            once (iterable): Widget states sent with this rerun only (button clicks, picks)
+
+        Returns:
+            tuple: (seconds, message bytes, image bytes, new elements)
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.page_script_hash = ""
+        message.rerun_script.widget_states.widgets.extend(self.widget_states.values())
+        message.rerun_script.widget_states.widgets.extend(once)
+        if fragment_id:
+            message.rerun_script.fragment_id = fragment_id
+
+        start = time.perf_counter()
+        await self.websocket.send(message.SerializeToString())
+        message_bytes, elements = 0, []
+        while True:
+            data = await self.websocket.recv()
+            message_bytes += len(data)
+            forward = ForwardMsg()
+            forward.ParseFromString(data)
+            if forward.WhichOneof("type") == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                elements.append((forward.delta.new_element, forward.delta.fragment_id))
+            elif forward.WhichOneof("type") == "script_finished":
+                status = forward.script_finished
+                if status == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                    # st.rerun(): the server starts the full run by itself
+                    elements = []
+                    continue
+                if status == ForwardMsg.FINISHED_SUCCESSFULLY:
+                    self.page = elements
+                break
+        elapsed = time.perf_counter() - start
+
+        media_bytes = 0
+        for element, _ in elements:
+            if element.WhichOneof("type") == "imgs":
+                for image in element.imgs.imgs:
+                    if image.url not in self.seen_media:
+                        self.seen_media.add(image.url)
+                        media_bytes += await asyncio.to_thread(self._fetch, image.url)
+        return elapsed, message_bytes, media_bytes, elements
+
+    def _fetch(self, url):
+        with urllib.request.urlopen(f"http://localhost:{self.port}{url}") as response:
+            return len(response.read())
+
+def bench_rerun(args):
+    """Wall time and bytes sent per verification checkbox click, measured against a live server."""
+    import websockets
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    async def clicks(port):
+        async with websockets.connect(f"ws://localhost:{port}/_stcore/stream", subprotocols=["streamlit"],
+                                      max_size=None) as websocket:
+            session = _BrowserSession(websocket, port)
+            elapsed, message_bytes, media_bytes, elements = await session.rerun()
+            print(f"initial page:   {elapsed * 1000:8.1f} ms {message_bytes / 1024:8.1f} KB messages "
+                  f"{media_bytes / 1024:8.1f} KB images {len(elements):4d} elements")
+            checkboxes = [(element.checkbox.id, fragment_id) for element, fragment_id in elements
+                          if element.WhichOneof("type") == "checkbox"]
+
+            results = []
+            for click in range(args.clicks):
+                widget_id, fragment_id = checkboxes[click % len(checkboxes)]
+                state = session.widget_states.get(widget_id) or WidgetState(id=widget_id, bool_value=False)
+                state.bool_value = not state.bool_value
+                session.widget_states[widget_id] = state
+                results.append(await session.rerun(fragment_id))
+
+            scope = "fragment" if checkboxes[0][1] else "full page"
+            print(f"per click ({scope}, median of {len(results)}):")
+            print(f"  wall time:    {statistics.median(r[0] for r in results) * 1000:8.1f} ms")
+            print(f"  messages:     {statistics.median(r[1] for r in results) / 1024:8.1f} KB")
+            print(f"  images:       {statistics.median(r[2] for r in results) / 1024:8.1f} KB")
+            print(f"  elements:     {statistics.median(len(r[3]) for r in results):8.0f}")
+
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    server = None
+    try:
+        server, port = _serve(args.script, work_dir)
+        asyncio.run(clicks(port))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Pools the synthetic extract draws from, shaped like the sample extract
+_SYNTHETIC_STORES = ["BIGC MARKET THE ONE BANGKOK", "Tonkatsu Wako One Bangkok", "DEAN & DELUCA", "Pradaday",
+                     "F.I.X. ONE BANGKOK", "CHONGDEE TEAHOUSE", "บริษัท คาเนโกะ ฮันโนะสึเกะ", "ร้านกาแฟบ้านสวน",
+                     "เซเว่น อีเลฟเว่น สาขาสีลม", "Brewing Happiness Co.,Ltd.", "Starbucks Central World",
+                     "ท็อปส์ มาร์เก็ต", "After You Dessert Cafe", "MK Restaurants"]
+
+_SYNTHETIC_REVIEWERS = ["Victor Lee", "Nok Srisuk", "Ploy Chaiya", "Ken Tanaka"]
+
+def _synthetic_row(index, rng):
+    """One extract row with the quirks of real extraction output: prefixes, gaps, mixed formats."""
+    # Real Tax IDs carry a check digit; misreads below break it
+    body = f"{rng.randrange(10**11, 10**12):012d}"
+    check = (11 - sum(int(digit) * weight for digit, weight in zip(body, range(13, 1, -1))) % 11) % 10
+    tax_id = body + str(check) if rng.random() > 0.1 else body + str((check + 1) % 10)
+    roll = rng.random()
+    if roll < 0.1:
+        tax_id = "TaxID: " + tax_id
+    elif roll < 0.2:
+        tax_id = tax_id[1:]
+    elif roll < 0.25:
+        tax_id = None
+    receipt_number = rng.choice([f"INV/{rng.randrange(10**8):08d}", f"#{rng.randrange(10**9)}",
+                                 f"No. {rng.randrange(10**6)}", f"Q{rng.randrange(100)}", None])
+    day = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    date = rng.choice([day, day + " 00:00:00", "/".join(reversed(day.split("-"))), None])
+    time_value = rng.choice([f"{rng.randint(7, 22):02d}:{rng.randrange(60):02d}",
+                             f"{rng.randint(7, 22):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}", None])
+    amount = round(rng.uniform(20, 5000), 2) if rng.random() > 0.05 else None
+    name = f"{rng.randrange(10**31, 10**32)}{index:06d} - {rng.choice(_SYNTHETIC_REVIEWERS)}.json"
+    return [name, tax_id, receipt_number, date, time_value, amount, rng.choice(_SYNTHETIC_STORES)]
+
+def _synthetic_workbook(rows, path, seed=0):
+    """
+    Write a synthetic extract workbook.
+
+    Returns:
+        list: The 'Source JSON File' names, in row order
+    """
+    from openpyxl import Workbook
+
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(['Source JSON File', 'Tax ID', 'Receipt Number', 'Date', 'Time', 'Total Amount', 'Store name'])
+    names = []
+    for index in range(rows):
+        row = _synthetic_row(index, rng)
+        names.append(row[0])
+        sheet.append(row)
+    workbook.save(path)
+    return names
+
+def _synthetic_images(names, unique, directory, seed=0):
+    """
+    Give every receipt a phone-photo-sized JPEG.
+
+    unique distinct images are written (roughly the sample's median size,
+    960x1706 and 200+ KB); the rest of the receipts are symlinked to them
+    round-robin so large datasets don't need gigabytes of disk.
+    """
+    import numpy as np
+    from PIL import Image, ImageDraw
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    originals = []
+    for index in range(min(unique, len(names))):
+        # Off-white paper with sensor noise, plus lines of "printed" text
+        paper = rng.normal(225, 18, (1706, 960, 3)).clip(0, 255).astype(np.uint8)
+        image = Image.fromarray(paper)
+        draw = ImageDraw.Draw(image)
+        for line in range(40):
+            text = " ".join(str(rng.integers(10**3, 10**8)) for _ in range(rng.integers(2, 6)))
+            draw.text((60 + int(rng.integers(0, 40)), 80 + line * 38), text, fill=(30, 30, 30))
+        path = os.path.join(directory, os.path.splitext(names[index])[0] + ".jpg")
+        image.save(path, format="JPEG", quality=90)
+        originals.append(path)
+    for index in range(len(originals), len(names)):
+        link = os.path.join(directory, os.path.splitext(names[index])[0] + ".jpg")
+        if not os.path.lexists(link):
+            os.symlink(os.path.basename(originals[index % len(originals)]), link)
+
+def generate_dataset(rows, images, out_dir, seed=0):
+    """Write data_ocr_extract.xlsx and receipts_raw/ for a synthetic dataset of the given size."""
+    os.makedirs(out_dir, exist_ok=True)
+    names = _synthetic_workbook(rows, os.path.join(out_dir, "data_ocr_extract.xlsx"), seed)
+    _synthetic_images(names, images, os.path.join(out_dir, "receipts_raw"), seed)
+    return out_dir
+
+def bench_generate(args):
+    """Write a synthetic dataset for running the app (or the workflow benchmark) against."""
+    start = time.perf_counter()
+    generate_dataset(args.rows, args.images, args.out, args.seed)
+    print(f"{args.rows} receipts ({args.images} distinct images) written to {args.out} "
+          f"in {time.perf_counter() - start:.1f}s")
+
+async def _review(session, actions, think, select_ratio, rng, timings):
+    """
+    One reviewer working through the queue: optionally pick a receipt from the
+    dropdown, tick a few fields, then press Yes (or, now and then, cancel).
+    """
+    from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+    def widget(kind, label=None):
+        for element, fragment_id in session.widgets(kind):
+            if label is None or getattr(element, kind).label == label:
+                return getattr(element, kind), fragment_id
+        return None, ""
+
+    for _ in range(actions):
+        # The receipt dropdown, not the shard selector shown above it for a sharded dataset
+        picker, fragment_id = widget("selectbox", "เลือกใบเสร็จที่ต้องการตรวจสอบ")
+        if picker is not None and picker.options and rng.random() < select_ratio:
+            await asyncio.sleep(think)
+            pick = WidgetState(id=picker.id, string_value=rng.choice(list(picker.options)))
+            timings["select"].append((await session.rerun(fragment_id, once=[pick]))[0])
+            session.widget_states.clear()
+
+        checkboxes = session.widgets("checkbox")
+        for element, fragment_id in rng.sample(checkboxes, min(len(checkboxes), rng.randint(0, 3))):
+            await asyncio.sleep(think)
+            session.widget_states[element.checkbox.id] = WidgetState(id=element.checkbox.id, bool_value=True)
+            timings["check"].append((await session.rerun(fragment_id))[0])
+
+        action = "yes" if rng.random() < 0.8 else "cancel"
+        button, _ = widget("button", "Yes" if action == "yes" else "cancel")
+        if button is None:
+            break
+        await asyncio.sleep(think)
+        timings[action].append((await session.rerun(once=[WidgetState(id=button.id, trigger_value=True)]))[0])
+        # The verdict resets the checkboxes, as a browser would see on the new page
+        session.widget_states.clear()
+        timings["verdicts"] += 1
+
+def bench_workflow(args):
+    """
+    p50/p99 latency of each review action, verdict throughput and server memory
+    per session, as the dataset and the number of concurrent reviewers grow.
+    """
+    import websockets
+
+    async def reviewers(port, count, server_pid):
+        timings = {"open": [], "select": [], "check": [], "yes": [], "cancel": [], "verdicts": 0}
+        async with contextlib.AsyncExitStack() as stack:
+            sessions = []
+            for _ in range(count):
+                websocket = await stack.enter_async_context(websockets.connect(
+                    f"ws://localhost:{port}/_stcore/stream", subprotocols=["streamlit"], max_size=None))
+                sessions.append(_BrowserSession(websocket, port))
+            opened = await asyncio.gather(*(session.rerun() for session in sessions))
+            timings["open"] = [result[0] for result in opened]
+            start = time.perf_counter()
+            await asyncio.gather(*(_review(session, args.actions, args.think_ms / 1000, args.select_ratio,
+                                           random.Random(index), timings)
+                                   for index, session in enumerate(sessions)))
+            elapsed = time.perf_counter() - start
+            # Measured while every session is still connected
+            return timings, elapsed, _rss_bytes(server_pid)
+
+    async def warm_up(port):
+        # Loads the dataset and fills the caches, so the memory baseline holds them
+        async with websockets.connect(f"ws://localhost:{port}/_stcore/stream", subprotocols=["streamlit"],
+                                      max_size=None) as websocket:
+            await _BrowserSession(websocket, port).rerun()
+
+    print(f"{'rows':>7} {'sessions':>8} {'action':>7} {'count':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    summary = []
+    data_root = tempfile.mkdtemp(prefix="receipt-bench-data-")
+    try:
+        for rows in [int(size) for size in args.rows.split(",")]:
+            data_dir = generate_dataset(rows, args.images, os.path.join(data_root, str(rows)))
+            for count in [int(size) for size in args.sessions.split(",")]:
+                # A fresh server, verdict store and dataset cache per run
+                work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+                server = None
+                try:
+                    server, port = _serve(args.script, work_dir, data_dir)
+                    # Twice: the first load's transient allocations are freed by the time the second ends
+                    asyncio.run(warm_up(port))
+                    asyncio.run(warm_up(port))
+                    baseline = _rss_bytes(server.pid)
+                    timings, elapsed, rss = asyncio.run(reviewers(port, count, server.pid))
+                finally:
+                    if server is not None:
+                        server.terminate()
+                        server.wait()
+                    shutil.rmtree(work_dir, ignore_errors=True)
+                for action in ("open", "select", "check", "yes", "cancel"):
+                    if timings[action]:
+                        print(f"{rows:7d} {count:8d} {action:>7} {len(timings[action]):6d} "
+                              f"{_percentile(timings[action], 0.5) * 1000:8.1f} "
+                              f"{_percentile(timings[action], 0.99) * 1000:8.1f}")
+                summary.append((rows, count, timings["verdicts"] / elapsed, rss, (rss - baseline) / count))
+    finally:
+        shutil.rmtree(data_root, ignore_errors=True)
+
+    print(f"\n{'rows':>7} {'sessions':>8} {'verdicts/s':>10} {'server MB':>10} {'MB/session':>10}")
+    for rows, count, throughput, rss, per_session in summary:
+        print(f"{rows:7d} {count:8d} {throughput:10.1f} {rss / 1024 / 1024:10.1f} {per_session / 1024 / 1024:10.2f}")
+
+def bench_triage(args):
+    """
+    Speed of the validation rules, the triage mix, and (given reviewed
+    verdicts) how many checkbox clicks pre-ticking saves per receipt.
+    """
+    import numpy as np
+
+    import validation
+
+    rng = random.Random(0)
+    df = pd.DataFrame([_synthetic_row(index, rng) for index in range(args.rows)],
+                      columns=['Source JSON File', 'Tax ID', 'Receipt Number', 'Date', 'Time', 'Total Amount',
+                               'Store name'])
+    fields = utils.ReceiptFields(df)
+    start = time.perf_counter()
+    triage = validation.ReceiptTriage(df, fields)
+    elapsed = time.perf_counter() - start
+    mix = np.bincount(triage.priority, minlength=3)
+    print(f"rows: {len(df)}, validation {elapsed * 1000:.1f} ms ({elapsed / len(df) * 1e6:.2f} us/row)")
+    print(f"triage: confirm {mix[validation.PRIORITY_CONFIRM]}, review {mix[validation.PRIORITY_REVIEW]}, "
+          f"skip {mix[validation.PRIORITY_SKIP]}")
+
+    if not os.path.exists(args.db):
+        return
+    sample = pd.read_excel(args.extract)
+    triage = validation.ReceiptTriage(sample, utils.ReceiptFields(sample))
+    verdicts = VerificationStore(args.db).verdicts_for(sample['Source JSON File'].astype(str).tolist())
+    verified = (verdicts['status'] == 1).to_numpy()
+    if not verified.any():
+        print(f"{args.db}: no verified receipts to compare against")
+        return
+    ticked = verdicts.loc[verified, triage.confidence.columns].fillna(0).to_numpy().astype(bool)
+    preticked = (triage.confidence.to_numpy() >= validation.PRETICK_CONFIDENCE)[verified]
+    print(f"{verified.sum()} verified receipts in {args.db}:")
+    print(f"  clicks per receipt, nothing pre-ticked: {ticked.sum(axis=1).mean():.2f}")
+    print(f"  clicks per receipt, pre-ticked:         {(ticked != preticked).sum(axis=1).mean():.2f}")
+    print(f"  pre-ticked fields kept ticked:          {(ticked & preticked).sum() / max(preticked.sum(), 1):.1%}")
+
+def bench_dedup(args):
+    """
+    Perceptual hashing throughput on the sample images, and near-duplicate
+    queries on the Hamming index against a brute-force scan.
+    """
+    import dedup
+
+    paths = [os.path.join(utils.RECEIPTS_RAW_DIR, name) for name in sorted(os.listdir(utils.RECEIPTS_RAW_DIR))
+             if name.lower().endswith(utils.IMAGE_EXTENSIONS)]
+    start = time.perf_counter()
+    for path in paths:
+        dedup.perceptual_hash(path)
+    serial_s = time.perf_counter() - start
+    cache_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        detector = dedup.DuplicateDetector(utils.RECEIPTS_RAW_DIR, cache_dir, workers=args.workers)
+        start = time.perf_counter()
+        detector.refresh()
+        pool_s = time.perf_counter() - start
+        start = time.perf_counter()
+        detector.refresh()
+        incremental_s = time.perf_counter() - start
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"hashing {len(paths)} images: {len(paths) / serial_s:.0f}/s serial, "
+          f"{len(paths) / pool_s:.0f}/s with {args.workers} workers, "
+          f"unchanged refresh {incremental_s * 1000:.1f} ms")
+
+    rng = random.Random(0)
+    bits = dedup.HASH_SIZE * dedup.HASH_SIZE
+    print(f"{'hashes':>8} {'build':>9} {'index query':>12} {'brute force':>12} {'add':>9}")
+    for size in [int(value) for value in args.sizes.split(",")]:
+        # Distinct photos, plus a resubmitted copy (a few bits flipped) of every tenth one
+        values = [rng.getrandbits(bits) for _ in range(size)]
+        for value in values[:size // 10]:
+            for bit in rng.sample(range(bits), rng.randint(0, dedup.DUPLICATE_DISTANCE)):
+                value ^= 1 << bit
+            values.append(value)
+        index = dedup.HammingIndex(bits)
+        start = time.perf_counter()
+        for key, value in enumerate(values[:size]):
+            index.add(key, value)
+        build_s = time.perf_counter() - start
+        queries = values[size:size + args.queries]
+        start = time.perf_counter()
+        found = [index.neighbours(value) for value in queries]
+        index_s = (time.perf_counter() - start) / len(queries)
+        start = time.perf_counter()
+        brute = [[key for key, other in enumerate(values[:size])
+                  if (other ^ value).bit_count() <= dedup.DUPLICATE_DISTANCE] for value in queries]
+        brute_s = (time.perf_counter() - start) / len(queries)
+        assert [sorted(key for key, _ in pairs) for pairs in found] == brute
+        start = time.perf_counter()
+        for key, value in enumerate(queries, start=size):
+            index.add(key, value)
+        add_s = (time.perf_counter() - start) / len(queries)
+        print(f"{size:>8} {build_s:>7.2f} s {index_s * 1e6:>9.1f} us {brute_s * 1000:>9.2f} ms "
+              f"{add_s * 1e6:>6.1f} us")
+
+def bench_export(args):
+    """
+    Verdict log append latency (batched vs per-verdict fsync vs rewriting a
+    results workbook per verdict), and compaction time and peak memory.
+    """
+    import export
+
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        print(f"{'fsync':>11} {'p50':>9} {'p99':>9}")
+        for label, fsync_records in (("batched", export.VERDICT_FSYNC_RECORDS), ("per verdict", 1)):
+            log = export.VerdictLog(os.path.join(work_dir, label), fsync_records=fsync_records)
+            timings = []
+            for index in range(args.verdicts):
+                start = time.perf_counter()
+                log.record_verdict(f"{index:08d}.json", 1, 6, [1] * 6, "bench", time.time())
+                timings.append(time.perf_counter() - start)
+            log.close()
+            print(f"{label:>11} {_percentile(timings, 0.5) * 1e6:>6.0f} us {_percentile(timings, 0.99) * 1e6:>6.0f} us")
+
+        print(f"{'rows':>8} {'xlsx rewrite':>13} {'compact':>9} {'peak RSS':>9}")
+        for rows in [int(value) for value in args.rows.split(",")]:
+            extract_path = os.path.join(work_dir, f"extract_{rows}.xlsx")
+            names = _synthetic_workbook(rows, extract_path)
+            # Half the receipts reviewed, a tenth of those twice, over several app processes
+            log_dir = os.path.join(work_dir, f"log_{rows}")
+            rng = random.Random(0)
+            reviewed = rng.sample(names, rows // 2)
+            for part in range(4):
+                log = export.VerdictLog(log_dir)
+                for name in reviewed[part::4] + reviewed[part:rows // 20:4]:
+                    checks = [int(rng.random() < 0.9) for _ in range(6)]
+                    log.record_verdict(name, 1, sum(checks), checks, f"reviewer{part}", time.time())
+                log.close()
+
+            # What the first version of an export would do on each click
+            start = time.perf_counter()
+            pd.read_excel(extract_path).to_excel(os.path.join(work_dir, "rewrite.xlsx"), index=False)
+            rewrite_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            process = subprocess.Popen([sys.executable, "export.py", "--log-dir", log_dir, "--extract", extract_path,
+                                        "--out", os.path.join(work_dir, f"out_{rows}")],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            peak = 0
+            while process.poll() is None:
+                with contextlib.suppress(OSError), open(f"/proc/{process.pid}/status") as f:
+                    peak = max([peak] + [int(line.split()[1]) * 1024 for line in f if line.startswith("VmHWM:")])
+                time.sleep(0.05)
+            compact_s = time.perf_counter() - start
+            assert process.returncode == 0
+            print(f"{rows:>8} {rewrite_s:>11.2f} s {compact_s:>7.2f} s {peak / 2**20:>6.0f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _peak_rss_bytes():
+    """High-water resident set size of this process, from /proc."""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def _review_single(extract_path, cache_dir):
+    """In a fresh process: what the app holds for one workbook with every batch in it."""
+    import dedup
+    import validation
+
+    baseline = _peak_rss_bytes()
+    start = time.perf_counter()
+    data = utils.build_dataset_cache(extract_path, cache_dir)
+    fields = utils.ReceiptFields(data)
+    derived = (utils.ReceiptSearchIndex(data), validation.ReceiptTriage(data, fields), dedup.ReceiptDuplicates(data))
+    open_s = time.perf_counter() - start
+    # Held together until the peak is read, as the app holds them
+    peak = _peak_rss_bytes()
+    del derived
+    return {'open_s': open_s, 'switch_s': [], 'baseline': baseline, 'peak': peak}
+
+def _review_sharded(manifest_path, cache_dir, db_path, max_loaded):
+    """In a fresh process: register the shards, then review them one after another (see shards.py)."""
+    import shards
+
+    baseline = _peak_rss_bytes()
+    catalog = shards.ShardCatalog(manifest_path, max_loaded=max_loaded, cache_dir=cache_dir)
+    catalog.refresh()
+    start = time.perf_counter()
+    catalog.register(VerificationStore(db_path))
+    register_s = time.perf_counter() - start
+    start = time.perf_counter()
+    catalog.load(catalog.shard_at(0).name)
+    open_s = time.perf_counter() - start
+    switch_s = []
+    for info in catalog.shards[1:]:
+        start = time.perf_counter()
+        catalog.load(catalog.shard_at(info.offset).name)
+        switch_s.append(time.perf_counter() - start)
+    return {'register_s': register_s, 'open_s': open_s, 'switch_s': switch_s, 'baseline': baseline,
+            'peak': _peak_rss_bytes()}
+
+def bench_shards(args):
+    """
+    Peak memory and load times of one workbook holding every batch vs the
+    same receipts as a shard manifest, reviewed shard by shard.
+    """
+    import json
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    def fresh(func, *func_args):
+        # A new process per run, so the peak RSS is that run's alone
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return executor.submit(func, *func_args).result()
+
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        entries = []
+        for index in range(args.shards):
+            extract_path = os.path.join(work_dir, f"batch{index}", "data_ocr_extract.xlsx")
+            os.makedirs(os.path.dirname(extract_path))
+            _synthetic_workbook(args.rows, extract_path, seed=index)
+            entries.append({'name': f"batch{index}", 'extract': extract_path})
+        manifest_path = os.path.join(work_dir, "shards.json")
+        with open(manifest_path, "w") as f:
+            json.dump({'shards': entries}, f)
+        single_path = os.path.join(work_dir, "data_ocr_extract.xlsx")
+        pd.concat([pd.read_excel(entry['extract']) for entry in entries]).to_excel(single_path, index=False)
+
+        cache_dir, db_path = os.path.join(work_dir, "cache"), os.path.join(work_dir, "verification.db")
+        runs = [("single workbook", "cold", fresh(_review_single, single_path, cache_dir)),
+                ("single workbook", "warm", fresh(_review_single, single_path, cache_dir))]
+        runs += [(f"shards (max {args.max_loaded})", "cold",
+                  fresh(_review_sharded, manifest_path, cache_dir, db_path, args.max_loaded)),
+                 (f"shards (max {args.max_loaded})", "warm",
+                  fresh(_review_sharded, manifest_path, cache_dir, db_path, args.max_loaded))]
+
+        print(f"{args.shards} batches of {args.rows} receipts")
+        print(f"{'layout':>16} {'caches':>6} {'register':>9} {'first page':>11} {'switch p50':>11} {'peak RSS':>9} "
+              f"{'over imports':>12}")
+        for layout, caches, run in runs:
+            register = f"{run['register_s']:>7.2f} s" if 'register_s' in run else f"{'-':>9}"
+            switch = f"{statistics.median(run['switch_s']) * 1000:>8.0f} ms" if run['switch_s'] else f"{'-':>11}"
+            print(f"{layout:>16} {caches:>6} {register} {run['open_s'] * 1000:>8.0f} ms {switch} "
+                  f"{run['peak'] / 2**20:>6.0f} MB {(run['peak'] - run['baseline']) / 2**20:>9.0f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def _image_server(directory, rtt_s):
+    """
+    Stand-in for an object store: serves directory over HTTP/1.1 keep-alive
+    with ETags, answering If-None-Match with 304. Every new connection and
+    every request waits rtt_s first, as if the store were across a network.
+
+    Returns:
+        ThreadingHTTPServer: Already serving, on a background thread; counts
+        its connections and requests in .connections and .requests
+    """
+    import hashlib
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import unquote
+
+    etags = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            # TCP (and TLS) handshake
+            time.sleep(rtt_s)
+            with lock:
+                server.connections += 1
+            super().setup()
+
+        def do_GET(self):
+            time.sleep(rtt_s)
+            with lock:
+                server.requests += 1
+            path = os.path.join(directory, unquote(self.path.lstrip("/")))
+            if not os.path.isfile(path):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            with lock:
+                if path not in etags:
+                    with open(path, "rb") as f:
+                        etags[path] = f'"{hashlib.sha1(f.read()).hexdigest()}"'
+                etag = etags[path]
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.connections = server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench_remote(args):
+    """
+    Receipt images from an HTTP object store (a local stand-in with a
+    simulated round trip): unpooled downloads vs the pooled, cached source,
+    cold and warm, plus ETag revalidation and the disk budget.
+    """
+    import requests
+
+    from image_sources import HttpImageSource, REMOTE_POOL_SIZE
+
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    server = None
+    try:
+        store_dir = os.path.join(work_dir, "store")
+        json_files = [f"{index:06d} - receipt.json" for index in range(args.count)]
+        _synthetic_images(json_files, args.count, store_dir)
+        names = [json_file.replace(".json", ".jpg") for json_file in json_files]
+        originals = {}
+        for name in names:
+            with open(os.path.join(store_dir, name), "rb") as f:
+                originals[name] = f.read()
+
+        server = _image_server(store_dir, args.rtt_ms / 1000)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+        rows = []
+
+        def measure(label, func):
+            connections, requests_before = server.connections, server.requests
+            start = time.perf_counter()
+            result = func()
+            seconds = time.perf_counter() - start
+            rows.append((label, seconds, server.connections - connections, server.requests - requests_before))
+            return result
+
+        def unpooled():
+            for name in names:
+                response = requests.get(base_url + name, timeout=30)
+                assert response.content == originals[name]
+
+        def check(paths):
+            for name, path in paths.items():
+                with open(path, "rb") as f:
+                    assert f.read() == originals[name.replace(".json", ".jpg")], name
+
+        measure("unpooled requests.get", unpooled)
+        sequential = HttpImageSource(base_url, os.path.join(work_dir, "sequential"))
+        check(measure("pooled, cold", lambda: {name: sequential.fetch(name) for name in names}))
+        source = HttpImageSource(base_url, os.path.join(work_dir, "cache"))
+        check(measure(f"pooled x{REMOTE_POOL_SIZE}, cold",
+                      lambda: source.fetch_many(json_files)))
+        check(measure("cache hit", lambda: {name: source.fetch(name) for name in names}))
+        # A restarted process finds the cache on disk and revalidates it
+        revalidating = HttpImageSource(base_url, os.path.join(work_dir, "cache"), revalidate_seconds=0)
+        check(measure("revalidate (304)", lambda: {name: revalidating.fetch(name) for name in names}))
+        assert revalidating.stats()['not_modified'] == len(names) and revalidating.stats()['downloads'] == 0
+
+        budget = sum(len(data) for data in originals.values()) // 4
+        bounded = HttpImageSource(base_url, os.path.join(work_dir, "bounded"), max_bytes=budget)
+        bounded.fetch_many(json_files)
+        on_disk = sum(os.path.getsize(os.path.join(bounded.cache_dir, filename))
+                      for filename in os.listdir(bounded.cache_dir) if not filename.endswith(".etag"))
+        assert on_disk <= budget, (on_disk, budget)
+
+        print(f"{len(names)} images of {statistics.median(map(len, originals.values())) / 1024:.0f} KB, "
+              f"{args.rtt_ms:g} ms round trip")
+        print(f"{'fetch':>22} {'total':>9} {'per image':>10} {'connections':>11} {'requests':>8}")
+        for label, seconds, connections, request_count in rows:
+            print(f"{label:>22} {seconds * 1000:>6.0f} ms {seconds / len(names) * 1000:>7.1f} ms "
+                  f"{connections:>11} {request_count:>8}")
+        print(f"budget {budget / 2**20:.1f} MB: {on_disk / 2**20:.1f} MB on disk after fetching "
+              f"{sum(map(len, originals.values())) / 2**20:.1f} MB, {bounded.stats()['evictions']} evicted")
+    finally:
+        if server is not None:
+            server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_upload(args):
+    """
+    Extract data uploaded on the page: the old path (copy the upload into a
+    temporary file and parse it on every rerun) vs the upload pipeline
+    (stream it to disk and parse it once in the background), per format,
+    plus extracting a ZIP archive of images.
+    """
+    import io
+    import zipfile
+
+    import uploads
+    from streamlit.runtime.uploaded_file_manager import UploadedFile, UploadedFileRec
+
+    def uploaded(name, data):
+        return UploadedFile(UploadedFileRec(name, name, "application/octet-stream", data), None)
+
+    def legacy(data):
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
+            tmp_file.write(uploaded("data_ocr_extract.xlsx", data).getvalue())
+            temp_path = tmp_file.name
+        try:
+            return pd.read_excel(temp_path)
+        finally:
+            os.unlink(temp_path)
+
+    def wait(job):
+        updates = set()
+        while not job.done:
+            updates.add(job.progress)
+            time.sleep(0.001)
+        assert job.state == 'done', job.error
+        return len(updates)
+
+    work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+    try:
+        workbook_path = os.path.join(work_dir, "data_ocr_extract.xlsx")
+        _synthetic_workbook(args.rows, workbook_path)
+        sample = pd.read_excel(workbook_path)
+        with open(workbook_path, "rb") as f:
+            files = {'xlsx': f.read(), 'csv': sample.to_csv(index=False).encode()}
+        buffer = io.BytesIO()
+        utils._to_columnar(sample).to_parquet(buffer, index=False)
+        files['parquet'] = buffer.getvalue()
+
+        rerun_s, _ = _timed(lambda: legacy(files['xlsx']), args.repeat)
+        print(f"{args.rows} receipts; old upload path (XLSX only): {rerun_s * 1000:.0f} ms on every rerun")
+        print(f"{'format':>8} {'size':>8} {'stream':>9} {'parse':>9} {'updates':>7} {'again':>8} {'restart':>8}")
+        for kind, data in files.items():
+            manager = uploads.UploadManager(os.path.join(work_dir, "uploads"),
+                                            os.path.join(work_dir, "uploads", "dataset.parquet"))
+            start = time.perf_counter()
+            path, digest = manager.save(uploaded(f"extract.{kind}", data))
+            stream_s = time.perf_counter() - start
+            start = time.perf_counter()
+            updates = wait(manager.submit(path, digest, f"extract.{kind}"))
+            parse_s = time.perf_counter() - start
+            df = pd.read_parquet(manager.dataset_path)
+            assert len(df) == args.rows and list(df.columns) == list(sample.columns), kind
+
+            # The same file again (another session or a re-upload), and a new process reading the result
+            start = time.perf_counter()
+            path, digest = manager.save(uploaded(f"extract.{kind}", data))
+            assert manager.submit(path, digest, f"extract.{kind}").done
+            again_s = time.perf_counter() - start
+            restart_s, _ = _timed(lambda: utils._compact_dtypes(pd.read_parquet(manager.dataset_path)), args.repeat)
+            print(f"{kind:>8} {len(data) / 2**20:>5.1f} MB {stream_s * 1000:>6.1f} ms {parse_s * 1000:>6.0f} ms "
+                  f"{updates:>7} {again_s * 1000:>5.1f} ms {restart_s * 1000:>5.1f} ms")
+
+        names = [f"{index:06d} - receipt.json" for index in range(args.images)]
+        _synthetic_images(names, args.images, os.path.join(work_dir, "images"))
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name in sorted(os.listdir(os.path.join(work_dir, "images"))):
+                archive.write(os.path.join(work_dir, "images", name), os.path.join("receipts", name))
+        manager = uploads.UploadManager(os.path.join(work_dir, "uploads"))
+        image_dir = os.path.join(work_dir, "extracted")
+        start = time.perf_counter()
+        path, digest = manager.save(uploaded("receipts.zip", buffer.getvalue()))
+        updates = wait(manager.submit(path, digest, "receipts.zip", image_dir))
+        extract_s = time.perf_counter() - start
+        assert len(os.listdir(image_dir)) == args.images
+        assert all(utils.get_image_index(image_dir).exact(name.replace(".json", ".jpg")) for name in names)
+        print(f"ZIP of {args.images} images ({len(buffer.getvalue()) / 2**20:.1f} MB): streamed and extracted in "
+              f"{extract_s * 1000:.0f} ms, {updates} progress updates")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def bench_coldstart(args):
+    """
+    Time to the first interactive page on a fresh process, for `streamlit run
+    app.py` and for serve.py, with empty disk caches and with the dataset and
+    preview caches already on disk (left by the build step's
+    `serve.py --warm-only`, or an earlier process).
+
+    The visitor arrives arrival-ms after the server answers: 0 is the
+    request that woke the deployment; more stands for a browser still
+    downloading and running the page's JavaScript, which this stand-in (it
+    only fetches the page shell and its assets) doesn't spend itself.
+    """
+    import websockets
+    from concurrent.futures import ThreadPoolExecutor
+
+    def page_shell(port):
+        # What a browser fetches before it opens the websocket, six requests at a time
+        with urllib.request.urlopen(f"http://localhost:{port}/") as response:
+            html = response.read().decode()
+        urls = [f"http://localhost:{port}/{path}" for path in re.findall(r'(?:src|href)="\./([^"]+)"', html)]
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            list(executor.map(lambda url: urllib.request.urlopen(url).read(), urls))
+
+    async def first_page(port):
+        await asyncio.to_thread(page_shell, port)
+        async with websockets.connect(f"ws://localhost:{port}/_stcore/stream", subprotocols=["streamlit"],
+                                      max_size=None) as websocket:
+            await _BrowserSession(websocket, port).rerun()
+
+    data_root = tempfile.mkdtemp(prefix="receipt-bench-data-")
+    try:
+        data_dir = generate_dataset(args.rows, args.images, data_root) if args.rows else "data"
+        print(f"{'launcher':>14} {'disk caches':>11} {'arrival ms':>10} {'server up ms':>12} {'page ms':>8} "
+              f"{'interactive ms':>14}")
+        for arrival in [float(ms) / 1000 for ms in args.arrival_ms.split(",")]:
+            for disk_caches in (False, True):
+                for name, launcher in (("streamlit run", None), ("serve.py", args.launcher)):
+                    results = []
+                    for _ in range(args.repeat):
+                        work_dir = tempfile.mkdtemp(prefix="receipt-bench-")
+                        server = None
+                        try:
+                            if disk_caches:
+                                _scratch_dir(work_dir, data_dir)
+                                subprocess.run([sys.executable, os.path.abspath(args.launcher), "--warm-only"],
+                                               cwd=work_dir, check=True, capture_output=True)
+                            start = time.perf_counter()
+                            server, port = _serve(args.script, work_dir, data_dir, launcher)
+                            up = time.perf_counter() - start
+                            time.sleep(arrival)
+                            visit = time.perf_counter()
+                            asyncio.run(first_page(port))
+                            done = time.perf_counter()
+                            results.append((up, done - visit, done - start))
+                        finally:
+                            if server is not None:
+                                server.terminate()
+                                server.wait()
+                            shutil.rmtree(work_dir, ignore_errors=True)
+                    up, page, total = (statistics.median(r[column] for r in results) for column in range(3))
+                    print(f"{name:>14} {'yes' if disk_caches else 'no':>11} {arrival * 1000:10.0f} {up * 1000:12.0f} "
+                          f"{page * 1000:8.0f} {total * 1000:14.0f}")
+    finally:
+        shutil.rmtree(data_root, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    dataset_parser = subparsers.add_parser("dataset", help="cold vs warm dataset load")
+    dataset_parser.add_argument("--rows", type=int, default=0, help="synthetic workbook size (default: sample workbook)")
+    dataset_parser.add_argument("--repeat", type=int, default=3)
+    dataset_parser.set_defaults(func=bench_dataset)
+
+    images_parser = subparsers.add_parser("images", help="receipt image lookup scaling")
+    images_parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated directory sizes")
+    images_parser.add_argument("--lookups", type=int, default=200)
+    images_parser.set_defaults(func=bench_images)
+
+    reconcile_parser = subparsers.add_parser("reconcile", help="offline image reconciliation vs first-view lookups")
+    reconcile_parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated receipt counts")
+    reconcile_parser.add_argument("--lookups", type=int, default=200)
+    reconcile_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    reconcile_parser.set_defaults(func=bench_reconcile)
+
+    previews_parser = subparsers.add_parser("previews", help="original image vs preview renditions per page view")
+    previews_parser.add_argument("--count", type=int, default=20, help="number of sample images")
+    previews_parser.set_defaults(func=bench_previews)
+
+    queue_parser = subparsers.add_parser("queue", help="multi-reviewer leasing throughput")
+    queue_parser.add_argument("--receipts", type=int, default=400)
+    queue_parser.add_argument("--reviewers", default="1,2,4,8,16", help="comma-separated reviewer counts")
+    queue_parser.add_argument("--batch", type=int, default=5, help="receipts leased per batch")
+    queue_parser.add_argument("--think-ms", type=float, default=20, help="simulated review time per receipt")
+    queue_parser.set_defaults(func=bench_queue)
+
+    fields_parser = subparsers.add_parser("fields", help="per-row vs vectorized field formatting")
+    fields_parser.add_argument("--rows", type=int, default=100000)
+    fields_parser.set_defaults(func=bench_fields)
+
+    rerun_parser = subparsers.add_parser("rerun", help="rerun cost of a checkbox click on a live server")
+    rerun_parser.add_argument("--clicks", type=int, default=12)
+    rerun_parser.add_argument("--script", default="app.py", help="app script to serve")
+    rerun_parser.set_defaults(func=bench_rerun)
+
+    triage_parser = subparsers.add_parser("triage", help="validation rule speed and pre-ticking clicks saved")
+    triage_parser.add_argument("--rows", type=int, default=100000)
+    triage_parser.add_argument("--extract", default=SOURCE_WORKBOOK, help="extract the verdicts belong to")
+    triage_parser.add_argument("--db", default=os.path.join("data", "verification.db"), help="reviewed verdicts")
+    triage_parser.set_defaults(func=bench_triage)
+
+    dedup_parser = subparsers.add_parser("dedup", help="perceptual hashing and duplicate search speed")
+    dedup_parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated indexed hash counts")
+    dedup_parser.add_argument("--queries", type=int, default=100)
+    dedup_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    dedup_parser.set_defaults(func=bench_dedup)
+
+    export_parser = subparsers.add_parser("export", help="verdict log appends and compaction")
+    export_parser.add_argument("--rows", default="1000,10000,100000", help="comma-separated extract sizes")
+    export_parser.add_argument("--verdicts", type=int, default=2000, help="appends timed per fsync mode")
+    export_parser.set_defaults(func=bench_export)
+
+    coldstart_parser = subparsers.add_parser("coldstart", help="time to first page on a fresh server process")
+    coldstart_parser.add_argument("--rows", type=int, default=0, help="synthetic dataset size (default: sample data)")
+    coldstart_parser.add_argument("--images", type=int, default=50, help="distinct synthetic images")
+    coldstart_parser.add_argument("--arrival-ms", default="0,1000",
+                                  help="comma-separated delays between server up and the visitor's first request")
+    coldstart_parser.add_argument("--repeat", type=int, default=3)
+    coldstart_parser.add_argument("--script", default="app.py", help="app script `streamlit run` serves")
+    coldstart_parser.add_argument("--launcher", default="serve.py", help="warming entry point to compare")
+    coldstart_parser.set_defaults(func=bench_coldstart)
+
+    shards_parser = subparsers.add_parser("shards", help="one workbook vs a shard manifest: memory and load times")
+    shards_parser.add_argument("--shards", type=int, default=4, help="number of batches")
+    shards_parser.add_argument("--rows", type=int, default=25000, help="receipts per batch")
+    shards_parser.add_argument("--max-loaded", type=int, default=2, help="shards held in memory at once")
+    shards_parser.set_defaults(func=bench_shards)
+
+    remote_parser = subparsers.add_parser("remote", help="images from an HTTP store: pooling, disk cache, ETags")
+    remote_parser.add_argument("--count", type=int, default=40, help="distinct images in the store")
+    remote_parser.add_argument("--rtt-ms", type=float, default=20, help="simulated network round trip")
+    remote_parser.set_defaults(func=bench_remote)
+
+    upload_parser = subparsers.add_parser("upload", help="uploaded extract data and image archives")
+    upload_parser.add_argument("--rows", type=int, default=50000)
+    upload_parser.add_argument("--images", type=int, default=50, help="images in the archive")
+    upload_parser.add_argument("--repeat", type=int, default=3)
+    upload_parser.set_defaults(func=bench_upload)
+
+    generate_parser = subparsers.add_parser("generate", help="write a synthetic dataset")
+    generate_parser.add_argument("--rows", type=int, default=10000)
+    generate_parser.add_argument("--images", type=int, default=50, help="distinct images (the rest are symlinks)")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.add_argument("--out", default=os.path.join("data", "synthetic"))
+    generate_parser.set_defaults(func=bench_generate)
+
+    workflow_parser = subparsers.add_parser("workflow", help="concurrent reviewers driving a live server")
+    workflow_parser.add_argument("--rows", default="1000,10000,100000", help="comma-separated dataset sizes")
+    workflow_parser.add_argument("--sessions", default="1,10,50", help="comma-separated concurrent reviewer counts")
+    workflow_parser.add_argument("--actions", type=int, default=10, help="receipts each reviewer reviews")
+    workflow_parser.add_argument("--think-ms", type=float, default=200, help="pause before each click")
+    workflow_parser.add_argument("--select-ratio", type=float, default=0.3,
+                                 help="share of receipts picked from the dropdown first")
+    workflow_parser.add_argument("--images", type=int, default=50, help="distinct synthetic images")
+    workflow_parser.add_argument("--script", default="app.py", help="app script to serve")
+    workflow_parser.set_defaults(func=bench_workflow)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""
+Duplicate receipt photos, found by perceptual hashing.
+
+Every image in data/receipts_raw gets a 256-bit difference hash (dHash) of
+its orientation-normalized, downscaled grey levels. Re-encoded, resized or
+re-shared copies of a photo stay within a few bits of each other, while
+different receipts, even from the same till, differ in about 50. Images
+within DUPLICATE_DISTANCE bits are grouped into clusters, and receipts whose
+images fall in the same cluster are written out as duplicates for the review
+page, which can then record one verdict for the whole cluster.
+
+Hashing runs in a process pool for large batches. Hashes are checkpointed by
+file size and mtime, so a refresh (or a restart) only hashes new or changed
+images, and the near-neighbour index is updated in place.
+
+Usage:
+    python dedup.py [--image-dir data/receipts_raw] [--cache-dir data/.cache/phash]
+                    [--extract data/data_ocr_extract.xlsx] [--distance N]
+                    [--workers N] [--watch SECONDS]
+"""
+import argparse
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import (normalize_orientation, _file_signature, IMAGE_EXTENSIONS, IMAGE_MANIFEST_PATH, RECEIPTS_DIR,
+                   RECEIPTS_RAW_DIR, DATASET_CACHE_DIR)
+
+# Side of the grey-level grid the hash is taken from; the hash has HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+
+# Images at most this many bits apart are the same photo
+DUPLICATE_DISTANCE = 16
+
+PHASH_CACHE_DIR = os.path.join(DATASET_CACHE_DIR, "phash")
+
+# Receipt -> duplicate cluster, read by the review page
+DUPLICATES_PATH = os.path.join(DATASET_CACHE_DIR, "duplicates.parquet")
+
+# Batches at least this large are hashed in a process pool
+DEDUP_PARALLEL_THRESHOLD = 200
+
+DEDUP_WORKERS = os.cpu_count() or 1
+
+def perceptual_hash(path, size=HASH_SIZE):
+    """
+    Difference hash of an image: one bit per horizontally adjacent pixel
+    pair of a size x (size + 1) grey-level thumbnail, set where brightness increases.
+
+    The image is first put upright the way the review page shows it (EXIF
+    orientation, landscape turned portrait), so rotated copies hash alike.
+
+    Returns:
+        int: The size ** 2-bit hash
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        # JPEG draft mode decodes straight to a small scale; the hash needs very few pixels
+        image.draft('L', (size * 8, size * 8))
+        image = normalize_orientation(image)
+        pixels = np.asarray(image.convert('L').resize((size + 1, size), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+def _hash_file(path):
+    """(hash as hex, None) or (None, error) for one image (runs in a worker)."""
+    try:
+        return f"{perceptual_hash(path):0{HASH_SIZE * HASH_SIZE // 4}x}", None
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+
+class HammingIndex:
+    """
+    Near-neighbour index of fixed-width hashes under Hamming distance, with
+    clusters of everything within max_distance of each other.
+
+    Multi-index hashing: each hash is split into max_distance + 1 bands and
+    filed under every band's value. Two hashes at most max_distance apart
+    must agree on at least one whole band (pigeonhole), so a query only
+    compares against hashes sharing a band with it rather than all of them.
+    Clusters are kept in a union-find as hashes are added.
+    """
+
+    def __init__(self, bits=HASH_SIZE * HASH_SIZE, max_distance=DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        edges = [round(band * bits / band_count) for band in range(band_count + 1)]
+        self._bands = [(start, (1 << (end - start)) - 1) for start, end in zip(edges, edges[1:])]
+        self._buckets = [{} for _ in self._bands]
+        self._hashes = {}
+        self._parent = {}
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def neighbours(self, value):
+        """
+        Keys of the indexed hashes within max_distance of value.
+
+        Returns:
+            list: (key, distance) pairs
+        """
+        candidates = set()
+        for (start, mask), buckets in zip(self._bands, self._buckets):
+            candidates.update(buckets.get((value >> start) & mask, ()))
+        found = []
+        for key in candidates:
+            distance = (self._hashes[key] ^ value).bit_count()
+            if distance <= self.max_distance:
+                found.append((key, distance))
+        return found
+
+    def add(self, key, value):
+        """
+        Index a hash and merge its cluster with those of its neighbours.
+
+        A key that is already indexed keeps its first hash (see
+        DuplicateDetector for changed images).
+
+        Returns:
+            list: Keys of the neighbours found
+        """
+        if key in self._hashes:
+            return []
+        neighbours = [neighbour for neighbour, _ in self.neighbours(value)]
+        self._hashes[key] = value
+        self._parent[key] = key
+        for (start, mask), buckets in zip(self._bands, self._buckets):
+            buckets.setdefault((value >> start) & mask, []).append(key)
+        for neighbour in neighbours:
+            self._union(key, neighbour)
+        return neighbours
+
+    def _find(self, key):
+        root = key
+        while self._parent[root] != root:
+            root = self._parent[root]
+        # Path compression
+        while self._parent[key] != root:
+            self._parent[key], key = root, self._parent[key]
+        return root
+
+    def _union(self, first, second):
+        first, second = self._find(first), self._find(second)
+        if first != second:
+            # Smallest key as the root, so cluster ids don't depend on insertion order
+            first, second = sorted((first, second))
+            self._parent[second] = first
+
+    def cluster(self, key):
+        """The cluster root (its smallest key) of an indexed key."""
+        return self._find(key)
+
+    def clusters(self):
+        """
+        Returns:
+            dict: Cluster root -> keys, for clusters of two or more
+        """
+        groups = {}
+        for key in self._hashes:
+            groups.setdefault(self._find(key), []).append(key)
+        return {root: sorted(keys) for root, keys in groups.items() if len(keys) > 1}
+
+class DuplicateDetector:
+    """
+    Perceptual hashes of an image directory, kept up to date incrementally.
+
+    refresh() hashes only images added or changed since the last one (by
+    size and mtime) and adds them to the index; the hashes are checkpointed
+    in cache_dir so a restart doesn't re-hash anything. An image that is
+    changed or removed rebuilds the index from the stored hashes, since a
+    union-find can't split clusters.
+    """
+
+    def __init__(self, image_dir=RECEIPTS_RAW_DIR, cache_dir=PHASH_CACHE_DIR, max_distance=DUPLICATE_DISTANCE,
+                 workers=DEDUP_WORKERS):
+        self.image_dir = image_dir
+        self.cache_dir = cache_dir
+        self.max_distance = max_distance
+        self.workers = workers
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._seen = {}
+        self.index = HammingIndex(max_distance=max_distance)
+        self._load_checkpoint()
+
+    def _checkpoint_path(self):
+        return os.path.join(self.cache_dir, "hashes.parquet")
+
+    def _load_checkpoint(self):
+        try:
+            rows = pd.read_parquet(self._checkpoint_path())
+        except FileNotFoundError:
+            return
+        for name, size, mtime_ns, value, error in zip(rows['image'], rows['_size'], rows['_mtime_ns'],
+                                                      rows['hash'], rows['_error']):
+            self._seen[name] = (int(size), int(mtime_ns))
+            if pd.isna(error):
+                self._hashes[name] = int(value, 16)
+            else:
+                self.errors[name] = error
+        for name in sorted(self._hashes):
+            self.index.add(name, self._hashes[name])
+
+    def _write_checkpoint(self):
+        names = sorted(self._seen)
+        width = HASH_SIZE * HASH_SIZE // 4
+        rows = pd.DataFrame({
+            'image': names,
+            '_size': [self._seen[name][0] for name in names],
+            '_mtime_ns': [self._seen[name][1] for name in names],
+            'hash': [f"{self._hashes[name]:0{width}x}" if name in self._hashes else None for name in names],
+            '_error': [self.errors.get(name) for name in names],
+        })
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self._checkpoint_path()}.{os.getpid()}.tmp"
+        rows.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, self._checkpoint_path())
+
+    def _hash(self, paths):
+        if len(paths) < DEDUP_PARALLEL_THRESHOLD or self.workers <= 1:
+            return [_hash_file(path) for path in paths]
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        # Spawned, not forked, like the JSON ingest pool
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(_hash_file, paths, chunksize=chunksize))
+
+    def refresh(self):
+        """
+        Hash new and changed images, drop removed ones, and update the clusters.
+
+        Returns:
+            int: Number of images hashed or removed (0 if the clusters are unchanged)
+        """
+        with self._lock:
+            current = {}
+            try:
+                with os.scandir(self.image_dir) as entries:
+                    for entry in entries:
+                        if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                            stat = entry.stat()
+                            current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+            pending = sorted(name for name, signature in current.items() if self._seen.get(name) != signature)
+            gone = set(self._seen) - set(current)
+            if not pending and not gone:
+                return 0
+
+            rebuild = bool(gone) or any(name in self._seen for name in pending)
+            for name in gone:
+                self._seen.pop(name)
+                self._hashes.pop(name, None)
+                self.errors.pop(name, None)
+            results = self._hash([os.path.join(self.image_dir, name) for name in pending])
+            for name, (value, error) in zip(pending, results):
+                self._seen[name] = current[name]
+                self._hashes.pop(name, None)
+                self.errors.pop(name, None)
+                if error is None:
+                    self._hashes[name] = int(value, 16)
+                else:
+                    self.errors[name] = error
+
+            if rebuild:
+                self.index = HammingIndex(max_distance=self.max_distance)
+                for name in sorted(self._hashes):
+                    self.index.add(name, self._hashes[name])
+            else:
+                for name in pending:
+                    if name in self._hashes:
+                        self.index.add(name, self._hashes[name])
+            self._write_checkpoint()
+            return len(pending) + len(gone)
+
+    def receipt_clusters(self, mapping):
+        """
+        Group receipts whose images are duplicates.
+
+        Args:
+            mapping (pandas.DataFrame): json_file and image (path or None),
+                e.g. the image manifest
+
+        Returns:
+            pandas.DataFrame: json_file and cluster (the cluster's first image
+            name), for receipts in clusters of two or more
+        """
+        with self._lock:
+            clusters = []
+            for image in mapping['image']:
+                if image is None or pd.isna(image):
+                    clusters.append(None)
+                    continue
+                name = os.path.basename(image)
+                # Images outside the hashed directory (e.g. uploads) only match receipts sharing the file
+                clusters.append(self.index.cluster(name) if name in self._hashes else image)
+        receipts = pd.DataFrame({'json_file': mapping['json_file'].to_numpy(), 'cluster': clusters}).dropna()
+        sizes = receipts.groupby('cluster')['json_file'].transform('size')
+        return receipts.loc[sizes > 1].reset_index(drop=True)
+
+def _receipt_images(extract_path):
+    """Receipt -> image mapping: the image manifest if reconcile.py has run, else matched now."""
+    if os.path.exists(IMAGE_MANIFEST_PATH):
+        return pd.read_parquet(IMAGE_MANIFEST_PATH, columns=['json_file', 'image'])
+    from reconcile import list_images, match_images, receipt_files
+
+    return match_images(receipt_files(extract_path), list_images(RECEIPTS_RAW_DIR), list_images(RECEIPTS_DIR))
+
+def write_duplicates(receipts, path=DUPLICATES_PATH):
+    """Write receipt_clusters() output for the review page, atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    receipts.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+class ReceiptDuplicates:
+    """
+    Duplicate clusters of one dataset's receipts, by dataset position.
+
+    The duplicates file is re-read when dedup.py rewrites it (checked at
+    most once every check_interval seconds).
+    """
+
+    def __init__(self, receipts_data, path=DUPLICATES_PATH, check_interval=2.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._positions = dict(zip(receipts_data['Source JSON File'].astype(str),
+                                   range(len(receipts_data))))
+        self._lock = threading.Lock()
+        self._clusters = {}
+        self._signature = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        # Caller must hold self._lock
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            signature = (-1, -1)
+        if signature == self._signature:
+            return
+        self._signature = signature
+        self._clusters = {}
+        if signature == (-1, -1):
+            return
+        receipts = pd.read_parquet(self.path)
+        members = {}
+        for json_file, cluster in zip(receipts['json_file'], receipts['cluster']):
+            position = self._positions.get(json_file)
+            if position is not None:
+                members.setdefault(cluster, []).append(position)
+        for positions in members.values():
+            if len(positions) > 1:
+                positions = sorted(positions)
+                for position in positions:
+                    self._clusters[position] = positions
+
+    def of(self, position):
+        """
+        Returns:
+            list: Dataset positions of the other receipts with the same photo
+        """
+        with self._lock:
+            self._refresh()
+            return [other for other in self._clusters.get(position, ()) if other != position]
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_receipt_duplicates(_receipts_data, dataset_key):
+    """
+    Duplicate clusters shared by every session, per dataset version.
+
+    Args:
+        _receipts_data (pandas.DataFrame): The receipt data (not hashed)
+        dataset_key (hashable): Identifies the dataset version
+
+    Returns:
+        ReceiptDuplicates: The clusters for the dataset (empty until dedup.py has run)
+    """
+    return ReceiptDuplicates(_receipts_data)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--image-dir", default=RECEIPTS_RAW_DIR)
+    parser.add_argument("--cache-dir", default=PHASH_CACHE_DIR)
+    parser.add_argument("--extract", default=os.path.join("data", "data_ocr_extract.xlsx"),
+                        help="used to match receipts to images when there is no image manifest")
+    parser.add_argument("--out", default=DUPLICATES_PATH)
+    parser.add_argument("--distance", type=int, default=DUPLICATE_DISTANCE, help="max Hamming distance (of 256 bits)")
+    parser.add_argument("--workers", type=int, default=DEDUP_WORKERS)
+    parser.add_argument("--watch", type=float, default=0, help="keep hashing new images, polling every SECONDS")
+    args = parser.parse_args()
+
+    detector = DuplicateDetector(args.image_dir, args.cache_dir, args.distance, args.workers)
+    mapping_signature = None
+    while True:
+        start = time.perf_counter()
+        count = detector.refresh()
+        # Receipts are matched to images through these, so a new extract or manifest regroups them too
+        signature = tuple(_file_signature(path) if os.path.exists(path) else None
+                          for path in (args.extract, IMAGE_MANIFEST_PATH))
+        if count or signature != mapping_signature:
+            mapping_signature = signature
+            receipts = detector.receipt_clusters(_receipt_images(args.extract))
+            write_duplicates(receipts, args.out)
+            print(f"{count} images hashed or removed in {time.perf_counter() - start:.2f}s; "
+                  f"{len(detector.index.clusters())} duplicate image clusters, "
+                  f"{receipts['cluster'].nunique()} receipt clusters covering {len(receipts)} receipts "
+                  f"({len(detector.errors)} unreadable images)")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Append-only log of review verdicts, and its compaction into result files.
+
+Every verdict the verification store records (and every reset) is appended
+as one JSON line to this process's file in the log directory. Lines reach
+the OS on every append, so they survive the app crashing; they are fsynced
+to disk in batches (every VERDICT_FSYNC_RECORDS lines or
+VERDICT_FSYNC_INTERVAL seconds), so a click never waits for the disk.
+
+Compaction replays the log (the latest verdict per receipt wins, and a
+reset voids the verdicts before it: the reviewer's own, or everyone's for a
+full reset) through an on-disk SQLite table, then
+writes:
+
+    verdicts.parquet                   one row per reviewed receipt
+    data_ocr_extract_reviewed.xlsx     the extract with verdict columns
+
+Both are streamed in chunks, so memory depends on the chunk size, not on
+the size of the log or the extract.
+
+Usage:
+    python export.py [--log-dir data/verdicts] [--extract data/data_ocr_extract.xlsx]
+                     [--out reports] [--chunksize N]
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import pandas as pd
+import streamlit as st
+
+from scoring import iter_extract, FIELD_LABELS
+from verification_store import VERIFIED_FIELDS, STATUS_VERIFIED, STATUS_CANCELLED
+
+# Verdict logging; RECEIPT_VERDICT_LOG=0 turns it off
+VERDICT_LOG_ENABLED = os.environ.get("RECEIPT_VERDICT_LOG", "1").lower() not in ("", "0", "false", "no")
+
+VERDICT_LOG_DIR = os.environ.get("RECEIPT_VERDICT_LOG_DIR", os.path.join("data", "verdicts"))
+
+# A log file is fsynced once this many lines are pending, or this many seconds after the first of them
+VERDICT_FSYNC_RECORDS = 50
+VERDICT_FSYNC_INTERVAL = 1.0
+
+# Rows compaction holds in memory at a time
+EXPORT_CHUNKSIZE = 20000
+
+# Fields of a verdict line, and columns of the compacted result file
+VERDICT_COLUMNS = ['json_file', 'status', 'checked_count'] + VERIFIED_FIELDS + ['reviewer', 'verified_at']
+
+# Columns the merged extract gets, after its own
+REVIEW_STATUS_LABELS = {STATUS_VERIFIED: 'Verified', STATUS_CANCELLED: 'Cancelled'}
+MERGED_COLUMNS = (['Review Status', 'Checked Fields'] + [f"{label} Correct" for label in FIELD_LABELS.values()]
+                  + ['Reviewer', 'Reviewed At'])
+
+class VerdictLog:
+    """
+    This process's append-only verdict log file.
+
+    The file is created on the first append, so processes that never record
+    a verdict leave nothing behind. Safe to use from several threads.
+    """
+
+    def __init__(self, directory=VERDICT_LOG_DIR, fsync_records=VERDICT_FSYNC_RECORDS,
+                 fsync_interval=VERDICT_FSYNC_INTERVAL):
+        self.directory = directory
+        self.fsync_records = fsync_records
+        self.fsync_interval = fsync_interval
+        # One file per process: appends never interleave, and names sort by start time
+        self.path = os.path.join(directory, f"verdicts-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                            f"{uuid.uuid4().hex[:8]}.jsonl")
+        self._lock = threading.Lock()
+        self._file = None
+        self._pending = 0
+        self._dirty = threading.Event()
+        self._stop = None
+        atexit.register(self.close)
+
+    def _append(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+                self._stop = threading.Event()
+                threading.Thread(target=self._fsync_loop, args=(self._stop,), name="receipt-verdict-log",
+                                 daemon=True).start()
+            self._file.write(line)
+            self._file.flush()
+            self._pending += 1
+            full = self._pending >= self.fsync_records
+        if full:
+            self.sync()
+        else:
+            self._dirty.set()
+
+    def record_verdict(self, json_file, status, checked_count, checks, reviewer, at):
+        """
+        Append one verdict.
+
+        Args:
+            json_file (str): The receipt's 'Source JSON File'
+            status (int): STATUS_VERIFIED or STATUS_CANCELLED
+            checked_count (int): Ticked fields (None when cancelled)
+            checks (list): 0/1 per field in VERIFIED_FIELDS (None when cancelled)
+            reviewer (str): Who recorded it
+            at (float): When, as a Unix timestamp
+        """
+        record = {'event': 'verdict', 'json_file': json_file, 'status': status, 'checked_count': checked_count}
+        record.update(zip(VERIFIED_FIELDS, checks or [None] * len(VERIFIED_FIELDS)))
+        record.update(reviewer=reviewer, verified_at=at)
+        self._append(record)
+
+    def record_reset(self, at, reviewer=None):
+        """
+        Append a reset (see VerificationStore.reset).
+
+        Args:
+            at (float): When, as a Unix timestamp
+            reviewer (str): Whose verdicts were cleared; None for every verdict
+        """
+        record = {'event': 'reset', 'at': at}
+        if reviewer is not None:
+            record['reviewer'] = reviewer
+        self._append(record)
+
+    def sync(self):
+        """fsync the lines appended so far."""
+        with self._lock:
+            if self._file is None or not self._pending:
+                return
+            fileno = self._file.fileno()
+            self._pending = 0
+            self._dirty.clear()
+        # Outside the lock, so appends carry on while the disk catches up
+        os.fsync(fileno)
+
+    def _fsync_loop(self, stop):
+        # Wait for a pending line, give the batch fsync_interval to fill up, then fsync it
+        while not stop.is_set():
+            self._dirty.wait()
+            if stop.wait(self.fsync_interval):
+                break
+            self.sync()
+
+    def close(self):
+        """fsync and close the file; a later append reopens it."""
+        self.sync()
+        with self._lock:
+            if self._file is None:
+                return
+            self._stop.set()
+            self._dirty.set()
+            self._file.close()
+            self._file = None
+
+@st.cache_resource(show_spinner=False)
+def get_verdict_log(directory=VERDICT_LOG_DIR):
+    """
+    Verdict log shared by every session in this process.
+
+    Returns:
+        VerdictLog or None: None when RECEIPT_VERDICT_LOG is off
+    """
+    return VerdictLog(directory) if VERDICT_LOG_ENABLED else None
+
+def iter_log(log_dir=VERDICT_LOG_DIR):
+    """
+    Records of every log file in the directory, oldest file first.
+
+    Yields:
+        dict: One verdict or reset record
+    """
+    try:
+        names = sorted(name for name in os.listdir(log_dir) if name.endswith(".jsonl"))
+    except FileNotFoundError:
+        return
+    for name in names:
+        with open(os.path.join(log_dir, name), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # The last line of a file written when the machine went down
+                    continue
+
+def _replay(log_dir, conn, chunksize):
+    """Load the latest verdict per receipt, less those voided by a reset, into a verdicts table."""
+    conn.execute(f"CREATE TABLE verdicts ({', '.join(VERDICT_COLUMNS)}, PRIMARY KEY (json_file))")
+    insert = (f"INSERT INTO verdicts VALUES ({', '.join('?' * len(VERDICT_COLUMNS))}) "
+              f"ON CONFLICT (json_file) DO UPDATE SET "
+              f"{', '.join(f'{column} = excluded.{column}' for column in VERDICT_COLUMNS[1:])} "
+              f"WHERE excluded.verified_at >= verdicts.verified_at")
+    # Reviewer (None for a reset of everyone's verdicts) -> time of their latest reset
+    reset_at = {}
+    batch = []
+    conn.execute("BEGIN")
+    for record in iter_log(log_dir):
+        if record.get('event') == 'reset':
+            reviewer = record.get('reviewer')
+            reset_at[reviewer] = max(reset_at.get(reviewer, record['at']), record['at'])
+            continue
+        batch.append([record.get(column) for column in VERDICT_COLUMNS])
+        if len(batch) >= chunksize:
+            conn.executemany(insert, batch)
+            batch = []
+    conn.executemany(insert, batch)
+    for reviewer, at in reset_at.items():
+        if reviewer is None:
+            conn.execute("DELETE FROM verdicts WHERE verified_at < ?", (at,))
+        else:
+            conn.execute("DELETE FROM verdicts WHERE reviewer = ? AND verified_at < ?", (reviewer, at))
+    conn.execute("COMMIT")
+    return conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+def _write_verdicts(conn, path, chunksize):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([('json_file', pa.string()), ('status', pa.int8()), ('checked_count', pa.int8())]
+                       + [(field, pa.int8()) for field in VERIFIED_FIELDS]
+                       + [('reviewer', pa.string()), ('verified_at', pa.timestamp('ms', tz='UTC'))])
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    cursor = conn.execute(f"SELECT {', '.join(VERDICT_COLUMNS)} FROM verdicts ORDER BY json_file")
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            chunk = pd.DataFrame(rows, columns=VERDICT_COLUMNS)
+            chunk['verified_at'] = pd.to_datetime(chunk['verified_at'], unit='s', utc=True).dt.round('ms')
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    os.replace(tmp_path, path)
+
+def _merged_rows(conn, chunk):
+    """Rows of an extract chunk with the MERGED_COLUMNS values appended."""
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (seq INTEGER PRIMARY KEY, json_file TEXT)")
+    conn.execute("DELETE FROM lookup")
+    conn.executemany("INSERT INTO lookup (seq, json_file) VALUES (?, ?)",
+                     enumerate(chunk['Source JSON File'].astype(str)))
+    verdicts = conn.execute(
+        f"SELECT verdicts.status, verdicts.checked_count, "
+        f"{', '.join(f'verdicts.{field}' for field in VERIFIED_FIELDS)}, verdicts.reviewer, verdicts.verified_at "
+        f"FROM lookup LEFT JOIN verdicts ON verdicts.json_file = lookup.json_file ORDER BY lookup.seq").fetchall()
+    # openpyxl writes NaN as a number Excel can't read
+    values = chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None)
+    for row, (status, checked_count, *checks, reviewer, verified_at) in zip(values, verdicts):
+        yield (*row, REVIEW_STATUS_LABELS.get(status), checked_count,
+               *(None if check is None else bool(check) for check in checks), reviewer,
+               None if verified_at is None else datetime.datetime.fromtimestamp(verified_at).replace(microsecond=0))
+
+def _write_merged(conn, extract_path, path, chunksize):
+    from openpyxl import Workbook
+
+    # Write-only mode streams rows to a temporary file instead of holding the sheet
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    rows = 0
+    for chunk in iter_extract(extract_path, chunksize, columns=None):
+        if not rows:
+            sheet.append(list(chunk.columns) + MERGED_COLUMNS)
+        for row in _merged_rows(conn, chunk):
+            sheet.append(row)
+        rows += len(chunk)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    workbook.save(tmp_path)
+    os.replace(tmp_path, path)
+    return rows
+
+def compact(log_dir=VERDICT_LOG_DIR, out_dir="reports", extract_path=None, chunksize=EXPORT_CHUNKSIZE):
+    """
+    Compact the verdict log into verdicts.parquet and, given the extract, a
+    copy of it with verdict columns.
+
+    Args:
+        log_dir (str): Verdict log directory
+        out_dir (str): Where the result files go
+        extract_path (str): .xlsx, .csv or .parquet extract to merge (None: don't)
+        chunksize (int): Rows held in memory at a time
+
+    Returns:
+        dict: Written path -> number of rows
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    written = {}
+    work_path = os.path.join(out_dir, f".export-{os.getpid()}.db")
+    conn = sqlite3.connect(work_path, isolation_level=None)
+    try:
+        # A scratch table, rebuilt from the log on every run
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        count = _replay(log_dir, conn, chunksize)
+        verdicts_path = os.path.join(out_dir, "verdicts.parquet")
+        _write_verdicts(conn, verdicts_path, chunksize)
+        written[verdicts_path] = count
+        if extract_path:
+            name = os.path.splitext(os.path.basename(extract_path))[0]
+            merged_path = os.path.join(out_dir, f"{name}_reviewed.xlsx")
+            written[merged_path] = _write_merged(conn, extract_path, merged_path, chunksize)
+    finally:
+        conn.close()
+        os.remove(work_path)
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log-dir", default=VERDICT_LOG_DIR)
+    parser.add_argument("--extract", default=os.path.join("data", "data_ocr_extract.xlsx"),
+                        help="extract to merge the verdicts into ('' to skip)")
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--chunksize", type=int, default=EXPORT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written = compact(args.log_dir, args.out, args.extract if args.extract and os.path.exists(args.extract) else None,
+                      args.chunksize)
+    print(f"compacted in {time.perf_counter() - start:.2f}s")
+    for path, rows in written.items():
+        print(f"{path}: {rows} rows")
+
+if __name__ == "__main__":
+    main()
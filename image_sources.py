@@ -0,0 +1,408 @@
+"""
+Where receipt images come from: a local directory or an HTTP(S) object store.
+
+An image source is named by its location, as in RECEIPT_IMAGE_SOURCE (the
+main images, data/receipts_raw by default) or a shard's "images" entry (see
+shards.py). A path names a directory, searched like data/receipts_raw always
+was. An http(s) URL names a prefix in an object store: the image for
+'<id> - <name>.json' is fetched from '<url>/<id> - <name>.jpg'. If the store
+also serves '<url>/index.txt' (one object name per line), receipts without
+an exact match get the first object whose name contains their ID, as in a
+local directory.
+
+Either way, callers get a local file path, so previews, the image cache and
+uploads (always saved to the local receipts directory) work the same.
+Remote images are kept in a size-bounded disk cache (least recently used
+out first). A cached image is used without asking the store for
+RECEIPT_REMOTE_REVALIDATE_SECONDS, then revalidated with a conditional
+request (If-None-Match), which costs a round trip but no transfer when it
+is unchanged. If the store can't be reached, the cached copy is used as is.
+Requests go over a pool of keep-alive connections, and concurrent requests
+for the same image wait for one download.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+from utils import (get_image_index, rank_partial_matches, receipt_base_id, _resolve_local_image_path, DATASET_CACHE_DIR,
+                   IMAGE_EXTENSIONS, RECEIPTS_DIR)
+
+# Downloaded images, one directory per source
+REMOTE_CACHE_DIR = os.path.join(DATASET_CACHE_DIR, "remote_images")
+
+# Disk budget of each source's cache
+REMOTE_CACHE_MAX_BYTES = int(os.environ.get("RECEIPT_REMOTE_CACHE_MB", "2048")) * 1024 * 1024
+
+# How long a downloaded image (or a 404) is trusted before asking the store again
+REMOTE_REVALIDATE_SECONDS = float(os.environ.get("RECEIPT_REMOTE_REVALIDATE_SECONDS", "300"))
+
+# Keep-alive connections per source, which is also how many downloads run at once
+REMOTE_POOL_SIZE = int(os.environ.get("RECEIPT_REMOTE_POOL_SIZE", "8"))
+
+REMOTE_TIMEOUT = (5, 30)
+
+# Object listing used for partial ID matches, relative to the source URL
+REMOTE_LISTING_NAME = "index.txt"
+
+_REMOTE_SOURCES = []
+_REMOTE_SOURCES_LOCK = threading.Lock()
+
+def is_remote(location):
+    """Whether an image source location is a URL rather than a directory."""
+    return location.startswith(("http://", "https://"))
+
+class LocalImageSource:
+    """
+    Images in a local directory.
+
+    The image manifest (reconcile.py) answers first when it covers the
+    directory. Otherwise: exact name in the directory, exact name in the
+    receipts directory, then the best partial ID match in the directory.
+    """
+
+    def __init__(self, directory):
+        self.location = directory
+
+    def find(self, json_filename, resolve):
+        """
+        Args:
+            json_filename (str): The JSON filename from the Excel data
+            resolve (metrics span): Records how the image was found
+
+        Returns:
+            str or None: Path to the image file, None if there is none
+        """
+        return _resolve_local_image_path(json_filename, resolve, self.location)
+
+    def fetch_many(self, json_filenames):
+        """
+        Find the images of several receipts (nothing to download; see HttpImageSource.fetch_many).
+
+        Args:
+            json_filenames (list): JSON filenames from the Excel data
+
+        Returns:
+            dict: JSON filename -> image path (or None if missing)
+        """
+        found = {}
+        for json_filename in json_filenames:
+            with metrics.span("image_resolve", source="prefetch") as resolve:
+                found[json_filename] = self.find(json_filename, resolve)
+        return found
+
+class HttpImageSource:
+    """
+    Images under a URL prefix, downloaded into a size-bounded disk cache.
+
+    Safe to use from several threads; one instance is shared by every
+    session (see get_image_source).
+    """
+
+    def __init__(self, base_url, cache_dir=REMOTE_CACHE_DIR, max_bytes=REMOTE_CACHE_MAX_BYTES,
+                 revalidate_seconds=REMOTE_REVALIDATE_SECONDS, pool_size=REMOTE_POOL_SIZE, timeout=REMOTE_TIMEOUT):
+        self.location = base_url
+        self.base_url = base_url.rstrip('/') + '/'
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(self.base_url.encode()).hexdigest()[:16])
+        self.max_bytes = max_bytes
+        self.revalidate_seconds = revalidate_seconds
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=Retry(
+            total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=("GET",)))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="receipt-image-fetch")
+        self._lock = threading.Lock()
+        # Cache file name -> size, least recently used first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        # Object name -> monotonic time it was last downloaded, revalidated or found missing
+        self._validated = {}
+        self._missing = {}
+        self._inflight = {}
+        self._listing = None
+        self._partial = {}
+        self.hits = 0
+        self.downloads = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Files left by earlier processes, oldest first (their mtime is when they were downloaded)
+        cached = []
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(('.etag', '.tmp')):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, filename))
+            cached.append((stat.st_mtime_ns, filename, stat.st_size))
+        for _, filename, size in sorted(cached):
+            self._entries[filename] = size
+            self._bytes += size
+
+    def _cache_path(self, name):
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(self.cache_dir, hashlib.sha1(name.encode()).hexdigest() + extension)
+
+    def fetch(self, name):
+        """
+        Local copy of an object, downloading or revalidating it if needed.
+
+        Args:
+            name (str): Object name under the source URL
+
+        Returns:
+            str or None: Path of the cached file, None if the store doesn't have it
+        """
+        path = self._cache_path(name)
+        filename = os.path.basename(path)
+        now = time.monotonic()
+        with self._lock:
+            if filename in self._entries and now - self._validated.get(name, float('-inf')) < self.revalidate_seconds:
+                self._entries.move_to_end(filename)
+                self.hits += 1
+                return path
+            if now - self._missing.get(name, float('-inf')) < self.revalidate_seconds:
+                return None
+            future = self._inflight.get(name)
+            downloading = future is None
+            if downloading:
+                future = self._inflight[name] = Future()
+        if not downloading:
+            return future.result()
+
+        try:
+            path = self._download(name, path)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[name]
+
+    def _download(self, name, path, conditional=True):
+        filename = os.path.basename(path)
+        etag_path = f"{path}.etag"
+        headers = {}
+        with self._lock:
+            cached = filename in self._entries
+        if conditional and cached and os.path.exists(etag_path):
+            with open(etag_path) as f:
+                headers['If-None-Match'] = f.read()
+
+        with metrics.span("image_fetch") as fetch:
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with self.session.get(self.base_url + quote(name), headers=headers, timeout=self.timeout,
+                                      stream=True) as response:
+                    if response.status_code != 200:
+                        # Closing a streamed response that wasn't read would close its connection too
+                        response.content
+                    if response.status_code == 304:
+                        with self._lock:
+                            # Another download may have evicted it since the request went out
+                            kept = filename in self._entries and os.path.exists(path)
+                            if kept:
+                                self.not_modified += 1
+                                self._validated[name] = time.monotonic()
+                                self._entries.move_to_end(filename)
+                        if kept:
+                            fetch.set(outcome="not_modified")
+                            return path
+                        fetch.set(outcome="evicted")
+                        return self._download(name, path, conditional=False)
+                    if response.status_code in (403, 404):
+                        # Object stores answer 403 for a missing key when listing isn't allowed
+                        fetch.set(outcome="missing")
+                        self._forget(filename)
+                        with self._lock:
+                            self._missing[name] = time.monotonic()
+                        return None
+                    response.raise_for_status()
+
+                    size = 0
+                    with open(tmp_path, 'wb') as f:
+                        for chunk in response.iter_content(256 * 1024):
+                            f.write(chunk)
+                            size += len(chunk)
+                    etag = response.headers.get('ETag')
+            except requests.RequestException:
+                with self._lock:
+                    self.errors += 1
+                fetch.set(outcome="error")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if cached:
+                    # Store unreachable: better a possibly stale image than none, and no retry until it's due again
+                    with self._lock:
+                        self._validated[name] = time.monotonic()
+                    return path
+                raise
+            os.replace(tmp_path, path)
+            if etag:
+                with open(etag_path, 'w') as f:
+                    f.write(etag)
+            elif os.path.exists(etag_path):
+                os.remove(etag_path)
+            fetch.set(outcome="downloaded")
+
+        with self._lock:
+            self.downloads += 1
+            self.bytes_downloaded += size
+            self._validated[name] = time.monotonic()
+            self._missing.pop(name, None)
+            self._bytes += size - self._entries.pop(filename, 0)
+            self._entries[filename] = size
+            # The newest file stays even if it alone is over budget; it's about to be used
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+                for evicted_path in (os.path.join(self.cache_dir, evicted),
+                                     os.path.join(self.cache_dir, f"{evicted}.etag")):
+                    try:
+                        os.remove(evicted_path)
+                    except OSError:
+                        pass
+        return path
+
+    def _forget(self, filename):
+        with self._lock:
+            size = self._entries.pop(filename, None)
+            if size is None:
+                return
+            self._bytes -= size
+        for stale_path in (os.path.join(self.cache_dir, filename), os.path.join(self.cache_dir, f"{filename}.etag")):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+
+    def _partial_matches(self, base_id):
+        """Object names in the store's listing containing base_id, best match first (empty without a listing)."""
+        path = self.fetch(REMOTE_LISTING_NAME)
+        with self._lock:
+            if path is None:
+                self._listing, self._partial = None, {}
+                return ()
+            signature = os.stat(path).st_mtime_ns
+            if self._listing is None or self._listing[0] != signature:
+                with open(path, encoding="utf-8") as f:
+                    names = [line.strip() for line in f if line.strip()]
+                self._listing, self._partial = (signature, names), {}
+            matches = self._partial.get(base_id)
+            if matches is None:
+                matches = self._partial[base_id] = tuple(rank_partial_matches(base_id, (
+                    name for name in self._listing[1] if name.lower().endswith(IMAGE_EXTENSIONS) and base_id in name)))
+            return matches
+
+    def find(self, json_filename, resolve):
+        """
+        Exact name in the store, exact name in the receipts directory (uploads),
+        then the best partial ID match in the store's listing.
+
+        Args:
+            json_filename (str): The JSON filename from the Excel data
+            resolve (metrics span): Records how the image was found
+
+        Returns:
+            str or None: Path of the local copy of the image, None if there is none
+        """
+        img_filename = json_filename.replace('.json', '.jpg')
+        try:
+            path = self.fetch(img_filename)
+            if path:
+                resolve.set(outcome="exact", remote=True)
+                return path
+            path = get_image_index(RECEIPTS_DIR).exact(img_filename)
+            if path:
+                resolve.set(outcome="receipts")
+                return path
+            for name in self._partial_matches(receipt_base_id(json_filename)):
+                path = self.fetch(name)
+                if path:
+                    resolve.set(outcome="partial", remote=True)
+                    return path
+        except requests.RequestException:
+            # The page offers the upload instead, as for a missing image
+            resolve.set(outcome="unreachable", remote=True)
+            return None
+        resolve.set(outcome="missing", remote=True)
+        return None
+
+    def fetch_many(self, json_filenames):
+        """
+        Download the images of several receipts at once, over the connection pool.
+
+        Args:
+            json_filenames (list): JSON filenames from the Excel data
+
+        Returns:
+            dict: JSON filename -> path of the local copy (or None if missing)
+        """
+        def _find(json_filename):
+            with metrics.span("image_resolve", source="prefetch") as resolve:
+                return self.find(json_filename, resolve)
+
+        futures = {json_filename: self._executor.submit(_find, json_filename) for json_filename in json_filenames}
+        return {json_filename: future.result() for json_filename, future in futures.items()}
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, downloads, not_modified, errors, evictions, bytes_downloaded, entries, bytes and max_bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'downloads': self.downloads,
+                'not_modified': self.not_modified,
+                'errors': self.errors,
+                'evictions': self.evictions,
+                'bytes_downloaded': self.bytes_downloaded,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_image_source(location):
+    """
+    Process-wide image source for a location, shared by every session.
+
+    Args:
+        location (str): Image directory or http(s) URL prefix
+
+    Returns:
+        LocalImageSource or HttpImageSource: The source
+    """
+    if not is_remote(location):
+        return LocalImageSource(location)
+    source = HttpImageSource(location)
+    with _REMOTE_SOURCES_LOCK:
+        _REMOTE_SOURCES.append(source)
+    metrics.REGISTRY.register_collector("remote_images", _remote_stats)
+    return source
+
+def _remote_stats():
+    """stats() summed over every remote source in use."""
+    with _REMOTE_SOURCES_LOCK:
+        sources = list(_REMOTE_SOURCES)
+    totals = {}
+    for source in sources:
+        for key, value in source.stats().items():
+            totals[key] = totals.get(key, 0) + value
+    return totals
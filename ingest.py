@@ -0,0 +1,349 @@
+"""
+Incremental ingestion of the per-receipt extraction JSON files.
+
+New and changed files in the drop directory are parsed (in parallel for
+large batches) and appended to the dataset as Parquet segments. The segments
+record the size and mtime of each file they came from, which is the
+checkpoint: files already seen are never parsed again, and a restart only
+reads the segments.
+
+The list of segments (segments.json) is shared by every process ingesting
+the same directory, e.g. the app and "python ingest.py --watch": it is only
+changed under a file lock, after picking up the segments other processes
+have added. A segment that has gone missing is dropped from the list and
+its files are parsed again.
+
+Usage:
+    python ingest.py [--drop-dir data/json] [--cache-dir data/.cache/json_ingest]
+                     [--workers N] [--watch SECONDS]
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+try:
+    import fcntl
+except ImportError:
+    # No file locking (Windows): run one ingesting process per directory
+    fcntl = None
+
+# Where the extraction drops its JSON output, one file per receipt
+JSON_DROP_DIR = os.environ.get("RECEIPT_JSON_DIR", os.path.join("data", "json"))
+
+JSON_INGEST_DIR = os.path.join("data", ".cache", "json_ingest")
+
+# Columns of the extract workbook, in order
+EXTRACT_COLUMNS = ['Source JSON File', 'Tax ID', 'Receipt Number', 'Date', 'Time', 'Total Amount', 'Store name']
+
+# Keys the extraction may use for each column
+JSON_FIELD_KEYS = {
+    'Tax ID': ('Tax ID', 'tax_id', 'taxId', 'TaxID'),
+    'Receipt Number': ('Receipt Number', 'receipt_number', 'receiptNumber', 'receipt_no'),
+    'Date': ('Date', 'date'),
+    'Time': ('Time', 'time'),
+    'Total Amount': ('Total Amount', 'total_amount', 'totalAmount', 'total'),
+    'Store name': ('Store name', 'Store Name', 'store_name', 'storeName'),
+}
+
+# Objects the fields may be nested under
+JSON_CONTAINER_KEYS = ('receipt', 'data', 'result', 'fields')
+
+# Batches at least this large are parsed in a process pool (smaller ones don't repay its start-up)
+INGEST_PARALLEL_THRESHOLD = 2000
+
+INGEST_WORKERS = os.cpu_count() or 1
+
+# Segments are merged into one once there are more than this many
+INGEST_MAX_SEGMENTS = 32
+
+# Seconds between listings of an unchanged-looking drop directory, for files rewritten in place
+INGEST_RESCAN_SECONDS = float(os.environ.get("RECEIPT_INGEST_RESCAN_SECONDS", "30"))
+
+_CHECKPOINT_COLUMNS = ['_size', '_mtime_ns', '_error']
+
+def _find_field(document, keys):
+    for key in keys:
+        if key in document:
+            return document[key]
+    for container in JSON_CONTAINER_KEYS:
+        if isinstance(document.get(container), dict):
+            value = _find_field(document[container], keys)
+            if value is not None:
+                return value
+    return None
+
+def parse_receipt_json(path):
+    """
+    Read one extraction JSON file into a row of the extract.
+
+    Args:
+        path (str): Path of the JSON file
+
+    Returns:
+        dict: EXTRACT_COLUMNS values, plus '_error' (None, or why the file
+        couldn't be read)
+    """
+    row = {column: None for column in EXTRACT_COLUMNS}
+    row['Source JSON File'] = os.path.basename(path)
+    row['_error'] = None
+    try:
+        with open(path, encoding="utf-8") as f:
+            document = json.load(f)
+        if not isinstance(document, dict):
+            raise ValueError("expected a JSON object")
+        for column, keys in JSON_FIELD_KEYS.items():
+            value = _find_field(document, keys)
+            # Segments store every field as text; the normalization pass parses them
+            row[column] = None if value is None or value == "" else str(value)
+    except (OSError, ValueError) as e:
+        row['_error'] = str(e)
+    return row
+
+def merge_receipts(frames):
+    """
+    Concatenate extract frames, keeping one row per file.
+
+    A file keeps the position it was first seen at (so verdict positions stay
+    valid as the dataset grows), with the values it was last seen with.
+
+    Args:
+        frames (list): DataFrames with a 'Source JSON File' column, oldest first
+
+    Returns:
+        pandas.DataFrame: The merged rows
+    """
+    rows = pd.concat(frames, ignore_index=True)
+    last_seen = rows.drop_duplicates('Source JSON File', keep='last').set_index('Source JSON File')
+    first_seen = rows['Source JSON File'].drop_duplicates(keep='first')
+    return last_seen.loc[first_seen].reset_index()[rows.columns]
+
+class JsonDropIngestor:
+    """
+    Dataset built from a JSON drop directory, grown as new files arrive.
+
+    refresh() is cheap to call on every rerun: the directory is only listed
+    when its mtime changes (a file is added, removed or renamed), at most once
+    per check_interval seconds. Rewriting a file in place doesn't change the
+    directory's mtime, so it is also listed (and every file stat'ed) once
+    every rescan_interval seconds.
+    """
+
+    def __init__(self, drop_dir=JSON_DROP_DIR, ingest_dir=JSON_INGEST_DIR, workers=INGEST_WORKERS,
+                 check_interval=2.0, rescan_interval=INGEST_RESCAN_SECONDS):
+        self.drop_dir = drop_dir
+        self.ingest_dir = ingest_dir
+        self.workers = workers
+        self.check_interval = check_interval
+        self.rescan_interval = rescan_interval
+        self.errors = {}
+        # Incremented whenever data changes
+        self.version = 0
+        self._lock = threading.Lock()
+        self._seen = {}
+        self._segments = []
+        self._data = pd.DataFrame(columns=EXTRACT_COLUMNS)
+        self._dir_mtime_ns = None
+        self._checked_at = 0.0
+        self._listed_at = 0.0
+        self._load_checkpoint()
+
+    @property
+    def data(self):
+        """The current dataset (the same object until something new is ingested)."""
+        return self._data
+
+    def _checkpoint_path(self):
+        return os.path.join(self.ingest_dir, "segments.json")
+
+    @contextlib.contextmanager
+    def _checkpoint_lock(self):
+        """Hold the lock other processes take to change segments.json."""
+        os.makedirs(self.ingest_dir, exist_ok=True)
+        with open(os.path.join(self.ingest_dir, "segments.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            # Closing the file releases the lock
+            yield
+
+    def _sync_segments(self):
+        """
+        Absorb the segments other processes have added to the checkpoint
+        (caller holds the checkpoint lock).
+
+        Segments that are listed but can't be read are dropped from it; their
+        files aren't in the seen-file checkpoint, so they are parsed again.
+        """
+        try:
+            with open(self._checkpoint_path(), encoding="utf-8") as f:
+                listed = json.load(f)
+        except FileNotFoundError:
+            listed = []
+        known = set(self._segments)
+        segments, frames = [], []
+        for name in listed:
+            if name not in known:
+                try:
+                    frames.append(pd.read_parquet(os.path.join(self.ingest_dir, name)))
+                except (OSError, ValueError):
+                    continue
+            segments.append(name)
+        self._segments = segments
+        if frames:
+            self._absorb(frames)
+        if segments != listed:
+            self._write_checkpoint()
+
+    def _load_checkpoint(self):
+        with self._checkpoint_lock():
+            self._sync_segments()
+
+    def _write_checkpoint(self):
+        path = self._checkpoint_path()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._segments, f)
+        os.replace(tmp_path, path)
+
+    def _absorb(self, frames):
+        """Add segment rows to the seen-file checkpoint and the dataset."""
+        for frame in frames:
+            self._seen.update(zip(frame['Source JSON File'], zip(frame['_size'], frame['_mtime_ns'])))
+            for name, error in zip(frame['Source JSON File'], frame['_error']):
+                if pd.isna(error):
+                    self.errors.pop(name, None)
+                else:
+                    self.errors[name] = error
+        parsed = [frame.loc[frame['_error'].isna(), EXTRACT_COLUMNS] for frame in frames]
+        if len(self._data) > 0:
+            parsed.insert(0, self._data)
+        self._data = merge_receipts(parsed)
+        self.version += 1
+
+    def _write_segment(self, rows):
+        frame = pd.DataFrame(rows, columns=EXTRACT_COLUMNS + _CHECKPOINT_COLUMNS)
+        for column in EXTRACT_COLUMNS + ['_error']:
+            frame[column] = frame[column].astype(object)
+        name = f"segment-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet"
+        os.makedirs(self.ingest_dir, exist_ok=True)
+        frame.to_parquet(os.path.join(self.ingest_dir, name), index=False)
+        return name, frame
+
+    def _compact(self):
+        """
+        Merge all segments into one, keeping each file's latest row (caller
+        holds the checkpoint lock, so the list is every process's segments).
+        """
+        paths = [os.path.join(self.ingest_dir, name) for name in self._segments]
+        rows = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+        rows = merge_receipts([rows])
+        name, _ = self._write_segment(rows.to_dict('records'))
+        self._segments = [name]
+        self._write_checkpoint()
+        for path in paths:
+            os.remove(path)
+
+    def _pending_files(self):
+        pending = []
+        with os.scandir(self.drop_dir) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith('.json') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if self._seen.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    pending.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return pending
+
+    def _parse(self, paths):
+        if len(paths) < INGEST_PARALLEL_THRESHOLD or self.workers <= 1:
+            return [parse_receipt_json(path) for path in paths]
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        # Spawned, not forked: the streamlit server process has threads running
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            return list(executor.map(parse_receipt_json, paths, chunksize=chunksize))
+
+    def refresh(self, force=False):
+        """
+        Ingest files added or changed since the last refresh.
+
+        Args:
+            force (bool): List the directory even if it looks unchanged
+
+        Returns:
+            int: Number of files ingested
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._checked_at < self.check_interval:
+                return 0
+            self._checked_at = now
+            # Files other processes have ingested don't need parsing here
+            with self._checkpoint_lock():
+                self._sync_segments()
+            try:
+                dir_mtime_ns = os.stat(self.drop_dir).st_mtime_ns
+            except FileNotFoundError:
+                return 0
+            if not force and dir_mtime_ns == self._dir_mtime_ns and now - self._listed_at < self.rescan_interval:
+                return 0
+
+            pending = self._pending_files()
+            self._dir_mtime_ns = dir_mtime_ns
+            self._listed_at = now
+            if not pending:
+                return 0
+
+            rows = self._parse([path for path, _, _ in pending])
+            for row, (_, size, mtime_ns) in zip(rows, pending):
+                row['_size'] = size
+                row['_mtime_ns'] = mtime_ns
+            name, frame = self._write_segment(rows)
+            with self._checkpoint_lock():
+                # Segments added meanwhile go first, as they do in the other processes
+                self._sync_segments()
+                self._segments.append(name)
+                self._write_checkpoint()
+                self._absorb([frame])
+                if len(self._segments) > INGEST_MAX_SEGMENTS:
+                    self._compact()
+            return len(pending)
+
+@st.cache_resource(show_spinner=False)
+def get_json_ingestor(drop_dir=JSON_DROP_DIR, ingest_dir=JSON_INGEST_DIR):
+    """
+    Ingestor shared by every session, so files are parsed once per process.
+
+    Returns:
+        JsonDropIngestor: The ingestor for the drop directory
+    """
+    return JsonDropIngestor(drop_dir, ingest_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--drop-dir", default=JSON_DROP_DIR)
+    parser.add_argument("--cache-dir", default=JSON_INGEST_DIR)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--watch", type=float, default=0, help="keep ingesting, polling every SECONDS")
+    args = parser.parse_args()
+
+    ingestor = JsonDropIngestor(args.drop_dir, args.cache_dir, workers=args.workers, check_interval=0)
+    while True:
+        start = time.perf_counter()
+        count = ingestor.refresh(force=True)
+        if count:
+            print(f"ingested {count} files in {time.perf_counter() - start:.2f}s "
+                  f"({len(ingestor.data)} receipts, {len(ingestor.errors)} unreadable)")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Timing instrumentation for the review app.
+
+Turned on with RECEIPT_METRICS=1. Timed spans are aggregated into histograms
+shared by every session in the process and served on
+http://<host>:RECEIPT_METRICS_PORT/metrics (Prometheus text format) and
+/metrics.json. Each full rerun is also logged as one JSON line on the
+"receipt_review.metrics" logger (stderr).
+
+When it is off, span() returns a shared no-op context manager and timed()
+returns the function unchanged, so instrumented code pays one function call
+per span at most.
+"""
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.environ.get("RECEIPT_METRICS", "0").lower() not in ("", "0", "false", "no")
+
+METRICS_PORT = int(os.environ.get("RECEIPT_METRICS_PORT", "9464"))
+
+# Histogram bucket upper bounds, in seconds
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+logger = logging.getLogger("receipt_review.metrics")
+
+class Histogram:
+    """Cumulative-bucket histogram of durations, like a Prometheus histogram."""
+
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def cumulative(self):
+        """(upper bound, observations <= bound) pairs, ending with +Inf."""
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+class MetricsRegistry:
+    """
+    Process-wide span histograms plus values read from collectors on export.
+
+    Histograms are keyed by span name and labels. Collectors are callables
+    returning a dict of numbers, e.g. ImageCache.stats.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._collectors = {}
+
+    def observe(self, name, seconds, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def register_collector(self, name, collect):
+        """
+        Report collect()'s values on every export, as receipt_<name>_<key>.
+
+        Args:
+            name (str): Collector name, e.g. 'image_cache'
+            collect (callable): Returns a dict of key -> number
+        """
+        with self._lock:
+            self._collectors[name] = collect
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: 'spans' (one entry per span name and labels with count, sum
+            and cumulative buckets) and 'collectors' (name -> values)
+        """
+        with self._lock:
+            spans = [{
+                'span': name,
+                'labels': dict(labels),
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': [['+Inf' if bound == float('inf') else bound, count]
+                            for bound, count in histogram.cumulative()],
+            } for (name, labels), histogram in sorted(self._histograms.items())]
+            collectors = dict(self._collectors)
+        return {'spans': spans, 'collectors': {name: collect() for name, collect in collectors.items()}}
+
+    def prometheus_text(self):
+        """The snapshot in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = ["# HELP receipt_span_seconds Duration of instrumented review app operations",
+                 "# TYPE receipt_span_seconds histogram"]
+        for entry in snapshot['spans']:
+            labels = [f'span="{entry["span"]}"'] + [f'{key}="{value}"' for key, value in entry['labels'].items()]
+            label_text = ",".join(labels)
+            for bound, count in entry['buckets']:
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'receipt_span_seconds_bucket{{{label_text},le="{le}"}} {count}')
+            lines.append(f'receipt_span_seconds_sum{{{label_text}}} {entry["sum"]}')
+            lines.append(f'receipt_span_seconds_count{{{label_text}}} {entry["count"]}')
+        for name, values in snapshot['collectors'].items():
+            for key, value in values.items():
+                lines.append(f"# TYPE receipt_{name}_{key} gauge")
+                lines.append(f"receipt_{name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+_local = threading.local()
+
+class _Span:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def set(self, **labels):
+        """Add labels known only once the operation is under way, e.g. which path it took."""
+        self.labels.update(labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        REGISTRY.observe(self.name, seconds, self.labels)
+        rerun = getattr(_local, 'rerun', None)
+        if rerun is not None:
+            rerun['spans'].append(dict(self.labels, span=self.name, seconds=round(seconds, 6)))
+        return False
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **labels):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name, **labels):
+    """
+    Time a block of code.
+
+    Usage:
+        with metrics.span("image_resolve") as resolve:
+            ...
+            resolve.set(outcome="exact")
+
+    Args:
+        name (str): Span name
+        **labels: Label values for the histogram
+
+    Returns:
+        A context manager
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, labels)
+
+def timed(name):
+    """Decorator timing every call of a function as a span (no wrapper at all when metrics are off)."""
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def start_rerun():
+    """Start collecting this thread's spans for the rerun's log line."""
+    if METRICS_ENABLED:
+        _local.rerun = {'start': time.perf_counter(), 'spans': []}
+
+def finish_rerun(**fields):
+    """
+    Record the rerun's total time and log its spans as one JSON line.
+
+    Args:
+        **fields: Extra values for the log line, e.g. the receipt shown
+    """
+    rerun = getattr(_local, 'rerun', None)
+    if rerun is None:
+        return
+    _local.rerun = None
+    seconds = time.perf_counter() - rerun['start']
+    REGISTRY.observe("rerun", seconds)
+    logger.info(json.dumps(dict(fields, event="rerun", seconds=round(seconds, 6), spans=rerun['spans']),
+                           ensure_ascii=False, default=str))
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body = REGISTRY.prometheus_text().encode()
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif self.path == "/metrics.json":
+            body = json.dumps(REGISTRY.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+_server_lock = threading.Lock()
+_server = None
+
+def serve(port=METRICS_PORT):
+    """
+    Start the metrics endpoint and the structured log, once per process.
+
+    Safe to call on every rerun; does nothing when metrics are off.
+    """
+    global _server
+    if not METRICS_ENABLED or _server is not None:
+        return
+    with _server_lock:
+        if _server is not None:
+            return
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        try:
+            _server = ThreadingHTTPServer(("", port), _MetricsHandler)
+        except OSError as e:
+            # Keep collecting (and logging) even if another process holds the port
+            logger.warning(f"metrics endpoint not started on port {port}: {e}")
+            _server = False
+            return
+        threading.Thread(target=_server.serve_forever, name="receipt-metrics", daemon=True).start()
@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+
+from utils import get_receipt_preview_bytes, IMAGE_SOURCE
+
+# How many receipts ahead of the current one are prepared in the background
+PREFETCH_COUNT = 3
+
+# Upper bound on preview bytes held by one session's prefetcher
+PREFETCH_MAX_BYTES = 16 * 1024 * 1024
+
+PREFETCH_WORKERS = 4
+
+@st.cache_resource(show_spinner=False)
+def get_prefetch_executor():
+    """
+    Thread pool shared by every session's prefetcher.
+
+    Returns:
+        ThreadPoolExecutor: The process-wide prefetch pool
+    """
+    return ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="receipt-prefetch")
+
+def prepare_receipt(json_filename, image_source=IMAGE_SOURCE):
+    """
+    Do the work the review page needs to show a receipt.
+
+    Builds the preview renditions if they don't exist yet and loads them into
+    the shared image cache. (Field display strings are precomputed per dataset.)
+
+    Args:
+        json_filename (str): The JSON filename from the Excel data
+        image_source (str): Image directory or URL of the receipt's shard
+
+    Returns:
+        dict: 'images' (rendition name -> JPEG bytes, empty if the image is
+        missing) and 'nbytes'
+    """
+    images = get_receipt_preview_bytes(json_filename, image_source) or {}
+    return {
+        'images': images,
+        'nbytes': sum(len(data) for data in images.values()),
+    }
+
+class ReceiptPrefetcher:
+    """
+    Per-session queue of receipts being prepared ahead of the reviewer.
+
+    schedule() is called on every rerun with the receipts expected next, in
+    priority order. Work for receipts that fall out of that window is
+    cancelled, and finished results beyond max_bytes are dropped starting
+    from the lowest priority.
+    """
+
+    def __init__(self, executor, max_bytes=PREFETCH_MAX_BYTES):
+        self.executor = executor
+        self.max_bytes = max_bytes
+        # Re-entrant: add_done_callback runs the callback inline if the future is already done
+        self._lock = threading.RLock()
+        self._futures = {}
+        self._order = []
+
+    def schedule(self, json_filenames, image_source=IMAGE_SOURCE):
+        """
+        Prepare the given receipts in the background.
+
+        Args:
+            json_filenames (list): JSON filenames, most likely first
+            image_source (str): Image directory or URL of their shard
+        """
+        with self._lock:
+            self._order = list(json_filenames)
+            for json_filename in list(self._futures):
+                if json_filename not in self._order:
+                    self._futures.pop(json_filename).cancel()
+            for json_filename in self._order:
+                if json_filename not in self._futures:
+                    future = self.executor.submit(prepare_receipt, json_filename, image_source)
+                    self._futures[json_filename] = future
+                    future.add_done_callback(lambda _: self._enforce_budget())
+
+    def take(self, json_filename):
+        """
+        Claim a finished result without waiting for pending work.
+
+        Returns:
+            dict or None: The prepare_receipt() result, if it is ready
+        """
+        with self._lock:
+            future = self._futures.get(json_filename)
+            if future is None or not future.done():
+                return None
+            del self._futures[json_filename]
+        if future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def cancel(self):
+        """Drop all pending and finished work, e.g. when the reviewer jumps elsewhere."""
+        with self._lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+            self._order = []
+
+    def _enforce_budget(self):
+        with self._lock:
+            total = 0
+            for json_filename in self._order:
+                future = self._futures.get(json_filename)
+                if future is None or not future.done() or future.cancelled() or future.exception() is not None:
+                    continue
+                total += future.result()['nbytes']
+                if total > self.max_bytes:
+                    del self._futures[json_filename]
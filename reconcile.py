@@ -0,0 +1,264 @@
+"""
+Offline reconciliation of the extract with the receipt image store.
+
+Matches every receipt in the extract (and the ingested JSON drop) to its
+image the way the review page looks it up, writes the result to the image
+manifest the page reads instead of searching on each view, and reports what
+doesn't line up:
+
+    reconcile_missing      receipts without an image
+    reconcile_ambiguous    receipts whose ID partially matches several images
+    reconcile_orphans      images in data/receipts_raw no receipt points at
+    reconcile_unreadable   matched images that can't be opened
+
+Usage:
+    python reconcile.py [--extract data/data_ocr_extract.xlsx] [--out reports]
+                        [--manifest data/.cache/image_manifest.parquet]
+                        [--workers N] [--previews]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pandas as pd
+from PIL import Image
+
+from ingest import JsonDropIngestor, JSON_DROP_DIR, JSON_INGEST_DIR
+from scoring import iter_extract
+from utils import (build_previews, rank_partial_matches, receipt_base_id, IMAGE_EXTENSIONS, IMAGE_MANIFEST_PATH,
+                   RECEIPTS_DIR, RECEIPTS_RAW_DIR, MANIFEST_RAW_MTIME_KEY)
+
+RECONCILE_WORKERS = os.cpu_count() or 1
+
+# Partial matching (receipt IDs x image names) runs in a process pool above this many comparisons
+RECONCILE_PARALLEL_THRESHOLD = 500000000
+
+# Image names, one per line, searched with str.find (C speed) rather than a loop per name
+_image_text = ""
+
+def _init_worker(names):
+    global _image_text
+    _image_text = "\n".join(names) + "\n"
+
+def _partial_candidates(base_ids):
+    """Image names containing each ID, in name order (runs in a worker)."""
+    found = []
+    for base_id in base_ids:
+        names = []
+        start = 0
+        while base_id:
+            at = _image_text.find(base_id, start)
+            if at < 0:
+                break
+            line_start = _image_text.rfind("\n", 0, at) + 1
+            line_end = _image_text.index("\n", at)
+            names.append(_image_text[line_start:line_end])
+            start = line_end + 1
+        found.append(names)
+    return found
+
+def list_images(directory):
+    """
+    Returns:
+        list: Image filenames in the directory, sorted (empty if it doesn't exist)
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(entry.name for entry in entries
+                          if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file())
+    except FileNotFoundError:
+        return []
+
+def receipt_files(extract_path, drop_dir=JSON_DROP_DIR, ingest_dir=JSON_INGEST_DIR):
+    """
+    'Source JSON File' of every receipt the review page would show, in dataset order.
+    """
+    json_files = []
+    if os.path.exists(extract_path):
+        for chunk in iter_extract(extract_path):
+            json_files.extend(chunk['Source JSON File'].dropna().astype(str))
+    if os.path.isdir(drop_dir) or os.path.isdir(ingest_dir):
+        ingestor = JsonDropIngestor(drop_dir, ingest_dir, check_interval=0)
+        ingestor.refresh(force=True)
+        json_files.extend(ingestor.data['Source JSON File'].astype(str))
+    return list(dict.fromkeys(json_files))
+
+def match_images(json_files, raw_names, local_names, workers=RECONCILE_WORKERS, raw_dir=RECEIPTS_RAW_DIR,
+                 local_dir=RECEIPTS_DIR):
+    """
+    Resolve each receipt's image like the review page: exact name in
+    data/receipts_raw, exact name in receipts, then a partial ID match in
+    data/receipts_raw. Of several partial matches, the first by
+    utils.rank_partial_matches wins, as it does on the page.
+
+    Args:
+        json_files (list): Receipts, in dataset order
+        raw_names (list): Sorted image names in data/receipts_raw
+        local_names (list): Image names in receipts
+        workers (int): Processes for partial matching of large sets
+        raw_dir (str): Directory of raw_names
+        local_dir (str): Directory of local_names
+
+    Returns:
+        pandas.DataFrame: json_file, image (path or None), match ('exact',
+        'receipts', 'partial', 'ambiguous' or 'missing') and candidates
+        (number of partial matches)
+    """
+    raw_set, local_set = set(raw_names), set(local_names)
+    images, matches, candidates = [], [], []
+    unresolved = []
+    for slot, json_file in enumerate(json_files):
+        img_filename = json_file.replace('.json', '.jpg')
+        if img_filename in raw_set:
+            images.append(os.path.join(raw_dir, img_filename))
+            matches.append('exact')
+        elif img_filename in local_set:
+            images.append(os.path.join(local_dir, img_filename))
+            matches.append('receipts')
+        else:
+            images.append(None)
+            matches.append('missing')
+            unresolved.append(slot)
+        candidates.append(0)
+
+    base_ids = [receipt_base_id(json_files[slot]) for slot in unresolved]
+    if len(base_ids) * len(raw_names) < RECONCILE_PARALLEL_THRESHOLD or workers <= 1:
+        _init_worker(raw_names)
+        found = _partial_candidates(base_ids)
+    else:
+        chunksize = max(1, len(base_ids) // (workers * 4))
+        chunks = [base_ids[start:start + chunksize] for start in range(0, len(base_ids), chunksize)]
+        # Spawned like the JSON ingest pool, so this also works from a threaded process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(raw_names,)) as executor:
+            found = [names for chunk in executor.map(_partial_candidates, chunks) for names in chunk]
+
+    for slot, base_id, names in zip(unresolved, base_ids, found):
+        if not names:
+            continue
+        images[slot] = os.path.join(raw_dir, rank_partial_matches(base_id, names)[0])
+        matches[slot] = 'partial' if len(names) == 1 else 'ambiguous'
+        candidates[slot] = len(names)
+
+    return pd.DataFrame({'json_file': json_files, 'image': images, 'match': matches, 'candidates': candidates})
+
+def _image_error(path):
+    """None if the image header can be read, else why not."""
+    try:
+        with Image.open(path) as image:
+            image.size
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+def _build_previews(path):
+    try:
+        build_previews(path)
+        return None
+    except Exception as e:
+        return str(e) or type(e).__name__
+
+def check_images(paths, workers=RECONCILE_WORKERS, previews=False):
+    """
+    Open every matched image, optionally building its preview renditions.
+
+    Header checks are I/O-bound and run in threads; preview builds decode
+    and re-encode, so they run in processes.
+
+    Returns:
+        dict: path -> error, for the images that failed
+    """
+    paths = list(dict.fromkeys(paths))
+    if previews and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            errors = executor.map(_build_previews, paths, chunksize=max(1, len(paths) // (workers * 4)))
+            return {path: error for path, error in zip(paths, errors) if error}
+    check = _build_previews if previews else _image_error
+    with ThreadPoolExecutor(max_workers=max(4, workers * 2)) as executor:
+        return {path: error for path, error in zip(paths, executor.map(check, paths)) if error}
+
+def write_manifest(mapping, path=IMAGE_MANIFEST_PATH, raw_dir_mtime_ns=None):
+    """
+    Write the receipt -> image mapping for the review page, atomically.
+
+    Args:
+        mapping (pandas.DataFrame): match_images() output
+        path (str): Manifest path
+        raw_dir_mtime_ns (int): mtime of data/receipts_raw when it was listed
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(mapping, preserve_index=False)
+    if raw_dir_mtime_ns is not None:
+        metadata = dict(table.schema.metadata or {})
+        metadata[MANIFEST_RAW_MTIME_KEY] = str(raw_dir_mtime_ns)
+        table = table.replace_schema_metadata(metadata)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+def reconcile(extract_path, manifest_path=IMAGE_MANIFEST_PATH, workers=RECONCILE_WORKERS, previews=False):
+    """
+    Match receipts to images, write the manifest and build the reports.
+
+    Returns:
+        dict: Report name -> pandas.DataFrame
+    """
+    try:
+        raw_dir_mtime_ns = os.stat(RECEIPTS_RAW_DIR).st_mtime_ns
+    except FileNotFoundError:
+        raw_dir_mtime_ns = None
+    # Listed after taking the mtime, so a file added in between makes the manifest look stale, not complete
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        raw_names = executor.submit(list_images, RECEIPTS_RAW_DIR)
+        local_names = executor.submit(list_images, RECEIPTS_DIR)
+        json_files = receipt_files(extract_path)
+        raw_names, local_names = raw_names.result(), local_names.result()
+
+    mapping = match_images(json_files, raw_names, local_names, workers)
+    matched = mapping['image'].notna()
+    errors = check_images(mapping.loc[matched, 'image'].tolist(), workers, previews)
+    unreadable = mapping['image'].isin(list(errors))
+    # The page shows the placeholder for these rather than failing to open them
+    manifest = mapping.copy()
+    manifest.loc[unreadable, 'image'] = None
+    manifest.loc[unreadable, 'match'] = 'unreadable'
+    write_manifest(manifest, manifest_path, raw_dir_mtime_ns)
+
+    used = {os.path.basename(image) for image in mapping.loc[matched, 'image']
+            if os.path.dirname(image) == RECEIPTS_RAW_DIR}
+    return {
+        'reconcile_missing': mapping.loc[~matched, ['json_file']],
+        'reconcile_ambiguous': mapping.loc[mapping['match'] == 'ambiguous', ['json_file', 'image', 'candidates']],
+        'reconcile_orphans': pd.DataFrame({'image': [name for name in raw_names if name not in used]}),
+        'reconcile_unreadable': pd.DataFrame({
+            'json_file': mapping.loc[unreadable, 'json_file'],
+            'image': mapping.loc[unreadable, 'image'],
+            'error': mapping.loc[unreadable, 'image'].map(errors),
+        }),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--extract", default=os.path.join("data", "data_ocr_extract.xlsx"))
+    parser.add_argument("--manifest", default=IMAGE_MANIFEST_PATH)
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--workers", type=int, default=RECONCILE_WORKERS)
+    parser.add_argument("--previews", action="store_true", help="also build the preview renditions")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    reports = reconcile(args.extract, args.manifest, args.workers, args.previews)
+    print(f"reconciled in {time.perf_counter() - start:.2f}s, manifest written to {args.manifest}")
+    os.makedirs(args.out, exist_ok=True)
+    for name, report in reports.items():
+        path = os.path.join(args.out, f"{name}.csv")
+        report.to_csv(path, index=False, encoding="utf-8-sig")
+        print(f"{path}: {len(report)} rows")
+
+if __name__ == "__main__":
+    main()
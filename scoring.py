@@ -0,0 +1,305 @@
+"""
+Per-field accuracy of the extraction model, computed from reviewed verdicts.
+
+Usage:
+    python scoring.py [--db data/verification.db] [--out reports]
+                      [--format csv|parquet] [--chunksize N] [--extract PATH ...]
+
+Writes accuracy_overall, accuracy_by_store and accuracy_by_date reports over
+the given extracts, or else the ones the review page shows: the shards in
+data/shards.json, or the extract workbook, or the uploaded extract data
+(see find_extracts). Receipts that only arrived through the JSON drop
+directory aren't scored. Each extract is read through the app's Parquet
+cache when there is one, only the grouping columns and chunksize rows at a
+time, so memory depends on the number of stores/dates, not on the dataset.
+Exits with an error if there is no dataset.
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+import streamlit as st
+
+from shards import ShardCatalog, SHARD_MANIFEST_PATH
+from utils import (dataset_cache_path, _as_text, _parse_dates, _to_columnar, DATASET_CACHE_DIR,
+                   UPLOADED_DATASET_PATH, WORKBOOK_PATHS)
+from verification_store import (VerificationStore, VERIFICATION_DB_PATH, VERIFIED_FIELDS,
+                                 STATUS_UNVERIFIED, STATUS_VERIFIED, STATUS_CANCELLED,
+                                 get_verification_store)
+
+# Report column prefix per verified field
+FIELD_LABELS = {
+    'tax_id': 'Tax ID',
+    'receipt_number': 'Receipt Number',
+    'date': 'Date',
+    'time': 'Time',
+    'total_amount': 'Total Amount',
+    'store_name': 'Store name',
+}
+
+# Columns needed from the extract to group the results
+EXTRACT_COLUMNS = ['Source JSON File', 'Store name', 'Date']
+
+UNKNOWN_GROUP = "(ไม่พบข้อมูล)"
+
+# How stale the accuracy in the app's summary panel may get, in seconds
+LIVE_ACCURACY_TTL = 15
+
+def aggregate(verdicts, by=None):
+    """
+    Partial sums of review results, optionally per group.
+
+    The sums from several chunks can be added together with combine(), which
+    is what lets the reports stream.
+
+    Args:
+        verdicts (pandas.DataFrame): Columns from VerificationStore.iter_verdicts(),
+            plus any group columns
+        by (str): Group column, or None for one overall row
+
+    Returns:
+        pandas.DataFrame: receipts, reviewed, verified, cancelled, all_correct
+        and one <field>_correct column per field
+    """
+    status = verdicts['status']
+    verified = (status == STATUS_VERIFIED).to_numpy()
+    sums = pd.DataFrame({
+        'receipts': 1,
+        'reviewed': (status != STATUS_UNVERIFIED).astype('int64'),
+        'verified': verified.astype('int64'),
+        'cancelled': (status == STATUS_CANCELLED).astype('int64'),
+        'all_correct': ((verdicts['checked_count'] == len(VERIFIED_FIELDS)).to_numpy() & verified).astype('int64'),
+    }, index=verdicts.index)
+    for field in VERIFIED_FIELDS:
+        sums[f'{field}_correct'] = (verdicts[field].fillna(0).to_numpy() * verified).astype('int64')
+
+    if by is None:
+        return sums.sum().to_frame().T
+    sums[by] = verdicts[by].fillna(UNKNOWN_GROUP).to_numpy()
+    return sums.groupby(by, sort=False).sum()
+
+def combine(partials):
+    """
+    Add up partial sums from aggregate().
+
+    Args:
+        partials (list): DataFrames from aggregate() with the same grouping
+
+    Returns:
+        pandas.DataFrame: The combined sums
+    """
+    combined = pd.concat(partials)
+    if combined.index.name is None:
+        return combined.sum().to_frame().T
+    return combined.groupby(level=0, sort=True).sum()
+
+def finalize(sums):
+    """
+    Turn summed counts into a report with accuracy ratios.
+
+    Accuracy is correct / verified. Cancelled receipts count as reviewed but
+    don't contribute to accuracy.
+
+    Returns:
+        pandas.DataFrame: sums plus <Field> accuracy columns and all_correct_rate
+    """
+    report = sums.copy()
+    verified = report['verified'].where(report['verified'] > 0)
+    for field, label in FIELD_LABELS.items():
+        report[f'{label} accuracy'] = report[f'{field}_correct'] / verified
+    report['all_correct_rate'] = report['all_correct'] / verified
+    return report
+
+def field_accuracy(store, chunksize=100000):
+    """
+    Overall per-field accuracy over everything in the store.
+
+    Returns:
+        dict: Field key -> accuracy (None until something is verified)
+    """
+    partials = [aggregate(chunk) for chunk in store.iter_verdicts(chunksize)]
+    if not partials:
+        return {field: None for field in VERIFIED_FIELDS}
+    report = finalize(combine(partials)).iloc[0]
+    return {
+        field: None if pd.isna(report[f'{label} accuracy']) else float(report[f'{label} accuracy'])
+        for field, label in FIELD_LABELS.items()
+    }
+
+@st.cache_data(ttl=LIVE_ACCURACY_TTL, show_spinner=False)
+def live_field_accuracy(db_path=VERIFICATION_DB_PATH):
+    """
+    field_accuracy() of the app's verdict store, recomputed at most every LIVE_ACCURACY_TTL seconds.
+
+    Args:
+        db_path (str): Verdict store path
+
+    Returns:
+        dict: Field key -> accuracy (None until something is verified)
+    """
+    return field_accuracy(get_verification_store(db_path))
+
+def iter_extract(path, chunksize=100000, columns=EXTRACT_COLUMNS):
+    """
+    Stream columns of an extract file (by default, the grouping columns).
+
+    Args:
+        path (str): .xlsx, .csv or .parquet extract
+        chunksize (int): Rows per chunk
+        columns (list): Columns to read; None reads all of them
+
+    Yields:
+        pandas.DataFrame: The columns, in the given order
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif extension == '.csv':
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+    else:
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = list(next(rows))
+            if columns is None:
+                columns = [column for column in header if column is not None]
+            indexes = [header.index(column) for column in columns]
+            key = columns.index('Source JSON File') if 'Source JSON File' in columns else 0
+            chunk = []
+            for row in rows:
+                values = [row[index] if index < len(row) else None for index in indexes]
+                # Formatted but empty rows at the end of the sheet
+                if values[key] is None:
+                    continue
+                chunk.append(values)
+                if len(chunk) >= chunksize:
+                    yield pd.DataFrame(chunk, columns=columns)
+                    chunk = []
+            if chunk:
+                yield pd.DataFrame(chunk, columns=columns)
+        finally:
+            workbook.close()
+
+def iter_cached_extract(path, cache_dir=DATASET_CACHE_DIR, chunksize=100000, columns=EXTRACT_COLUMNS):
+    """
+    Stream columns of an extract, from the app's Parquet cache of it if it has been built.
+
+    Chunks read from the extract itself get their values converted the way
+    the cache stores them (see utils.build_dataset_cache).
+
+    Args:
+        path (str): .xlsx, .csv or .parquet extract
+        cache_dir (str): Directory of its Parquet cache
+        chunksize (int): Rows per chunk
+        columns (list): Columns to read
+
+    Yields:
+        pandas.DataFrame: The columns, in the given order
+    """
+    cache_path = dataset_cache_path(path, cache_dir)
+    if os.path.exists(cache_path):
+        yield from iter_extract(cache_path, chunksize, columns)
+    else:
+        for chunk in iter_extract(path, chunksize, columns):
+            yield _to_columnar(chunk)
+
+def _days(path, cache_dir, chunksize):
+    """
+    Day (YYYY-MM-DD) of each distinct date in an extract.
+
+    The dates are parsed together, as the review page parses a dataset's
+    (whether numeric dates are day or month first is read off all of them).
+    """
+    dates = set()
+    for chunk in iter_cached_extract(path, cache_dir, chunksize, columns=['Date']):
+        dates.update(_as_text(chunk['Date']).dropna())
+    if not dates:
+        return {}
+    text = pd.Series(sorted(dates), dtype="string")
+    return dict(zip(text, _parse_dates(text).dt.strftime('%Y-%m-%d')))
+
+def find_extracts(extracts=None, manifest_path=SHARD_MANIFEST_PATH):
+    """
+    The extracts to score: the given ones, or else the dataset the review
+    page would show, without its JSON drop receipts (see shards.open_dataset).
+
+    Args:
+        extracts (list): Extract paths, or None
+        manifest_path (str): Shard manifest
+
+    Returns:
+        list: (extract path, Parquet cache directory) pairs; empty if there is no dataset
+    """
+    if extracts:
+        return [(path, DATASET_CACHE_DIR) for path in extracts]
+    catalog = ShardCatalog(manifest_path)
+    if catalog.refresh():
+        return catalog.extracts()
+    for path in WORKBOOK_PATHS + [UPLOADED_DATASET_PATH]:
+        if os.path.exists(path):
+            return [(path, DATASET_CACHE_DIR)]
+    return []
+
+def score(extracts, store, chunksize=100000):
+    """
+    Compute the accuracy reports for extracts and their stored verdicts.
+
+    Args:
+        extracts (list): (extract path, Parquet cache directory) pairs, see find_extracts()
+        store (VerificationStore): The verdicts
+        chunksize (int): Rows read and looked up in the store at a time
+
+    Returns:
+        dict: Report name -> pandas.DataFrame
+    """
+    overall, by_store, by_date = [], [], []
+    for path, cache_dir in extracts:
+        days = _days(path, cache_dir, chunksize)
+        for chunk in iter_cached_extract(path, cache_dir, chunksize):
+            verdicts = store.verdicts_for(chunk['Source JSON File'].astype(str).tolist())
+            verdicts['Store name'] = chunk['Store name'].to_numpy(dtype=object)
+            verdicts['Day'] = _as_text(chunk['Date']).map(days).to_numpy(dtype=object)
+            overall.append(aggregate(verdicts))
+            by_store.append(aggregate(verdicts, by='Store name'))
+            by_date.append(aggregate(verdicts, by='Day'))
+    if not overall:
+        return {}
+    return {
+        'accuracy_overall': finalize(combine(overall)),
+        'accuracy_by_store': finalize(combine(by_store)),
+        'accuracy_by_date': finalize(combine(by_date)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=VERIFICATION_DB_PATH)
+    parser.add_argument("--out", default="reports")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--chunksize", type=int, default=100000)
+    parser.add_argument("--extract", action="append",
+                        help="Extract to score (repeatable); by default the dataset the review page shows")
+    args = parser.parse_args()
+
+    extracts = find_extracts(args.extract)
+    missing = [path for path, _ in extracts if not os.path.exists(path)]
+    if not extracts or missing:
+        sys.exit(f"No dataset to score: {', '.join(missing) or 'no shard manifest, extract workbook or upload'}")
+
+    reports = score(extracts, VerificationStore(args.db), args.chunksize)
+    os.makedirs(args.out, exist_ok=True)
+    for name, report in reports.items():
+        path = os.path.join(args.out, f"{name}.{args.format}")
+        if args.format == "parquet":
+            report.to_parquet(path)
+        else:
+            report.to_csv(path, encoding="utf-8-sig")
+        print(f"{path}: {len(report)} rows")
+
+if __name__ == "__main__":
+    main()
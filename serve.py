@@ -0,0 +1,210 @@
+"""
+Entry point for deployments: starts the streamlit server for app.py and
+warms the process-wide caches in the background as soon as it is up.
+
+An autoscale deployment starts a fresh process for the first visitor after
+an idle spell. Under a plain `streamlit run app.py`, nothing past the
+server itself is loaded until that visitor's first page run, which then
+imports the app's modules, loads the dataset, derives the fields, triage
+and search index, syncs the verification store and renders a preview
+before anything shows. Here the same work starts the moment the server
+accepts connections, while the browser is still loading the page shell, so
+the first page run finds the caches filled (or waits on the st.cache_resource
+entry being built rather than starting over). The warm-up waits for the
+server so it doesn't delay the port opening: both are CPU-bound and would
+only take turns on the GIL.
+
+app.py and utils.py import pandas and numpy at module level on purpose:
+every page run needs them for the dataset, so importing them lazily would
+only move the cost into the first run. Here the warm-up's "import" step
+takes it off the first visitor instead. PIL and requests are imported
+where images are loaded.
+
+The deployment's build step runs the warm-up once ahead of time
+(--warm-only), so even the first process finds the dataset cache and the
+previews of the first receipts on disk. With a shard manifest (see
+shards.py) that also registers every new shard, so no visitor waits for it;
+the warm-up then loads only the shard reviewers start in.
+
+Each step's time is logged as one JSON line on the "receipt_review.startup"
+logger (stderr) and reported on the metrics endpoint as
+receipt_startup_<step>_seconds when RECEIPT_METRICS=1.
+
+Usage:
+    python serve.py [streamlit run options, e.g. --server.port 5000]
+    python serve.py --warm-only     # run the warm-up once, in the foreground, and exit
+"""
+import contextlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Taken before any heavy import, so the timings count from process start
+_BOOT = time.perf_counter()
+
+# RECEIPT_WARMUP=0 starts the server without warming the caches
+WARMUP_ENABLED = os.environ.get("RECEIPT_WARMUP", "1").lower() not in ("", "0", "false", "no")
+
+# Previews rendered at boot, in the order reviewers will be given them
+WARMUP_PREVIEWS = int(os.environ.get("RECEIPT_WARMUP_PREVIEWS", "10"))
+
+# How long the warm-up waits for the server before giving up
+WARMUP_SERVER_TIMEOUT = 60
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+logger = logging.getLogger("receipt_review.startup")
+
+# Step name -> seconds, filled in as the warm-up runs ('server' and 'ready' count from process start)
+STARTUP_TIMINGS = {}
+
+@contextlib.contextmanager
+def _step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round(time.perf_counter() - start, 4)
+
+def _first_shown(positions, shard, count):
+    """
+    Shard positions new sessions will show first: the first unverified receipt
+    (where a session opens), then the lease order within its shard (see VerificationStore.lease_batch).
+
+    Args:
+        positions (numpy.ndarray): Unverified dataset positions
+        shard (shards.Shard): The shard of the first of them
+    """
+    import numpy as np
+
+    positions = positions[(positions >= shard.offset) & (positions < shard.offset + len(shard))] - shard.offset
+    triage = shard.triage
+    leased = positions[np.argsort(-triage.priority[positions], kind='stable')] if triage is not None else positions
+    return list(dict.fromkeys(positions[:1].tolist() + leased[:count].tolist()))[:count]
+
+def warm_up(preview_count=WARMUP_PREVIEWS, visitor_connected=lambda: False):
+    """
+    Fill the caches the first page run reads, timing each step.
+
+    Runs the same cached calls as app.py with the same arguments, so the
+    page gets the very objects built here, or waits for the one being built.
+
+    Args:
+        preview_count (int): Receipts whose previews are rendered and cached
+        visitor_connected (callable): True once a session is open; previews
+            are then left to the page's prefetcher, which knows what is next
+
+    Returns:
+        dict: Step name -> seconds (also kept in STARTUP_TIMINGS)
+    """
+    with _step("import"):
+        import metrics
+        import utils
+        from image_sources import get_image_source
+        from shards import get_shard_catalog, open_dataset
+        from verification_store import get_verification_store
+        # utils imports it lazily; the first page's st.image and preview need it and its format plugins
+        import PIL.Image
+        PIL.Image.init()
+
+    metrics.serve()
+    metrics.REGISTRY.register_collector("startup", lambda: {f"{name}_seconds": seconds
+                                                            for name, seconds in STARTUP_TIMINGS.items()})
+
+    if not get_shard_catalog().refresh() and not any(
+            os.path.exists(path) for path in ("data/data_ocr_extract.xlsx", "data_ocr_extract.xlsx",
+                                              utils.UPLOADED_DATASET_PATH, utils.JSON_DROP_DIR,
+                                              utils.JSON_INGEST_DIR)):
+        # Nothing to load until someone uploads a workbook on the page
+        return STARTUP_TIMINGS
+
+    with _step("dataset"):
+        dataset = open_dataset()
+
+    # Registering a sharded dataset loads (and caches on disk) each shard the store doesn't have yet
+    with _step("store"):
+        store = get_verification_store()
+        dataset.register(store)
+        positions = store.unverified_positions()
+    if len(dataset) == 0:
+        return STARTUP_TIMINGS
+
+    with _step("derived"):
+        shard = dataset.load(dataset.shard_at(int(positions[0]) if len(positions) else 0).name)
+        positions = _first_shown(positions, shard, preview_count)
+
+    with _step("previews"):
+        json_files = shard.data['Source JSON File']
+        # Images in an object store are downloaded all at once, over the source's connection pool
+        get_image_source(shard.image_source).fetch_many(json_files.iloc[positions].tolist())
+        for position in positions:
+            if visitor_connected():
+                break
+            utils.get_receipt_preview_bytes(json_files.iat[position], shard.image_source)
+
+    return STARTUP_TIMINGS
+
+def _wait_for_server(timeout=WARMUP_SERVER_TIMEOUT):
+    """Wait until the streamlit server reports itself healthy, as the deployment's health check sees it."""
+    import urllib.request
+
+    from streamlit import config, runtime
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # The runtime exists once the command line options are in the config
+        if runtime.exists():
+            address = config.get_option("server.address") or "127.0.0.1"
+            path = "/".join(filter(None, [config.get_option("server.baseUrlPath").strip("/"), "_stcore/health"]))
+            url = f"http://{address}:{config.get_option('server.port')}/{path}"
+            try:
+                urllib.request.urlopen(url, timeout=1).close()
+                STARTUP_TIMINGS["server"] = round(time.perf_counter() - _BOOT, 4)
+                return True
+            except OSError:
+                pass
+        time.sleep(0.01)
+    return False
+
+def _visitor_connected():
+    from streamlit import runtime
+
+    return runtime.exists() and runtime.get_instance().state == runtime.RuntimeState.ONE_OR_MORE_SESSIONS_CONNECTED
+
+def _warm_up_in_background():
+    if not _wait_for_server():
+        return
+    try:
+        warm_up(visitor_connected=_visitor_connected)
+        STARTUP_TIMINGS["ready"] = round(time.perf_counter() - _BOOT, 4)
+        logger.info(json.dumps(dict(STARTUP_TIMINGS, event="warmup")))
+    except Exception as e:
+        # The page loads everything itself anyway; a failed warm-up only costs the first visitor time
+        logger.warning(json.dumps({'event': "warmup", 'error': str(e) or type(e).__name__,
+                                   **STARTUP_TIMINGS}))
+
+def main():
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    if sys.argv[1:] == ["--warm-only"]:
+        warm_up()
+        print(json.dumps(dict(STARTUP_TIMINGS, total=round(time.perf_counter() - _BOOT, 4))))
+        return
+
+    from streamlit.web import cli as stcli
+
+    if WARMUP_ENABLED:
+        threading.Thread(target=_warm_up_in_background, name="receipt-warmup", daemon=True).start()
+
+    sys.argv = ["streamlit", "run", APP_SCRIPT] + sys.argv[1:]
+    sys.exit(stcli.main())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,418 @@
+"""
+Datasets made of several batches (shards) of receipts, listed in a manifest.
+
+The manifest (data/shards.json, or RECEIPT_SHARD_MANIFEST) lists the
+batches in review order, each with its own extract workbook and image
+directory or object store URL ("images" defaults to receipts_raw next to the
+extract; see image_sources.py):
+
+    {"shards": [
+        {"name": "2025-01", "extract": "data/2025-01/data_ocr_extract.xlsx",
+         "images": "data/2025-01/receipts_raw"},
+        {"name": "2025-02", "extract": "data/2025-02/data_ocr_extract.xlsx",
+         "images": "https://receipts.example.com/2025-02/"},
+        {"name": "2025-03", "extract": "data/2025-03/data_ocr_extract.xlsx"}
+    ]}
+
+The shards share one position space: a shard's receipts take the dataset
+positions after those of the shards before it, so the verification store,
+the review cursor and the picker keep working on dataset positions, and a
+new batch appended to the manifest leaves every earlier position in place.
+
+Only the shards being reviewed are held in memory. A shard is loaded (from
+its Parquet cache, see utils.build_dataset_cache) with its fields, search
+index, triage and duplicates when a session first needs it, and evicted once
+nobody has used it for SHARD_IDLE_SECONDS, or when more than
+SHARD_MAX_LOADED shards are loaded. Registering a new or changed shard in
+the verification store loads it once; the store then keeps its version, so
+a restart doesn't load it again. A shard that only moved (one before it
+changed size) has its positions shifted in the store without being loaded.
+
+Without a manifest, the extract workbook (plus the JSON drop, see
+ingest.py) is reviewed as a dataset of one shard.
+"""
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+
+import metrics
+from dedup import ReceiptDuplicates, get_receipt_duplicates
+from utils import (build_dataset_cache, get_receipt_fields, get_search_index, load_dataset, ReceiptFields,
+                   ReceiptSearchIndex, DATASET_CACHE_DIR, IMAGE_SOURCE, _file_signature)
+from validation import get_receipt_triage, ReceiptTriage, TRIAGE_ENABLED
+
+SHARD_MANIFEST_PATH = os.environ.get("RECEIPT_SHARD_MANIFEST", os.path.join("data", "shards.json"))
+
+# Shards held in memory at once, and how long an unused one stays loaded
+SHARD_MAX_LOADED = int(os.environ.get("RECEIPT_SHARD_MAX_LOADED", "2"))
+SHARD_IDLE_SECONDS = float(os.environ.get("RECEIPT_SHARD_IDLE_SECONDS", "600"))
+
+# Parquet caches of the shards' extracts, one directory per shard
+SHARD_CACHE_DIR = os.path.join(DATASET_CACHE_DIR, "shards")
+
+class ShardInfo:
+    """
+    A shard as listed in the manifest and, once registered, its place in the dataset.
+    """
+
+    def __init__(self, name, extract, images, signature=None):
+        self.name = name
+        self.extract = extract
+        self.images = images
+        # (size, mtime_ns) of the extract, checked against the store's copy when registering
+        self.signature = signature
+        self.offset = 0
+        self.rows = 0
+
+    @property
+    def version(self):
+        """The key the shard is registered in the store under; changes with the extract (its place is kept apart)."""
+        return f"{self.signature[0]}:{self.signature[1]}"
+
+class Shard:
+    """
+    A loaded shard: its receipts and everything derived from them.
+
+    fields, search_index, triage and duplicates take shard positions, i.e.
+    dataset position - offset.
+    """
+
+    def __init__(self, name, receipts_data, image_source, offset, fields, search_index, triage, duplicates,
+                 version=None):
+        self.name = name
+        self.data = receipts_data
+        self.image_source = image_source
+        self.offset = offset
+        self.fields = fields
+        self.search_index = search_index
+        self.triage = triage
+        self.duplicates = duplicates
+        self.version = version
+
+    def __len__(self):
+        return len(self.data)
+
+    def contains(self, position):
+        """Whether a dataset position is one of this shard's receipts."""
+        return self.offset <= position < self.offset + len(self.data)
+
+def count_by_shard(dataset, positions):
+    """
+    Args:
+        dataset (ShardCatalog or SingleDataset): The dataset
+        positions (numpy.ndarray): Sorted dataset positions, e.g. the unverified ones
+
+    Returns:
+        numpy.ndarray: How many of them fall in each shard, in dataset.shards order
+    """
+    bounds = [info.offset for info in dataset.shards] + [len(dataset)]
+    return np.diff(np.searchsorted(positions, bounds))
+
+class SingleDataset:
+    """
+    The extract workbook (plus the JSON drop) as a dataset of one shard, named ''.
+
+    Its derived data comes from the process-wide caches in utils, validation
+    and dedup, so it is shared with every session as before. key identifies
+    the data's version (see utils.load_dataset).
+    """
+
+    def __init__(self, receipts_data, key):
+        self.data = receipts_data
+        self.key = key
+        info = ShardInfo('', None, IMAGE_SOURCE)
+        info.rows = len(receipts_data)
+        self.shards = [info]
+
+    def __len__(self):
+        return len(self.data)
+
+    def shard_at(self, position):
+        return self.shards[0]
+
+    def load(self, name=''):
+        fields = get_receipt_fields(self.data, self.key)
+        triage = get_receipt_triage(self.data, self.key) if TRIAGE_ENABLED else None
+        return Shard('', self.data, IMAGE_SOURCE, 0, fields, get_search_index(self.data, self.key), triage,
+                     get_receipt_duplicates(self.data, self.key))
+
+    def register(self, store):
+        """Sync the store with the dataset (once per dataset version)."""
+        triage = get_receipt_triage(self.data, self.key) if TRIAGE_ENABLED else None
+        store.sync(self.data['Source JSON File'], key=self.key, priorities=triage.priority if triage else None)
+
+class ShardCatalog:
+    """
+    The shards in the manifest, loaded on demand and evicted when idle.
+
+    The manifest and the extracts it lists are checked for changes at most
+    once every check_interval seconds. Changes take effect when register()
+    has placed the shards; until then the previous shards are served.
+    Concurrent loads of the same shard wait for one another, like
+    st.cache_resource entries.
+    """
+
+    def __init__(self, manifest_path=SHARD_MANIFEST_PATH, max_loaded=SHARD_MAX_LOADED,
+                 idle_seconds=SHARD_IDLE_SECONDS, cache_dir=SHARD_CACHE_DIR, check_interval=2.0):
+        self.manifest_path = manifest_path
+        self.max_loaded = max_loaded
+        self.idle_seconds = idle_seconds
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self.shards = []
+        self.loads = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._register_lock = threading.Lock()
+        self._load_locks = {}
+        self._by_name = {}
+        self._ends = np.zeros(0, dtype=np.int64)
+        # The shards as last read, published (with _ends) by register()
+        self._manifest = []
+        self._loaded = OrderedDict()
+        self._last_used = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._registered = None
+        self._sweeper = None
+
+    def __len__(self):
+        return int(self._ends[-1]) if len(self._ends) else 0
+
+    def _read_manifest(self):
+        with open(self.manifest_path, encoding="utf-8") as f:
+            entries = json.load(f).get('shards', [])
+        shards = []
+        for entry in entries:
+            name, extract = entry.get('name'), entry.get('extract')
+            if not name or not extract:
+                raise ValueError(f"{self.manifest_path}: every shard needs a name and an extract")
+            images = entry.get('images') or os.path.join(os.path.dirname(extract), "receipts_raw")
+            shards.append(ShardInfo(str(name), extract, images))
+        names = [info.name for info in shards]
+        if len(set(names)) != len(names):
+            raise ValueError(f"{self.manifest_path}: shard names must be unique")
+        return shards
+
+    def refresh(self):
+        """
+        Pick up changes to the manifest or to the shards' extracts.
+
+        Returns:
+            bool: True if there is a manifest listing at least one shard
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._signature is not None and now - self._checked_at < self.check_interval:
+                return bool(self._manifest)
+            self._checked_at = now
+            try:
+                manifest_signature = _file_signature(self.manifest_path)
+            except OSError:
+                manifest_signature = None
+            if manifest_signature is None:
+                shards = []
+            elif self._signature is not None and manifest_signature == self._signature[0]:
+                shards = [ShardInfo(info.name, info.extract, info.images) for info in self._manifest]
+            else:
+                shards = self._read_manifest()
+            for info in shards:
+                info.signature = _file_signature(info.extract)
+            signature = (manifest_signature, tuple((info.name, info.extract, info.images, info.signature)
+                                                   for info in shards))
+            if signature != self._signature:
+                self._signature = signature
+                self._manifest = shards
+            return bool(self._manifest)
+
+    def register(self, store):
+        """
+        Give each shard its place in the dataset and make sure the store has its receipts.
+
+        Shards the store has already registered at the same version and place
+        are not loaded. Receipts of shards no longer in the manifest leave the
+        dataset (see VerificationStore.retire_shards). Runs once per manifest
+        and extract version, so it can be called on every rerun.
+        """
+        signature = self._signature
+        if self._registered == (signature, id(store)):
+            return
+        with self._register_lock:
+            with self._lock:
+                signature, shards = self._signature, self._manifest
+            if self._registered == (signature, id(store)):
+                return
+            versions = store.shard_versions()
+            # Worked out first, then published under self._lock together with _ends
+            places = []
+            offset = 0
+            for info in shards:
+                registered = versions.get(info.name)
+                if registered is not None and registered[0] == info.version:
+                    rows = registered[2]
+                    if registered[1] != offset:
+                        # Unchanged, but a shard before it changed size or left: only its positions move
+                        store.move_shard(info.name, offset)
+                else:
+                    # New or changed: loaded once to register its receipts, then dropped
+                    shard = self._build(info, offset)
+                    store.sync(shard.data['Source JSON File'], key=info.version,
+                               priorities=shard.triage.priority if shard.triage else None,
+                               shard=info.name, offset=offset)
+                    rows = len(shard)
+                    del shard
+                places.append((offset, rows))
+                offset += rows
+            store.retire_shards([info.name for info in shards])
+
+            with self._lock:
+                for info, (info_offset, rows) in zip(shards, places):
+                    info.offset, info.rows = info_offset, rows
+                self.shards = shards
+                self._by_name = {info.name: info for info in shards}
+                self._ends = np.cumsum([rows for _, rows in places], dtype=np.int64)
+                # Loaded copies of shards that changed or moved are out of date
+                for name, shard in list(self._loaded.items()):
+                    info = self._by_name.get(name)
+                    if info is None or shard.offset != info.offset or len(shard) != info.rows \
+                            or shard.version != info.version:
+                        self._drop(name)
+                self._registered = (signature, id(store))
+
+    def shard_at(self, position):
+        """
+        Returns:
+            ShardInfo: The shard holding a dataset position (the last one for positions past the end)
+        """
+        with self._lock:
+            index = bisect.bisect_right(self._ends, position)
+            return self.shards[min(index, len(self.shards) - 1)]
+
+    def extracts(self):
+        """
+        Returns:
+            list: (extract path, Parquet cache directory) of each shard in the manifest, in order
+        """
+        with self._lock:
+            return [(info.extract, self._cache_dir(info)) for info in self._manifest]
+
+    def _cache_dir(self, info):
+        return os.path.join(self.cache_dir, re.sub(r'[^\w.-]', '_', info.name))
+
+    def _build(self, info, offset=None):
+        cache_dir = self._cache_dir(info)
+        with metrics.span("shard_load"):
+            receipts_data = build_dataset_cache(info.extract, cache_dir)
+            fields = ReceiptFields(receipts_data)
+            triage = ReceiptTriage(receipts_data, fields) if TRIAGE_ENABLED else None
+            return Shard(info.name, receipts_data, info.images, info.offset if offset is None else offset, fields,
+                         ReceiptSearchIndex(receipts_data), triage, ReceiptDuplicates(receipts_data), info.version)
+
+    def load(self, name):
+        """
+        A shard's receipts and derived data, loading the shard if it isn't loaded.
+
+        Loading one shard may evict the least recently used one.
+
+        Args:
+            name (str): Shard name, as in the manifest
+
+        Returns:
+            Shard: The loaded shard
+        """
+        with self._lock:
+            shard = self._touch(name)
+            if shard is not None:
+                return shard
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            with self._lock:
+                shard = self._touch(name)
+                if shard is not None:
+                    return shard
+                info = self._by_name[name]
+                # Make room first, so the new shard isn't built while max_loaded others are still held
+                while self._loaded and len(self._loaded) >= max(self.max_loaded, 1):
+                    self._drop(next(iter(self._loaded)))
+            shard = self._build(info)
+            with self._lock:
+                self._loaded[name] = shard
+                self._last_used[name] = time.monotonic()
+                self.loads += 1
+                while len(self._loaded) > max(self.max_loaded, 1):
+                    self._drop(next(iter(self._loaded)))
+                if self._sweeper is None:
+                    self._sweeper = threading.Thread(target=self._sweep_loop, name="receipt-shards", daemon=True)
+                    self._sweeper.start()
+        return shard
+
+    def _touch(self, name):
+        # Caller must hold self._lock
+        shard = self._loaded.get(name)
+        if shard is not None:
+            self._loaded.move_to_end(name)
+            self._last_used[name] = time.monotonic()
+        return shard
+
+    def _drop(self, name):
+        # Caller must hold self._lock. Sessions still using the shard keep it until their rerun ends.
+        del self._loaded[name]
+        del self._last_used[name]
+        self.evictions += 1
+
+    def evict_idle(self):
+        """Unload the shards nobody has used for idle_seconds."""
+        with self._lock:
+            now = time.monotonic()
+            for name in [name for name, used in self._last_used.items() if now - used > self.idle_seconds]:
+                self._drop(name)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(min(self.idle_seconds / 4, 60))
+            self.evict_idle()
+
+    def stats(self):
+        """
+        Returns:
+            dict: shards, loaded, loads and evictions
+        """
+        with self._lock:
+            return {
+                'shards': len(self.shards),
+                'loaded': len(self._loaded),
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_shard_catalog(manifest_path=SHARD_MANIFEST_PATH):
+    """
+    Shard catalog shared by every session in this process.
+
+    Returns:
+        ShardCatalog: The catalog for manifest_path (empty while there is no manifest)
+    """
+    catalog = ShardCatalog(manifest_path)
+    metrics.REGISTRY.register_collector("shards", catalog.stats)
+    return catalog
+
+def open_dataset():
+    """
+    The dataset to review: the shards in the manifest, or else the extract
+    workbook as loaded by load_dataset (which asks for an upload if there is none).
+
+    Returns:
+        ShardCatalog or SingleDataset: The dataset
+    """
+    catalog = get_shard_catalog()
+    if catalog.refresh():
+        return catalog
+    return SingleDataset(*load_dataset())
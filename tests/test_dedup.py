@@ -0,0 +1,70 @@
+import random
+
+from PIL import Image
+
+from dedup import DuplicateDetector, HammingIndex
+
+BITS = 64
+
+def _flip(value, *bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+def test_neighbours_match_a_brute_force_scan():
+    rng = random.Random(0)
+    values = [rng.getrandbits(BITS) for _ in range(500)]
+    values += [_flip(value, *rng.sample(range(BITS), rng.randint(0, 6))) for value in values[:100]]
+    index = HammingIndex(BITS, max_distance=6)
+    for key, value in enumerate(values):
+        index.add(key, value)
+
+    for query in values[::7]:
+        expected = {key: (value ^ query).bit_count() for key, value in enumerate(values)
+                    if (value ^ query).bit_count() <= 6}
+        assert dict(index.neighbours(query)) == expected
+
+def test_clusters_join_chains_of_near_duplicates():
+    index = HammingIndex(BITS, max_distance=2)
+    base = 0
+    # a ~ b and b ~ c, though a and c are 4 bits apart
+    index.add("c", _flip(base, 0, 1, 2, 3))
+    index.add("a", base)
+    index.add("b", _flip(base, 0, 1))
+    index.add("far", _flip(base, *range(20, 40)))
+
+    assert index.clusters() == {"a": ["a", "b", "c"]}
+    assert index.cluster("c") == "a"
+    assert index.cluster("far") == "far"
+
+def test_cluster_roots_do_not_depend_on_insertion_order():
+    values = {key: _flip(0, *range(index)) for index, key in enumerate([3, 1, 2])}
+    forward, backward = HammingIndex(BITS, max_distance=1), HammingIndex(BITS, max_distance=1)
+    for key in values:
+        forward.add(key, values[key])
+    for key in reversed(list(values)):
+        backward.add(key, values[key])
+
+    assert forward.clusters() == backward.clusters() == {1: [1, 2, 3]}
+
+def test_readded_key_keeps_its_first_hash():
+    index = HammingIndex(BITS, max_distance=1)
+    index.add("a", 0)
+
+    assert index.add("a", _flip(0, *range(30))) == []
+    assert len(index) == 1
+    assert index.neighbours(0) == [("a", 0)]
+
+def test_refresh_reports_removed_images(tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for name, shade in [("a.png", 0), ("b.png", 255)]:
+        Image.new("L", (32, 32), shade).save(image_dir / name)
+    detector = DuplicateDetector(str(image_dir), str(tmp_path / "cache"), workers=1)
+    assert detector.refresh() == 2
+    assert detector.refresh() == 0
+
+    (image_dir / "b.png").unlink()
+
+    assert detector.refresh() == 1
+    assert len(detector.index) == 1
@@ -0,0 +1,70 @@
+import pandas as pd
+from openpyxl import load_workbook
+
+from export import compact, iter_log, VerdictLog
+from verification_store import STATUS_CANCELLED, STATUS_VERIFIED
+
+ALL_TICKED = [1, 1, 1, 1, 1, 1]
+
+def _log(directory, *records):
+    log = VerdictLog(str(directory))
+    for record in records:
+        if record[0] == 'reset':
+            log.record_reset(*record[1:])
+        else:
+            json_file, status, reviewer, at = record
+            checks = None if status == STATUS_CANCELLED else ALL_TICKED
+            log.record_verdict(json_file, status, None if checks is None else sum(checks), checks, reviewer, at)
+    log.close()
+    return log.path
+
+def _verdicts(tmp_path):
+    compact(str(tmp_path / "log"), str(tmp_path / "out"))
+    verdicts = pd.read_parquet(tmp_path / "out" / "verdicts.parquet")
+    return dict(zip(verdicts['json_file'], zip(verdicts['status'], verdicts['reviewer'])))
+
+def test_latest_verdict_wins_across_files(tmp_path):
+    # Two processes' files; the later verdict is in the earlier file
+    _log(tmp_path / "log", ("a.json", STATUS_VERIFIED, "r1", 200.0))
+    _log(tmp_path / "log", ("a.json", STATUS_CANCELLED, "r2", 100.0), ("b.json", STATUS_VERIFIED, "r2", 150.0))
+
+    assert _verdicts(tmp_path) == {"a.json": (STATUS_VERIFIED, "r1"), "b.json": (STATUS_VERIFIED, "r2")}
+
+def test_reviewer_reset_voids_only_their_earlier_verdicts(tmp_path):
+    _log(tmp_path / "log",
+         ("a.json", STATUS_VERIFIED, "r1", 100.0),
+         ("b.json", STATUS_VERIFIED, "r2", 110.0),
+         ('reset', 120.0, "r1"),
+         ("c.json", STATUS_CANCELLED, "r1", 130.0))
+
+    assert _verdicts(tmp_path) == {"b.json": (STATUS_VERIFIED, "r2"), "c.json": (STATUS_CANCELLED, "r1")}
+
+def test_full_reset_voids_every_earlier_verdict(tmp_path):
+    _log(tmp_path / "log",
+         ("a.json", STATUS_VERIFIED, "r1", 100.0),
+         ("b.json", STATUS_VERIFIED, "r2", 110.0),
+         ('reset', 120.0),
+         ("b.json", STATUS_CANCELLED, "r1", 130.0))
+
+    assert _verdicts(tmp_path) == {"b.json": (STATUS_CANCELLED, "r1")}
+
+def test_torn_last_line_is_skipped(tmp_path):
+    path = _log(tmp_path / "log", ("a.json", STATUS_VERIFIED, "r1", 100.0))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"event":"verdict","json_file":"b.js')
+
+    assert [record['json_file'] for record in iter_log(str(tmp_path / "log"))] == ["a.json"]
+
+def test_merged_extract_gets_verdict_columns(tmp_path):
+    _log(tmp_path / "log", ("b.json", STATUS_VERIFIED, "r1", 100.0))
+    extract_path = tmp_path / "extract.csv"
+    pd.DataFrame({'Source JSON File': ["a.json", "b.json"], 'Store name': ["A", "B"]}).to_csv(extract_path, index=False)
+
+    written = compact(str(tmp_path / "log"), str(tmp_path / "out"), str(extract_path), chunksize=1)
+
+    merged_path = str(tmp_path / "out" / "extract_reviewed.xlsx")
+    assert written[merged_path] == 2
+    rows = list(load_workbook(merged_path).active.iter_rows(values_only=True))
+    header = rows[0]
+    assert [row[header.index('Review Status')] for row in rows[1:]] == [None, "Verified"]
+    assert rows[2][header.index('Reviewer')] == "r1"
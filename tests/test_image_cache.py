@@ -0,0 +1,42 @@
+from utils import ImageCache
+
+def _loader(value, nbytes):
+    return lambda: (value, nbytes)
+
+def test_hit_returns_cached_value_without_loading():
+    cache = ImageCache(max_bytes=100)
+    assert cache.get('a', _loader('first', 10)) == 'first'
+    assert cache.get('a', _loader('second', 10)) == 'first'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_evicts_least_recently_used_over_budget():
+    cache = ImageCache(max_bytes=30)
+    cache.get('a', _loader('a', 10))
+    cache.get('b', _loader('b', 10))
+    cache.get('c', _loader('c', 10))
+    # Touch 'a' so 'b' is the least recently used
+    cache.get('a', _loader('a2', 10))
+    cache.get('d', _loader('d', 10))
+
+    stats = cache.stats()
+    assert stats['evictions'] == 1
+    assert stats['bytes'] == 30
+    assert cache.get('b', _loader('b2', 10)) == 'b2'
+    assert cache.get('a', _loader('a3', 10)) == 'a'
+
+def test_entry_larger_than_budget_is_returned_but_not_stored():
+    cache = ImageCache(max_bytes=10)
+    cache.get('small', _loader('small', 5))
+    assert cache.get('big', _loader('big', 50)) == 'big'
+
+    stats = cache.stats()
+    assert stats['entries'] == 1
+    assert stats['bytes'] == 5
+    assert stats['evictions'] == 0
+
+def test_clear_drops_everything():
+    cache = ImageCache(max_bytes=100)
+    cache.get('a', _loader('a', 10))
+    cache.clear()
+    assert cache.stats()['bytes'] == 0
+    assert cache.get('a', _loader('again', 10)) == 'again'
@@ -0,0 +1,165 @@
+import hashlib
+import http.server
+import os
+import threading
+from urllib.parse import unquote
+
+import pytest
+
+from image_sources import HttpImageSource
+
+class _Store(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.objects = {}
+        self.statuses = {}
+        # Object name -> called before the request is answered
+        self.hooks = {}
+        self.requests = []
+
+    def requests_for(self, name):
+        return [etag for requested, etag in self.requests if requested == name]
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        store = self.server
+        name = unquote(self.path.lstrip('/'))
+        store.requests.append((name, self.headers.get('If-None-Match')))
+        if name in store.hooks:
+            store.hooks[name]()
+        body = store.objects.get(name)
+        status = store.statuses.get(name, 404 if body is None else 200)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"' if body is not None else None
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            status = 304
+        self.send_response(status)
+        if status == 200:
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def store():
+    server = _Store()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def _source(store, tmp_path, **options):
+    return HttpImageSource(f"http://127.0.0.1:{store.server_address[1]}/receipts", cache_dir=str(tmp_path),
+                           pool_size=4, **options)
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_cold_fetch_downloads_and_a_fresh_copy_is_reused(store, tmp_path):
+    store.objects["receipts/a 1.jpg"] = b"a" * 100
+    source = _source(store, tmp_path, revalidate_seconds=60)
+
+    path = source.fetch("a 1.jpg")
+    assert _read(path) == b"a" * 100
+    assert source.fetch("a 1.jpg") == path
+
+    assert store.requests_for("receipts/a 1.jpg") == [None]
+    assert (source.downloads, source.hits, source.bytes_downloaded) == (1, 1, 100)
+
+def test_stale_copy_is_revalidated_with_its_etag(store, tmp_path):
+    store.objects["receipts/a.jpg"] = b"a" * 100
+    source = _source(store, tmp_path, revalidate_seconds=0)
+    path = source.fetch("a.jpg")
+
+    assert source.fetch("a.jpg") == path
+
+    first, second = store.requests_for("receipts/a.jpg")
+    assert first is None and second is not None
+    assert (source.downloads, source.not_modified) == (1, 1)
+    assert _read(path) == b"a" * 100
+
+def test_changed_object_is_downloaded_again(store, tmp_path):
+    store.objects["receipts/a.jpg"] = b"a" * 100
+    source = _source(store, tmp_path, revalidate_seconds=0)
+    path = source.fetch("a.jpg")
+    store.objects["receipts/a.jpg"] = b"b" * 50
+
+    assert source.fetch("a.jpg") == path
+    assert _read(path) == b"b" * 50
+    assert source.stats()['bytes'] == 50
+
+@pytest.mark.parametrize("status", [403, 404])
+def test_forbidden_or_absent_object_is_missing(store, tmp_path, status):
+    store.statuses["receipts/gone.jpg"] = status
+    source = _source(store, tmp_path, revalidate_seconds=60)
+
+    assert source.fetch("gone.jpg") is None
+    assert source.fetch("gone.jpg") is None
+
+    assert len(store.requests_for("receipts/gone.jpg")) == 1
+    assert source.errors == 0
+
+def test_least_recently_used_files_are_evicted_over_budget(store, tmp_path):
+    for name in "abc":
+        store.objects[f"receipts/{name}.jpg"] = name.encode() * 100
+    source = _source(store, tmp_path, max_bytes=250, revalidate_seconds=60)
+    paths = {name: source.fetch(f"{name}.jpg") for name in "ab"}
+    # Touch a, so b is the least recently used
+    source.fetch("a.jpg")
+
+    paths["c"] = source.fetch("c.jpg")
+
+    assert [os.path.exists(paths[name]) for name in "abc"] == [True, False, True]
+    assert source.stats()['entries'] == 2 and source.stats()['bytes'] == 200
+    assert source.evictions == 1
+    assert _read(source.fetch("b.jpg")) == b"b" * 100
+    assert len(store.requests_for("receipts/b.jpg")) == 2
+
+def test_concurrent_fetches_of_one_object_share_a_download(store, tmp_path):
+    store.objects["receipts/slow.jpg"] = b"s" * 100
+    requested, release = threading.Event(), threading.Event()
+    store.hooks["receipts/slow.jpg"] = lambda: requested.set() or release.wait(5)
+    source = _source(store, tmp_path, revalidate_seconds=60)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(source.fetch("slow.jpg"))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    assert requested.wait(5)
+
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 5 and len(set(results)) == 1
+    assert len(store.requests_for("receipts/slow.jpg")) == 1
+    assert _read(results[0]) == b"s" * 100
+
+def test_copy_evicted_during_revalidation_is_downloaded_again(store, tmp_path):
+    store.objects["receipts/a.jpg"] = b"a" * 100
+    source = _source(store, tmp_path, revalidate_seconds=0)
+    path = source.fetch("a.jpg")
+
+    def evict():
+        # Another download evicts it while the conditional request is in flight
+        del store.hooks["receipts/a.jpg"]
+        source._forget(os.path.basename(path))
+    store.hooks["receipts/a.jpg"] = evict
+
+    assert source.fetch("a.jpg") == path
+
+    assert _read(path) == b"a" * 100
+    _, revalidation, retry = store.requests_for("receipts/a.jpg")
+    assert revalidation is not None and retry is None
+    assert (source.downloads, source.not_modified) == (2, 0)
+    assert source.stats()['entries'] == 1
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import ingest
+from ingest import JsonDropIngestor, merge_receipts
+
+def _drop(drop_dir, name, **fields):
+    with open(os.path.join(drop_dir, name), "w", encoding="utf-8") as f:
+        json.dump(fields, f)
+
+@pytest.fixture
+def dirs(tmp_path):
+    drop_dir, ingest_dir = tmp_path / "json", tmp_path / "ingest"
+    drop_dir.mkdir()
+    return str(drop_dir), str(ingest_dir)
+
+def _ingestor(dirs):
+    return JsonDropIngestor(*dirs, workers=1, check_interval=0)
+
+def test_merge_receipts_keeps_first_position_and_last_values():
+    old = pd.DataFrame({'Source JSON File': ["a.json", "b.json"], 'Tax ID': ["1", "2"]})
+    new = pd.DataFrame({'Source JSON File': ["c.json", "a.json"], 'Tax ID': ["3", "9"]})
+
+    merged = merge_receipts([old, new])
+
+    assert merged['Source JSON File'].tolist() == ["a.json", "b.json", "c.json"]
+    assert merged['Tax ID'].tolist() == ["9", "2", "3"]
+
+def test_processes_keep_each_others_segments(dirs):
+    app, watcher = _ingestor(dirs), _ingestor(dirs)
+    _drop(dirs[0], "a.json", tax_id="1")
+    assert app.refresh(force=True) == 1
+    _drop(dirs[0], "b.json", tax_id="2")
+    # a.json was ingested by the other process, so only b.json is parsed
+    assert watcher.refresh(force=True) == 1
+    _drop(dirs[0], "c.json", tax_id="3")
+    assert app.refresh(force=True) == 1
+
+    assert app.data['Source JSON File'].tolist() == ["a.json", "b.json", "c.json"]
+    restarted = _ingestor(dirs)
+    assert restarted.data['Source JSON File'].tolist() == ["a.json", "b.json", "c.json"]
+
+def test_compaction_keeps_other_processes_working(dirs, monkeypatch):
+    monkeypatch.setattr(ingest, "INGEST_MAX_SEGMENTS", 2)
+    app, watcher = _ingestor(dirs), _ingestor(dirs)
+    for index in range(4):
+        _drop(dirs[0], f"{index}.json", tax_id=str(index))
+        (app if index % 2 else watcher).refresh(force=True)
+    with open(os.path.join(dirs[1], "segments.json")) as f:
+        assert len(json.load(f)) <= 2
+
+    _drop(dirs[0], "4.json", tax_id="4")
+    assert app.refresh(force=True) == 1
+    assert watcher.refresh(force=True) == 0
+    assert watcher.data['Source JSON File'].tolist() == [f"{index}.json" for index in range(5)]
+    assert len(_ingestor(dirs).data) == 5
+
+def test_missing_segment_is_skipped_and_rebuilt(dirs):
+    ingestor = _ingestor(dirs)
+    _drop(dirs[0], "a.json", tax_id="1")
+    ingestor.refresh(force=True)
+    _drop(dirs[0], "b.json", tax_id="2")
+    ingestor.refresh(force=True)
+    os.remove(os.path.join(dirs[1], ingestor._segments[0]))
+
+    restarted = _ingestor(dirs)
+    assert restarted.data['Source JSON File'].tolist() == ["b.json"]
+    assert restarted.refresh(force=True) == 1
+    assert sorted(restarted.data['Source JSON File']) == ["a.json", "b.json"]
+
+def test_file_rewritten_in_place_is_picked_up_on_the_rescan(dirs):
+    app = JsonDropIngestor(*dirs, workers=1, check_interval=0, rescan_interval=3600)
+    _drop(dirs[0], "a.json", tax_id="1")
+    assert app.refresh() == 1
+    dir_stat = os.stat(dirs[0])
+    _drop(dirs[0], "a.json", tax_id="12")
+    # Writing over a file leaves the directory's mtime alone
+    os.utime(dirs[0], ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+
+    assert app.refresh() == 0
+    app.rescan_interval = 0
+    assert app.refresh() == 1
+    assert app.data['Tax ID'].tolist() == ["12"]
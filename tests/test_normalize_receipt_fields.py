@@ -0,0 +1,38 @@
+import pandas as pd
+
+from utils import normalize_receipt_fields, MISSING_VALUE
+
+def _fields(**columns):
+    rows = len(next(iter(columns.values())))
+    data = {column: [None] * rows for column in
+            ['Source JSON File', 'Tax ID', 'Receipt Number', 'Date', 'Time', 'Total Amount', 'Store name']}
+    data.update({column.replace('_', ' '): values for column, values in columns.items()})
+    return normalize_receipt_fields(pd.DataFrame(data))
+
+def test_day_first_dates_are_read_day_first():
+    fields = _fields(Date=["13/02/2025", "01/02/2025", "2025-04-02"])
+
+    assert fields['date'].tolist() == ["2025-02-13", "2025-02-01", "2025-04-02"]
+
+def test_month_first_dates_are_read_month_first():
+    fields = _fields(Date=["2/13/2025", "1/2/2025"])
+
+    assert fields['date'].tolist() == ["2025-02-13", "2025-01-02"]
+
+def test_ambiguous_dates_are_left_as_extracted():
+    fields = _fields(Date=["1/2/2025", "5/5/2025", "13/02/2025", "2/14/2025"])
+
+    assert fields['date'].tolist() == ["1/2/2025", "2025-05-05", "2025-02-13", "2025-02-14"]
+    assert pd.isna(fields['date_value'].iloc[0])
+
+def test_empty_columns_are_shown_as_missing():
+    fields = _fields(Date=[None, " "])
+
+    assert fields['date'].tolist() == [MISSING_VALUE, MISSING_VALUE]
+    assert fields['time'].tolist() == [MISSING_VALUE, MISSING_VALUE]
+    assert fields['date_value'].isna().all()
+
+def test_tax_id_labels_are_stripped():
+    fields = _fields(Tax_ID=["TAX# 0105560000000", "TaxID: 010-5560-000000", "105560000000", "n/a"])
+
+    assert fields['tax_id'].tolist() == ["0105560000000", "0105560000000", "0105560000000", "n/a"]
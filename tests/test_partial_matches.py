@@ -0,0 +1,25 @@
+import os
+
+from reconcile import match_images
+from utils import rank_partial_matches, ReceiptImageIndex
+
+NAMES = ["copy of 1234.jpg", "1234 - Victor Lee.jpg", "1234.png", "x1234 - Other.jpg"]
+
+def test_own_images_rank_before_names_containing_the_id():
+    assert rank_partial_matches("1234", NAMES) == ["1234 - Victor Lee.jpg", "1234.png", "copy of 1234.jpg",
+                                                   "x1234 - Other.jpg"]
+
+def test_ranking_ignores_listing_order():
+    assert rank_partial_matches("1234", reversed(NAMES)) == rank_partial_matches("1234", NAMES)
+
+def test_index_and_manifest_pick_the_same_image(tmp_path):
+    for name in ["copy of 1234.jpg", "z1234 - Later.jpg", "1234 - Victor Lee.jpg", "5678 copy.jpg", "a5678.jpg"]:
+        (tmp_path / name).touch()
+    json_files = ["1234 - Someone Else.json", "5678 - Victor Lee.json"]
+
+    manifest = match_images(json_files, sorted(os.listdir(tmp_path)), [], workers=1, raw_dir=str(tmp_path))
+    index = ReceiptImageIndex(str(tmp_path))
+
+    assert manifest['image'].tolist() == [os.path.join(str(tmp_path), index.partial_matches(base)[0])
+                                          for base in ["1234", "5678"]]
+    assert manifest['image'].map(os.path.basename).tolist() == ["1234 - Victor Lee.jpg", "5678 copy.jpg"]
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from scoring import aggregate, combine, finalize, find_extracts, score
+from shards import ShardCatalog
+from utils import build_dataset_cache, dataset_cache_path
+from verification_store import (VerificationStore, VERIFIED_FIELDS, STATUS_CANCELLED, STATUS_UNVERIFIED,
+                                 STATUS_VERIFIED)
+
+def _verdicts(rows):
+    columns = ['status', 'checked_count'] + VERIFIED_FIELDS
+    return pd.DataFrame([dict(zip(columns, row)) for row in rows], columns=columns)
+
+ALL_CORRECT = (STATUS_VERIFIED, 6, 1, 1, 1, 1, 1, 1)
+WRONG_DATE = (STATUS_VERIFIED, 5, 1, 1, 0, 1, 1, 1)
+CANCELLED = (STATUS_CANCELLED, None, None, None, None, None, None, None)
+UNVERIFIED = (STATUS_UNVERIFIED, None, None, None, None, None, None, None)
+
+def test_aggregate_counts_only_verified_receipts_as_correct():
+    sums = aggregate(_verdicts([ALL_CORRECT, WRONG_DATE, CANCELLED, UNVERIFIED])).iloc[0]
+
+    assert (sums['receipts'], sums['reviewed'], sums['verified'], sums['cancelled']) == (4, 3, 2, 1)
+    assert sums['all_correct'] == 1
+    assert sums['date_correct'] == 1
+    assert sums['tax_id_correct'] == 2
+
+def test_aggregate_by_group_puts_missing_values_in_their_own_group():
+    verdicts = _verdicts([ALL_CORRECT, WRONG_DATE, ALL_CORRECT])
+    verdicts['Store name'] = ["A", None, "A"]
+
+    sums = aggregate(verdicts, by='Store name')
+
+    assert sums.loc["A", 'verified'] == 2
+    assert sums.loc["(ไม่พบข้อมูล)", 'date_correct'] == 0
+
+def test_combined_chunks_match_one_aggregate():
+    verdicts = _verdicts([ALL_CORRECT, WRONG_DATE, CANCELLED, UNVERIFIED, WRONG_DATE])
+    verdicts['Store name'] = ["A", "B", "A", "B", "A"]
+
+    chunked = combine([aggregate(verdicts.iloc[:2], by='Store name'), aggregate(verdicts.iloc[2:], by='Store name')])
+
+    pd.testing.assert_frame_equal(chunked, aggregate(verdicts, by='Store name').sort_index())
+
+def test_finalize_leaves_accuracy_empty_without_verified_receipts():
+    report = finalize(aggregate(_verdicts([CANCELLED, UNVERIFIED])))
+
+    assert pd.isna(report['Date accuracy'].iloc[0])
+    assert pd.isna(report['all_correct_rate'].iloc[0])
+
+def _extract(tmp_path):
+    path = tmp_path / "data_ocr_extract.xlsx"
+    pd.DataFrame({
+        'Source JSON File': ["a.json", "b.json", "c.json"],
+        'Tax ID': ["0105560000000"] * 3,
+        'Receipt Number': ["1", "2", "3"],
+        'Date': ["02/04/2025", "13/04/2025", None],
+        'Time': ["14:04:32"] * 3,
+        'Total Amount': [100.0, 50.0, 20.0],
+        'Store name': ["A", "B", "A"],
+    }).to_excel(path, index=False)
+    store = VerificationStore(str(tmp_path / "verification.db"))
+    store.sync(pd.Series(["a.json", "b.json", "c.json"]), key="v1")
+    store.record_verdict("a.json", dict.fromkeys(VERIFIED_FIELDS, True))
+    store.record_verdict("b.json", {'tax_id': True})
+    return str(path), store
+
+@pytest.mark.parametrize("cached", [False, True])
+def test_score_streams_the_extract_or_its_cache(tmp_path, cached):
+    path, store = _extract(tmp_path)
+    cache_dir = str(tmp_path / "cache")
+    if cached:
+        build_dataset_cache(path, cache_dir)
+
+    reports = score([(path, cache_dir)], store, chunksize=2)
+
+    assert reports['accuracy_overall']['verified'].iloc[0] == 2
+    assert reports['accuracy_by_store'].loc["A", 'all_correct'] == 1
+    # 13/04 makes the extract's dates day first
+    assert reports['accuracy_by_date'].loc["2025-04-02", 'all_correct'] == 1
+    assert reports['accuracy_by_date'].loc["2025-04-13", 'Tax ID accuracy'] == 1.0
+    assert reports['accuracy_by_date'].loc["(ไม่พบข้อมูล)", 'receipts'] == 1
+
+def test_no_dataset_is_found_in_an_empty_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    assert find_extracts(manifest_path=str(tmp_path / "shards.json")) == []
+
+def test_shard_extracts_are_read_through_their_shard_caches(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path, _ = _extract(tmp_path)
+    manifest_path = tmp_path / "shards.json"
+    manifest_path.write_text(json.dumps({'shards': [{'name': "2025/04", 'extract': path}]}))
+    catalog = ShardCatalog(str(manifest_path))
+    catalog.refresh()
+    catalog.register(VerificationStore(str(tmp_path / "shards.db")))
+
+    [(extract, cache_dir)] = find_extracts(manifest_path=str(manifest_path))
+
+    assert extract == path
+    assert os.path.exists(dataset_cache_path(extract, cache_dir))
@@ -0,0 +1,107 @@
+import json
+
+import pandas as pd
+import pytest
+
+from shards import ShardCatalog
+from verification_store import VerificationStore, STATUS_VERIFIED
+
+def _write_extract(path, names):
+    pd.DataFrame({
+        'Source JSON File': names,
+        'Tax ID': ["0105560000000"] * len(names),
+        'Receipt Number': [str(index) for index in range(len(names))],
+        'Date': ["2025-04-02"] * len(names),
+        'Time': ["14:04:32"] * len(names),
+        'Total Amount': [100.0] * len(names),
+        'Store name': ["Store"] * len(names),
+    }).to_excel(path, index=False)
+
+@pytest.fixture
+def dataset(tmp_path):
+    extracts = {}
+    for name, rows in [("a", 3), ("b", 2), ("c", 4)]:
+        extracts[name] = tmp_path / f"{name}.xlsx"
+        _write_extract(extracts[name], [f"{name}{index}.json" for index in range(rows)])
+    manifest_path = tmp_path / "shards.json"
+    manifest_path.write_text(json.dumps({'shards': [{'name': name, 'extract': str(path)}
+                                                    for name, path in extracts.items()]}))
+    catalog = ShardCatalog(str(manifest_path), cache_dir=str(tmp_path / "cache"), check_interval=0)
+    catalog.refresh()
+    store = VerificationStore(str(tmp_path / "verification.db"))
+    return catalog, store, extracts
+
+def _positions(store, names):
+    return dict(store._connect().execute(
+        f"SELECT json_file, position FROM receipts WHERE json_file IN ({', '.join('?' * len(names))})", names))
+
+def test_shards_follow_each_other(dataset):
+    catalog, store, _ = dataset
+    catalog.register(store)
+
+    assert [(info.name, info.offset, info.rows) for info in catalog.shards] == [("a", 0, 3), ("b", 3, 2), ("c", 5, 4)]
+    assert len(catalog) == 9
+    assert [catalog.shard_at(position).name for position in [0, 2, 3, 4, 5, 8, 20]] == list("aabbccc")
+    assert _positions(store, ["b0.json", "c3.json"]) == {"b0.json": 3, "c3.json": 8}
+
+def test_changed_shard_moves_later_ones_without_reloading_them(dataset, monkeypatch):
+    catalog, store, extracts = dataset
+    catalog.register(store)
+    store.record_verdict("c1.json", {'tax_id': True})
+    _write_extract(extracts["a"], ["a0.json", "a1.json"])
+    catalog.refresh()
+    built = []
+    original_build = catalog._build
+    monkeypatch.setattr(catalog, "_build",
+                        lambda info, offset=None: built.append(info.name) or original_build(info, offset))
+
+    catalog.register(store)
+
+    assert built == ["a"]
+    assert [(info.offset, info.rows) for info in catalog.shards] == [(0, 2), (2, 2), (4, 4)]
+    assert _positions(store, ["a2.json", "b0.json", "c1.json"]) == {"a2.json": None, "b0.json": 2, "c1.json": 5}
+    assert store.verdicts_for(["c1.json"])['status'].tolist() == [STATUS_VERIFIED]
+    assert store.shard_versions()["c"][1:] == (4, 4)
+    assert catalog.load("c").offset == 4
+
+def test_refresh_keeps_the_old_places_until_register(dataset):
+    catalog, store, extracts = dataset
+    catalog.register(store)
+    manifest = json.loads(open(catalog.manifest_path).read())
+    manifest['shards'] = manifest['shards'][1:]
+    with open(catalog.manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    assert catalog.refresh()
+    assert [info.name for info in catalog.shards] == ["a", "b", "c"]
+    assert len(catalog) == 9 and catalog.shard_at(8).name == "c"
+
+    catalog.register(store)
+
+    assert [(info.name, info.offset, info.rows) for info in catalog.shards] == [("b", 0, 2), ("c", 2, 4)]
+    assert len(catalog) == 6 and catalog.shard_at(0).name == "b"
+
+def test_restart_registers_nothing_again(dataset, monkeypatch):
+    catalog, store, _ = dataset
+    catalog.register(store)
+    restarted = ShardCatalog(catalog.manifest_path, cache_dir=catalog.cache_dir, check_interval=0)
+    restarted.refresh()
+    monkeypatch.setattr(restarted, "_build", lambda info, offset=None: pytest.fail(f"{info.name} was loaded"))
+
+    restarted.register(store)
+
+    assert [(info.offset, info.rows) for info in restarted.shards] == [(0, 3), (3, 2), (5, 4)]
+
+def test_single_dataset_is_keyed_on_its_workbook(tmp_path, monkeypatch):
+    from utils import load_dataset
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    workbook = tmp_path / "data" / "data_ocr_extract.xlsx"
+    _write_extract(workbook, ["a0.json", "a1.json"])
+    _, key = load_dataset()
+    assert load_dataset()[1] == key
+
+    _write_extract(workbook, ["a0.json", "a1.json", "a2.json"])
+    receipts_data, changed_key = load_dataset()
+    assert changed_key != key
+    assert len(receipts_data) == 3
@@ -0,0 +1,77 @@
+import io
+import os
+import time
+import zipfile
+
+import pandas as pd
+import pytest
+
+from uploads import UploadManager
+
+class _Upload(io.BytesIO):
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+
+@pytest.fixture
+def manager(tmp_path):
+    return UploadManager(str(tmp_path / "uploads"), str(tmp_path / "uploads" / "dataset.parquet"))
+
+def _process(manager, name, data, image_dir=None):
+    upload = _Upload(name, data)
+    path, digest = manager.save(upload)
+    job = manager.submit(path, digest, name, *([] if image_dir is None else [image_dir]))
+    deadline = time.monotonic() + 30
+    while not job.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.state == 'done', job.error
+    return job
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def _csv(names):
+    return pd.DataFrame({'Source JSON File': names, 'Store name': ["A"] * len(names)}).to_csv(index=False).encode()
+
+def test_archive_never_overwrites_images(manager, tmp_path):
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    (image_dir / "existing.jpg").write_bytes(b"original")
+
+    job = _process(manager, "images.zip", _zip({
+        "a/receipt.jpg": b"first",
+        "b/receipt.jpg": b"second",
+        "existing.jpg": b"replacement",
+        "new.png": b"new",
+    }), str(image_dir))
+
+    assert job.result == "2 รูป"
+    assert "b/receipt.jpg" in job.notice and "existing.jpg" in job.notice
+    assert (image_dir / "receipt.jpg").read_bytes() == b"first"
+    assert (image_dir / "existing.jpg").read_bytes() == b"original"
+    assert sorted(os.listdir(image_dir)) == ["existing.jpg", "new.png", "receipt.jpg"]
+
+def test_first_upload_becomes_the_dataset(manager):
+    job = _process(manager, "extract.csv", _csv(["a.json", "b.json"]))
+
+    assert job.result == "2 รายการ" and job.notice is None
+    assert pd.read_parquet(manager.dataset_path)['Source JSON File'].tolist() == ["a.json", "b.json"]
+
+def test_later_upload_does_not_replace_the_dataset(manager):
+    _process(manager, "extract.csv", _csv(["a.json", "b.json"]))
+
+    job = _process(manager, "other.csv", _csv(["c.json"]))
+
+    assert job.notice is not None
+    assert pd.read_parquet(manager.dataset_path)['Source JSON File'].tolist() == ["a.json", "b.json"]
+
+def test_same_upload_again_is_not_reported(manager):
+    data = _csv(["a.json"])
+    _process(manager, "extract.csv", data)
+    manager._jobs.clear()
+
+    assert _process(manager, "extract again.csv", data).notice is None
@@ -0,0 +1,26 @@
+import pandas as pd
+
+from validation import thai_tax_id_valid
+
+def _with_check_digit(first_12):
+    total = sum(int(digit) * (13 - index) for index, digit in enumerate(first_12))
+    return first_12 + str((11 - total % 11) % 10)
+
+def test_valid_tax_ids_pass():
+    tax_ids = pd.Series([_with_check_digit("010556000000"), _with_check_digit("310010012345"), "0105536092641"])
+
+    assert thai_tax_id_valid(tax_ids).tolist() == [True, True, True]
+
+def test_wrong_check_digit_fails():
+    valid = _with_check_digit("010556000000")
+    wrong = valid[:12] + str((int(valid[12]) + 1) % 10)
+
+    assert thai_tax_id_valid(pd.Series([wrong])).tolist() == [False]
+
+def test_anything_but_13_digits_fails():
+    tax_ids = pd.Series(["105560000000", "0105-560000000", "TAX0105560000", None, "", "01055600000000"])
+
+    assert not thai_tax_id_valid(tax_ids).any()
+
+def test_empty_series():
+    assert thai_tax_id_valid(pd.Series([], dtype=object)).tolist() == []
@@ -0,0 +1,75 @@
+import pytest
+
+from verification_store import VerificationStore, STATUS_CANCELLED, STATUS_UNVERIFIED, STATUS_VERIFIED
+
+RECEIPTS = [f"{index:03d} - receipt.json" for index in range(10)]
+
+@pytest.fixture
+def store(tmp_path):
+    store = VerificationStore(str(tmp_path / "verification.db"))
+    store.sync(RECEIPTS, key="v1")
+    return store
+
+def _statuses(store):
+    verdicts = store.verdicts_for(RECEIPTS)
+    return dict(zip(verdicts['json_file'], verdicts['status']))
+
+def test_reviewer_reset_keeps_other_reviewers_verdicts(store):
+    store.record_verdict(RECEIPTS[0], {'tax_id': True}, reviewer="a")
+    store.record_verdict(RECEIPTS[1], {'tax_id': True}, reviewer="b")
+    store.lease_batch("a", size=2)
+
+    store.reset("a")
+
+    statuses = _statuses(store)
+    assert statuses[RECEIPTS[0]] == STATUS_UNVERIFIED
+    assert statuses[RECEIPTS[1]] == STATUS_VERIFIED
+    assert store.counts()['remaining'] == len(RECEIPTS) - 1
+    # a's leases are given up, so b can lease the first receipts
+    assert [json_file for json_file, _ in store.lease_batch("b", size=1)] == [RECEIPTS[0]]
+
+def test_full_reset_clears_every_verdict(store):
+    store.record_verdict(RECEIPTS[0], reviewer="a")
+    store.record_verdict(RECEIPTS[1], cancelled=True, reviewer="b")
+
+    store.reset()
+
+    assert set(_statuses(store).values()) == {STATUS_UNVERIFIED}
+    assert store.counts()['remaining'] == len(RECEIPTS)
+
+def test_leases_go_to_one_reviewer_at_a_time(store):
+    first = store.lease_batch("a", size=3)
+    second = store.lease_batch("b", size=3)
+
+    assert [json_file for json_file, _ in first] == RECEIPTS[:3]
+    assert [json_file for json_file, _ in second] == RECEIPTS[3:6]
+    assert [position for _, position in store.lease_batch("a", size=3)] == [0, 1, 2]
+
+def test_held_lease_batch_is_not_written_again(store):
+    store.lease_batch("a", size=3)
+    conn = store._connect()
+    changes = conn.total_changes
+
+    store.lease_batch("a", size=3)
+    assert conn.total_changes == changes
+
+    # A verdict leaves the batch short, so it's topped up again
+    store.record_verdict(RECEIPTS[0], reviewer="a")
+    changes = conn.total_changes
+    assert [json_file for json_file, _ in store.lease_batch("a", size=3)] == RECEIPTS[1:4]
+    assert conn.total_changes > changes
+
+def test_lease_batch_renews_leases_near_expiry(store):
+    store.lease_batch("a", size=3, ttl=-1)
+    # Expired, so b gets them
+    assert [json_file for json_file, _ in store.lease_batch("b", size=3)] == RECEIPTS[:3]
+    assert [json_file for json_file, _ in store.lease_batch("a", size=3)] == RECEIPTS[3:6]
+
+def test_only_unverified_keeps_an_existing_verdict(store):
+    store.record_verdict(RECEIPTS[0], {'tax_id': True}, reviewer="a")
+
+    assert not store.record_verdict(RECEIPTS[0], cancelled=True, reviewer="b", only_unverified=True)
+    assert store.record_verdict(RECEIPTS[1], cancelled=True, reviewer="b", only_unverified=True)
+    verdicts = store.verdicts_for(RECEIPTS[:2])
+    assert verdicts['status'].tolist() == [STATUS_VERIFIED, STATUS_CANCELLED]
+    assert verdicts['checked_count'].iloc[0] == 1
@@ -0,0 +1,373 @@
+"""
+Files uploaded on the review page: extract data and archives of receipt images.
+
+Extract data may be an XLSX workbook, a CSV or a Parquet file; images come
+as a ZIP archive (.jpg, .jpeg and .png files, in any folders). An upload is
+copied to data/uploads/incoming in chunks, hashed on the way, and then
+parsed or extracted once on a background thread while the page shows its
+progress (the copy is removed afterwards):
+
+- Extract data is parsed into a Parquet file named by the upload's hash,
+  which then becomes the dataset (UPLOADED_DATASET_PATH, read by
+  utils.load_excel_data when there is no extract workbook) if there is none
+  yet. An upload never replaces a dataset other reviewers may be working
+  on: if another upload became the dataset first, the page says so instead
+  (remove UPLOADED_DATASET_PATH to switch deliberately). Uploading the same
+  file again, from any session or after a restart, doesn't parse it again.
+- An archive's images are extracted into an image directory (the main one
+  if it is local, else the receipts directory) and added to its image
+  index, so they are found at once. An image whose name is already in the
+  directory (or earlier in the archive) is skipped and reported, never
+  overwritten. A record per archive and directory keeps an archive from
+  being extracted twice.
+
+Reruns while the uploader still holds a file reuse its job, so a file is
+never copied or parsed twice.
+"""
+import filecmp
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import streamlit as st
+
+import metrics
+from image_sources import is_remote
+from utils import (get_image_index, _compact_dtypes, _to_columnar, IMAGE_EXTENSIONS, RECEIPTS_DIR, UPLOAD_CHUNK_BYTES,
+                   UPLOAD_DIR, UPLOADED_DATASET_PATH)
+
+DATASET_TYPES = ("xlsx", "csv", "parquet")
+ARCHIVE_TYPES = ("zip",)
+
+# How often the page checks on uploads being processed, in seconds
+UPLOAD_PROGRESS_INTERVAL = 0.5
+
+def archive_image_dir(image_source):
+    """
+    Where the images of an uploaded archive go for receipts with the given image source.
+
+    Args:
+        image_source (str): Image directory or URL (see image_sources.py)
+
+    Returns:
+        str: The source itself if it's a directory, else the receipts directory
+    """
+    return RECEIPTS_DIR if is_remote(image_source) else image_source
+
+class _ProgressFile(io.FileIO):
+    """A file that reports the share of it read so far, for parsers that take a file object."""
+
+    def __init__(self, path, report):
+        super().__init__(path, 'rb')
+        self._size = max(os.fstat(self.fileno()).st_size, 1)
+        self._bytes_read = 0
+        self._report = report
+
+    def _count(self, count):
+        self._bytes_read += count or 0
+        self._report(min(self._bytes_read / self._size, 1.0))
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self._count(len(data) if data else 0)
+        return data
+
+    def readinto(self, buffer):
+        count = super().readinto(buffer)
+        self._count(count)
+        return count
+
+class UploadJob:
+    """
+    One uploaded file being parsed or extracted.
+
+    state goes from 'pending' to 'running' to 'done' or 'failed'; progress
+    (0 to 1) and message describe the current step, result the outcome.
+    notice is set when the upload was processed but not (fully) used.
+    """
+
+    def __init__(self, key, filename, kind):
+        self.key = key
+        self.filename = filename
+        self.kind = kind
+        self.state = 'pending'
+        self.progress = 0.0
+        self.message = "รอดำเนินการ"
+        self.result = None
+        self.notice = None
+        self.error = None
+
+    @property
+    def done(self):
+        return self.state in ('done', 'failed')
+
+class UploadManager:
+    """
+    Copies uploads to disk and processes them on a background thread.
+
+    Jobs are kept by content (and, for archives, target directory), so the
+    same file uploaded from several sessions is processed once.
+    """
+
+    def __init__(self, upload_dir=UPLOAD_DIR, dataset_path=UPLOADED_DATASET_PATH, workers=1):
+        self.upload_dir = upload_dir
+        self.dataset_path = dataset_path
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="receipt-upload")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def save(self, uploaded_file):
+        """
+        Copy an uploaded file to the upload directory in chunks, hashing it on the way.
+
+        Args:
+            uploaded_file (file-like): The upload, with a name (e.g. from st.file_uploader)
+
+        Returns:
+            tuple: (path of the copy, hex digest of its content)
+        """
+        incoming_dir = os.path.join(self.upload_dir, "incoming")
+        os.makedirs(incoming_dir, exist_ok=True)
+        extension = os.path.splitext(uploaded_file.name)[1].lower()
+        tmp_path = os.path.join(incoming_dir, f".{uuid.uuid4().hex}.part")
+        digest = hashlib.sha1()
+        uploaded_file.seek(0)
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: uploaded_file.read(UPLOAD_CHUNK_BYTES), b''):
+                digest.update(chunk)
+                f.write(chunk)
+        digest = digest.hexdigest()[:20]
+        path = os.path.join(incoming_dir, f"{digest}{extension}")
+        os.replace(tmp_path, path)
+        return path, digest
+
+    def submit(self, path, digest, filename, image_dir=RECEIPTS_DIR):
+        """
+        Parse or extract a saved upload in the background, unless it already is.
+
+        Args:
+            path (str): The copy written by save()
+            digest (str): Its digest, from save()
+            filename (str): The name it was uploaded under
+            image_dir (str): Where an archive's images go
+
+        Returns:
+            UploadJob: The job processing the file
+        """
+        kind = os.path.splitext(filename)[1].lower().lstrip('.')
+        if kind not in DATASET_TYPES + ARCHIVE_TYPES:
+            raise ValueError(f"ไม่รองรับไฟล์ประเภท .{kind}")
+        key = digest if kind in DATASET_TYPES else f"{digest}:{image_dir}"
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and job.state != 'failed':
+                if job.done:
+                    # Nothing will read this copy; a running job removes its own when it finishes
+                    os.remove(path)
+                return job
+            job = self._jobs[key] = UploadJob(key, filename, kind)
+        self._executor.submit(self._run, job, path, digest, image_dir)
+        return job
+
+    def job(self, key):
+        """The job for a key from UploadJob.key, or None."""
+        with self._lock:
+            return self._jobs.get(key)
+
+    def _run(self, job, path, digest, image_dir):
+        job.state = 'running'
+        try:
+            with metrics.span("upload_process", kind=job.kind):
+                if job.kind in DATASET_TYPES:
+                    self._load_dataset(job, path, digest)
+                else:
+                    self._extract_archive(job, path, digest, image_dir)
+            job.progress = 1.0
+            job.state = 'done'
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            job.state = 'failed'
+        finally:
+            # The parsed or extracted result is kept; the upload itself isn't needed any more
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _load_dataset(self, job, path, digest):
+        parsed_path = os.path.join(self.upload_dir, f"{digest}.parquet")
+        if not os.path.exists(parsed_path):
+            job.message = "กำลังอ่านไฟล์ข้อมูล"
+
+            def report(share):
+                job.progress = 0.9 * share
+
+            # The parsers read through the file object, so how much they have read is the progress
+            with _ProgressFile(path, report) as f:
+                if job.kind == "xlsx":
+                    df = pd.read_excel(f)
+                elif job.kind == "csv":
+                    df = pd.read_csv(f)
+                else:
+                    df = pd.read_parquet(f)
+            if 'Source JSON File' not in df.columns:
+                raise ValueError("ไม่พบคอลัมน์ 'Source JSON File' ในไฟล์")
+            job.message = "กำลังบันทึกข้อมูล"
+            df = _compact_dtypes(_to_columnar(df))
+            tmp_path = f"{parsed_path}.{os.getpid()}.tmp"
+            df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, parsed_path)
+
+        import pyarrow.parquet as pq
+
+        job.result = f"{pq.ParquetFile(parsed_path).metadata.num_rows:,} รายการ"
+
+        # Make it the dataset, unless there already is one: a hard link fails rather than replace it
+        try:
+            os.link(parsed_path, self.dataset_path)
+            return
+        except FileExistsError:
+            pass
+        except OSError:
+            # No hard links here: a copy swapped in (the check and the swap aren't atomic)
+            if not os.path.exists(self.dataset_path):
+                tmp_path = f"{self.dataset_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                shutil.copyfile(parsed_path, tmp_path)
+                os.replace(tmp_path, self.dataset_path)
+                return
+        if not filecmp.cmp(parsed_path, self.dataset_path, shallow=False):
+            job.notice = ("ไม่ได้ใช้แทนชุดข้อมูลเดิม เพราะมีผู้อัปโหลดชุดข้อมูลไว้ก่อนแล้ว และอาจมีผู้ตรวจกำลังตรวจอยู่ "
+                          f"(ลบไฟล์ {self.dataset_path} ก่อนหากต้องการเปลี่ยนชุดข้อมูล)")
+
+    def _extract_archive(self, job, path, digest, image_dir):
+        record_path = os.path.join(self.upload_dir,
+                                   f"{digest}-{hashlib.sha1(image_dir.encode()).hexdigest()[:8]}.json")
+        if os.path.exists(record_path):
+            with open(record_path) as f:
+                record = json.load(f)
+            self._archive_result(job, record['images'], record.get('skipped', []))
+            return
+
+        index = get_image_index(image_dir)
+        with zipfile.ZipFile(path) as archive:
+            members = [member for member in archive.infolist()
+                       if not member.is_dir() and '__MACOSX/' not in member.filename
+                       and not os.path.basename(member.filename).startswith('.')
+                       and member.filename.lower().endswith(IMAGE_EXTENSIONS)]
+            if not members:
+                raise ValueError("ไม่พบรูปภาพ (.jpg, .jpeg, .png) ในไฟล์ ZIP")
+            os.makedirs(image_dir, exist_ok=True)
+            total = sum(member.file_size for member in members) or 1
+            extracted = 0
+            images, skipped = 0, []
+            for count, member in enumerate(members, 1):
+                job.message = f"กำลังแตกไฟล์รูปภาพ {count:,}/{len(members):,}"
+                # Folders inside the archive are dropped, so nothing is written outside image_dir
+                name = os.path.basename(member.filename)
+                image_path = os.path.join(image_dir, name)
+                if os.path.exists(image_path):
+                    skipped.append(member.filename)
+                else:
+                    tmp_path = f"{image_path}.{os.getpid()}.tmp"
+                    with archive.open(member) as source, open(tmp_path, 'wb') as f:
+                        shutil.copyfileobj(source, f, UPLOAD_CHUNK_BYTES)
+                    try:
+                        # A hard link fails rather than replace an image written meanwhile
+                        os.link(tmp_path, image_path)
+                        index.add(name)
+                        images += 1
+                    except FileExistsError:
+                        skipped.append(member.filename)
+                    finally:
+                        os.remove(tmp_path)
+                extracted += member.file_size
+                job.progress = extracted / total
+
+        with open(record_path, 'w') as f:
+            json.dump({'images': images, 'skipped': skipped, 'image_dir': image_dir}, f)
+        self._archive_result(job, images, skipped)
+
+    @staticmethod
+    def _archive_result(job, images, skipped):
+        job.result = f"{images:,} รูป"
+        if skipped:
+            shown = ", ".join(skipped[:5]) + (" ..." if len(skipped) > 5 else "")
+            job.notice = f"ข้าม {len(skipped):,} รูปที่มีชื่อซ้ำกับรูปที่มีอยู่แล้ว (ไม่เขียนทับ): {shown}"
+
+@st.cache_resource(show_spinner=False)
+def get_upload_manager():
+    """
+    Process-wide upload manager, shared by every session.
+
+    Returns:
+        UploadManager: The manager
+    """
+    return UploadManager()
+
+@st.fragment(run_every=UPLOAD_PROGRESS_INTERVAL)
+def _upload_progress(keys):
+    manager = get_upload_manager()
+    jobs = [manager.job(key) for key in keys]
+    for job in jobs:
+        st.progress(job.progress, text=f"{job.filename}: {job.message}")
+    if all(job.done for job in jobs):
+        # The whole page, so it picks up the new dataset or images
+        st.rerun()
+
+def upload_files(label, types, key, image_dir=RECEIPTS_DIR):
+    """
+    File uploader whose files go through the upload pipeline.
+
+    Args:
+        label (str): Uploader label
+        types (tuple): Accepted extensions, from DATASET_TYPES and ARCHIVE_TYPES
+        key (str): Widget key
+        image_dir (str): Where archives' images go
+
+    Returns:
+        list: UploadJob of each file in the uploader
+    """
+    uploaded_files = st.file_uploader(label, type=list(types), accept_multiple_files=True, key=key)
+    manager = get_upload_manager()
+    # Uploader file ID -> job key, so reruns don't copy the file again
+    job_keys = st.session_state.setdefault('upload_jobs', {})
+    jobs = []
+    for uploaded_file in uploaded_files or []:
+        job = manager.job(job_keys.get(uploaded_file.file_id))
+        if job is None:
+            path, digest = manager.save(uploaded_file)
+            job = manager.submit(path, digest, uploaded_file.name, image_dir)
+            job_keys[uploaded_file.file_id] = job.key
+        jobs.append(job)
+
+    if any(not job.done for job in jobs):
+        _upload_progress([job.key for job in jobs])
+    else:
+        for job in jobs:
+            if job.state == 'failed':
+                st.error(f"เกิดข้อผิดพลาดในการอ่านไฟล์ {job.filename}: {job.error}")
+            else:
+                st.success(f"{job.filename}: นำเข้าแล้ว {job.result}")
+                if job.notice:
+                    st.warning(f"{job.filename}: {job.notice}")
+    return jobs
+
+def show_upload_notices():
+    """
+    Warn (once each) about this session's extract data uploads that didn't
+    become the dataset, once the page has moved on from the uploader.
+    """
+    job_keys = st.session_state.get('upload_jobs')
+    if not job_keys:
+        return
+    manager = get_upload_manager()
+    for file_id, key in list(job_keys.items()):
+        job = manager.job(key)
+        if job is not None and job.kind in DATASET_TYPES and job.done and job.notice:
+            st.warning(f"{job.filename}: {job.notice}")
+            del job_keys[file_id]
@@ -1,63 +1,181 @@
 import pandas as pd
+import numpy as np
 import os
+import datetime
+import functools
+import hashlib
+import shutil
+import threading
+import time
+from collections import OrderedDict
 import streamlit as st
-from PIL import Image
-import requests
-from io import BytesIO
-import tempfile
+import metrics
+from ingest import get_json_ingestor, JSON_DROP_DIR, JSON_INGEST_DIR, merge_receipts
 
-def load_excel_data():
+# The extract workbook, looked for in the data directory, then the current directory
+WORKBOOK_PATHS = [os.path.join("data", "data_ocr_extract.xlsx"), "data_ocr_extract.xlsx"]
+
+# Columnar (Parquet) copies of the extract workbook, keyed by source size/mtime
+DATASET_CACHE_DIR = os.path.join("data", ".cache")
+
+# Files uploaded on the page, and the extract data uploaded last (see uploads.py)
+UPLOAD_DIR = os.environ.get("RECEIPT_UPLOAD_DIR", os.path.join("data", "uploads"))
+UPLOADED_DATASET_PATH = os.path.join(UPLOAD_DIR, "dataset.parquet")
+
+# Uploads are copied to disk this much at a time
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Text columns with at most this share of distinct values are held as categoricals
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+
+def _file_signature(path):
     """
-    Load data from Excel file or use sample data if file is not available.
-    
+    Return a cheap change signature for a file.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        tuple: (size in bytes, mtime in nanoseconds)
+    """
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def _to_columnar(df):
+    """
+    Make mixed-type object columns storable as Parquet.
+
+    openpyxl hands back ints, strings, datetimes and times mixed in one column
+    (e.g. Tax ID, Receipt Number, Date). Non-null values are converted to the
+    same strings the review page displays, so rendering is unchanged.
+    """
+    def _as_text(value):
+        if isinstance(value, datetime.datetime):
+            if value.time() == datetime.time(0, 0):
+                return value.strftime('%Y-%m-%d')
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        return str(value)
+
+    df = df.copy()
+    for column in df.columns:
+        if df[column].dtype == object:
+            df[column] = df[column].map(_as_text, na_action='ignore').astype(object)
+    return df
+
+def _compact_dtypes(df):
+    """
+    Store repeated text columns (store names, dates, times) as categoricals.
+
+    Each distinct value is then held once, with an integer code per row.
+    Columns of mostly distinct values, like the filenames, are left as they are.
+    """
+    for column in df.columns:
+        values = df[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) or column == 'Source JSON File':
+            continue
+        if (values.dtype == object or pd.api.types.is_string_dtype(values)) \
+                and values.nunique() <= len(values) * CATEGORICAL_MAX_UNIQUE_RATIO:
+            df[column] = values.astype('category')
+    return df
+
+def dataset_cache_path(excel_path, cache_dir=DATASET_CACHE_DIR):
+    """The Parquet cache file of the workbook's current version (which may not be built yet)."""
+    size, mtime_ns = _file_signature(excel_path)
+    stem = os.path.splitext(os.path.basename(excel_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{size}-{mtime_ns}.parquet")
+
+def build_dataset_cache(excel_path, cache_dir=DATASET_CACHE_DIR):
+    """
+    Load the extract workbook through its Parquet cache, rebuilding it if stale.
+
+    The cache file name embeds the workbook's size and mtime, so editing or
+    replacing the workbook produces a new cache entry and old ones are removed.
+
+    Args:
+        excel_path (str): Path to the extract workbook
+        cache_dir (str): Directory holding the Parquet cache files
+
     Returns:
         pandas.DataFrame: DataFrame containing receipt data
     """
-    # Check if the Excel file exists in the data directory
-    excel_path = "data/data_ocr_extract.xlsx"
-    
-    # If file exists, load it
-    if os.path.exists(excel_path):
-        try:
-            df = pd.read_excel(excel_path)
-            return df
-        except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการอ่านไฟล์ Excel: {str(e)}")
-            raise e
-    
-    # If not found in data directory, check the current directory
-    excel_path = "data_ocr_extract.xlsx"
-    if os.path.exists(excel_path):
-        try:
-            df = pd.read_excel(excel_path)
-            return df
-        except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการอ่านไฟล์ Excel: {str(e)}")
-            raise e
-            
-    # If file doesn't exist in either location, show upload option
-    st.warning("ไม่พบไฟล์ Excel (data_ocr_extract.xlsx) ในระบบ กรุณาอัปโหลดไฟล์ก่อนใช้งาน")
-    
-    # Allow user to upload Excel file
-    uploaded_file = st.file_uploader("อัปโหลดไฟล์ Excel (data_ocr_extract.xlsx)", type=["xlsx"])
-    
-    if uploaded_file is not None:
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            temp_path = tmp_file.name
-        
-        # Load the data from the temporary file
+    stem = os.path.splitext(os.path.basename(excel_path))[0]
+    cache_path = dataset_cache_path(excel_path, cache_dir)
+
+    if os.path.exists(cache_path):
         try:
-            df = pd.read_excel(temp_path)
-            os.unlink(temp_path)  # Delete the temporary file
-            return df
-        except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการอ่านไฟล์ Excel: {str(e)}")
-            os.unlink(temp_path)  # Delete the temporary file
-            raise e
-    
-    # If no file is uploaded, use sample data
+            # Categoricals round-trip through Parquet; caches written before they were used get them here
+            return _compact_dtypes(pd.read_parquet(cache_path))
+        except Exception:
+            # Corrupt or unreadable cache, fall through and rebuild it
+            pass
+
+    df = _compact_dtypes(_to_columnar(pd.read_excel(excel_path)))
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, cache_path)
+        # Drop caches built from older versions of the same workbook
+        for filename in os.listdir(cache_dir):
+            if filename.startswith(f"{stem}-") and filename.endswith('.parquet') \
+                    and filename != os.path.basename(cache_path):
+                os.remove(os.path.join(cache_dir, filename))
+    except Exception:
+        # The cache is an optimization only; the parsed data is still valid
+        pass
+
+    return df
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _load_dataset(excel_path, size, mtime_ns, cache_dir=DATASET_CACHE_DIR):
+    """
+    Process-wide copy of the dataset, shared by every session.
+
+    size and mtime_ns are part of the cache key so a changed workbook is reloaded.
+    """
+    return build_dataset_cache(excel_path, cache_dir)
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _load_uploaded_dataset(path, size, mtime_ns):
+    """Process-wide copy of the uploaded extract data, already parsed to Parquet (see uploads.py)."""
+    return _compact_dtypes(pd.read_parquet(path))
+
+def _load_json_source():
+    """
+    Receipts ingested from the JSON drop directory, picking up new files.
+
+    Returns:
+        JsonDropIngestor or None: None if JSON ingestion isn't in use
+    """
+    if not os.path.isdir(JSON_DROP_DIR) and not os.path.isdir(JSON_INGEST_DIR):
+        return None
+    ingestor = get_json_ingestor()
+    ingestor.refresh()
+    return ingestor
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _merge_sources(_workbook_data, _json_data, key):
+    """
+    Workbook rows followed by receipts that only arrived as JSON.
+
+    A JSON file for a receipt already in the workbook updates that row in
+    place, so existing positions don't move. key identifies both inputs.
+    """
+    return _compact_dtypes(merge_receipts([_workbook_data, _json_data]))
+
+def _with_json_source(workbook_data, source_key, json_source):
+    """The workbook data with the JSON drop's receipts merged in, and the key of the result."""
+    if json_source is None or len(json_source.data) == 0:
+        return workbook_data, source_key
+    key = (source_key, json_source.version)
+    return _merge_sources(workbook_data, json_source.data, key), key
+
+@st.cache_resource(show_spinner=False)
+def _sample_data():
+    """Sample receipts shown until there is an extract (one shared frame, so its key never changes)."""
     sample_data = {
         'Source JSON File': [
             '17386590297053997295044438274399 - Victor Lee.json',
@@ -73,90 +191,923 @@ def load_excel_data():
     }
     return pd.DataFrame(sample_data)
 
-def get_receipt_image(json_filename):
+@metrics.timed("dataset_load")
+def load_dataset():
+    """
+    Load data from Excel file or use sample data if file is not available.
+    
+    Receipts from the JSON drop directory (see ingest.py) are added to the
+    workbook's, or used on their own when there is no workbook.
+    
+    Returns:
+        tuple: (pandas.DataFrame containing receipt data, key). The key
+        identifies the data's version (the source file and its size and
+        mtime, and the JSON drop's version), for caches and the verdict store.
     """
-    Get receipt image based on JSON filename from local storage.
+    json_source = _load_json_source()
+    
+    # Check the data directory, then the current directory, for the Excel file
+    for excel_path in WORKBOOK_PATHS:
+        if os.path.exists(excel_path):
+            try:
+                signature = _file_signature(excel_path)
+                df = _load_dataset(excel_path, *signature)
+                return _with_json_source(df, (excel_path, *signature), json_source)
+            except Exception as e:
+                st.error(f"เกิดข้อผิดพลาดในการอ่านไฟล์ Excel: {str(e)}")
+                raise e
+    
+    # Extract data uploaded on the page earlier
+    if os.path.exists(UPLOADED_DATASET_PATH):
+        # An upload from this session that another one beat to it is only reported
+        from uploads import show_upload_notices
+        show_upload_notices()
+        signature = _file_signature(UPLOADED_DATASET_PATH)
+        df = _load_uploaded_dataset(UPLOADED_DATASET_PATH, *signature)
+        return _with_json_source(df, (UPLOADED_DATASET_PATH, *signature), json_source)
     
+    # Receipts ingested from JSON only
+    if json_source is not None and len(json_source.data) > 0:
+        return json_source.data, (JSON_DROP_DIR, json_source.version)
+            
+    # If file doesn't exist in either location, show upload option
+    st.warning("ไม่พบไฟล์ Excel (data_ocr_extract.xlsx) ในระบบ กรุณาอัปโหลดไฟล์ก่อนใช้งาน")
+    
+    # Extract data (and image archives) are parsed once in the background; the page reruns when they're in
+    from uploads import upload_files, archive_image_dir, ARCHIVE_TYPES, DATASET_TYPES
+    upload_files("อัปโหลดไฟล์ข้อมูล (Excel, CSV หรือ Parquet) และไฟล์ ZIP รูปภาพใบเสร็จ",
+                 DATASET_TYPES + ARCHIVE_TYPES, key="dataset_upload", image_dir=archive_image_dir(IMAGE_SOURCE))
+    
+    # If no file is uploaded, use sample data
+    return _sample_data(), ('sample',)
+
+def load_excel_data():
+    """
+    The receipt data from load_dataset(), without its key.
+
+    Returns:
+        pandas.DataFrame: DataFrame containing receipt data
+    """
+    return load_dataset()[0]
+
+# Shown in place of a field the extraction left empty
+MISSING_VALUE = "ไม่พบข้อมูล"
+
+# Fields shown on the review page, in display order
+DISPLAY_FIELDS = ['tax_id', 'receipt_number', 'date', 'time', 'total_amount', 'store_name']
+
+# Extraction noise stripped before a Tax ID's digits, e.g. "TaxID:", "TAX#", "ID:", "NO."
+_TAX_ID_NOISE = r'(?i)^\s*(?:tax\s*id|tax|tin|id|no)\s*[.:#]?\s*'
+
+# Label prefixes the extraction sometimes keeps on receipt numbers, e.g. "No:", "Receipt No."
+_RECEIPT_NUMBER_LABEL = r'(?i)^\s*(?:receipt\s*)?(?:no|#)\s*[.:#]\s*'
+
+# Numeric dates other than ISO ones: day and month in either order, e.g. 13/02/2025 or 2/13/2025
+_NUMERIC_DATE = r'^(\d{1,2})[/.\-](\d{1,2})[/.\-](\d{4}|\d{2})$'
+
+def _as_text(values):
+    """Non-null values as stripped strings (str dtype), nulls and blanks as NA."""
+    text = values.astype(object).where(values.notna()).astype("string").str.strip()
+    return text.mask(text == "")
+
+def _parse_dates(values):
+    """
+    Parse date strings: ISO (YYYY-MM-DD, with or without a time), numeric
+    day/month/year in either order, or with the month spelled out.
+
+    Whether numeric dates are day or month first is read off the values
+    that can only be one of them (13/02/2025, 2/13/2025). If those disagree,
+    or there are none, only dates that read the same both ways are parsed;
+    the rest stay unparsed rather than risk swapping day and month.
+
+    Args:
+        values (pandas.Series): Distinct date strings
+
+    Returns:
+        pandas.Series: datetime64 values, NaT where unparsed
+    """
+    parsed = pd.to_datetime(values, format='ISO8601', errors='coerce')
+
+    parts = values.str.extract(_NUMERIC_DATE).astype('float64')
+    first, second, year = parts[0], parts[1], parts[2]
+    year = year.where(year >= 100, year + 2000)
+    day_first = ((first > 12) & (second <= 12)).any()
+    month_first = ((second > 12) & (first <= 12)).any()
+    if day_first != month_first:
+        day, month = (first, second) if day_first else (second, first)
+    else:
+        # Only the dates with a single reading
+        same = first.where(first == second)
+        day = first.where(first > 12, second.where(second > 12, same))
+        month = second.where(first > 12, first.where(second > 12, same))
+    numeric = pd.to_datetime(pd.DataFrame({'year': year, 'month': month, 'day': day}), errors='coerce')
+    parsed = parsed.fillna(numeric)
+
+    # Month names can't be swapped with days
+    named = values.str.contains(r'[A-Za-z]{3}', regex=True).fillna(False).astype(bool) & parsed.isna()
+    if named.any():
+        parsed[named] = pd.to_datetime(values[named], format='mixed', errors='coerce')
+    return parsed
+
+def _parse_times(values):
+    """Parse HH:MM or HH:MM:SS strings (on today's date)."""
+    return pd.to_datetime(values, format='mixed', errors='coerce')
+
+def _parse_datetimes(text, display_format, parse):
+    """
+    Parse date/time strings and format them for display.
+
+    Only the distinct values are parsed and formatted; extracts repeat the same
+    dates and times a lot. Unparseable values keep their text.
+
+    Args:
+        text (pandas.Series): Strings from _as_text()
+        display_format (str): strftime format to display parsed values in
+        parse (callable): Parses a Series of distinct strings (_parse_dates or _parse_times)
+
+    Returns:
+        tuple: (datetime64 Series, display string Series)
+    """
+    codes, uniques = pd.factorize(text)
+    if len(uniques) == 0:
+        return pd.Series(pd.NaT, index=text.index, dtype='datetime64[ns]'), text
+    parsed = parse(pd.Series(uniques, dtype="string"))
+    formatted = parsed.dt.strftime(display_format).astype(object).to_numpy()
+    missing = codes < 0
+    codes = np.maximum(codes, 0)
+    values = pd.Series(np.where(missing, np.datetime64('NaT'), parsed.to_numpy()[codes]),
+                       index=text.index, dtype='datetime64[ns]')
+    display = pd.Series(np.where(missing, None, formatted[codes]), index=text.index, dtype="string")
+    return values, display.fillna(text)
+
+def normalize_receipt_fields(receipts_data):
+    """
+    Parse and standardize the extracted fields of a whole dataset at once.
+
+    - Tax ID: label prefixes and separators removed. A 12-digit number gets its
+      leading zero back (Excel stores Thai tax IDs as numbers and drops it).
+    - Receipt Number: label prefixes removed, numbers read as floats lose ".0".
+    - Date: ISO, numeric day/month/year in the order the dataset uses, or
+      with the month spelled out, as YYYY-MM-DD (see _parse_dates).
+    - Time: HH:MM or HH:MM:SS, as HH:MM:SS.
+    - Total Amount: numbers (thousands separators and currency allowed), two decimals.
+
+    Values that can't be parsed are shown as extracted, and missing values
+    as MISSING_VALUE.
+
+    Args:
+        receipts_data (pandas.DataFrame): The receipt data
+
+    Returns:
+        pandas.DataFrame: One categorical display string column per field
+        (keyed like st.session_state.verified_fields), plus the parsed
+        'date_value' and 'total_amount_value' columns, in dataset order
+    """
+    tax_id = _as_text(receipts_data['Tax ID'])
+    tax_id_digits = tax_id.str.replace(_TAX_ID_NOISE, '', regex=True).str.replace(r'[\s\-]', '', regex=True)
+    tax_id_digits = tax_id_digits.str.replace(r'\.0$', '', regex=True)
+    is_digits = tax_id_digits.str.fullmatch(r'\d{12,13}').fillna(False).astype(bool)
+    tax_id = tax_id.mask(is_digits, tax_id_digits.str.zfill(13))
+
+    receipt_number = _as_text(receipts_data['Receipt Number'])
+    receipt_number = receipt_number.str.replace(_RECEIPT_NUMBER_LABEL, '', regex=True)
+    receipt_number = receipt_number.str.replace(r'^(\d+)\.0$', r'\1', regex=True)
+
+    date_text = _as_text(receipts_data['Date'])
+    date_value, date = _parse_datetimes(date_text, '%Y-%m-%d', _parse_dates)
+
+    time_text = _as_text(receipts_data['Time'])
+    is_time = time_text.str.fullmatch(r'\d{1,2}:\d{2}(:\d{2})?').fillna(False).astype(bool)
+    _, receipt_time = _parse_datetimes(time_text.where(is_time), '%H:%M:%S', _parse_times)
+    receipt_time = receipt_time.fillna(time_text)
+
+    amount_text = _as_text(receipts_data['Total Amount'])
+    total_amount_value = pd.to_numeric(amount_text.str.replace(r'[,\s฿]|THB|บาท', '', regex=True), errors='coerce')
+    total_amount = pd.Series(np.char.mod('%.2f', total_amount_value.fillna(0).to_numpy()),
+                             index=amount_text.index, dtype="string")
+    total_amount = total_amount.mask(total_amount_value.isna()).fillna(amount_text)
+
+    store_name = _as_text(receipts_data['Store name']).str.replace(r'\s+', ' ', regex=True)
+
+    fields = pd.DataFrame({
+        'tax_id': tax_id,
+        'receipt_number': receipt_number,
+        'date': date,
+        'time': receipt_time,
+        'total_amount': total_amount,
+        'store_name': store_name,
+    }).fillna(MISSING_VALUE).astype('category')
+    fields['date_value'] = date_value
+    fields['total_amount_value'] = total_amount_value.astype('float64')
+    return fields.reset_index(drop=True)
+
+class ReceiptFields:
+    """
+    Display strings of every receipt's fields, computed once per dataset.
+
+    The review page and the prefetcher look fields up by dataset position
+    instead of formatting a row on each rerun. Each distinct display string
+    is held once; rows hold integer codes into them.
+    """
+
+    def __init__(self, receipts_data):
+        self.frame = normalize_receipt_fields(receipts_data)
+        self._columns = {field: (self.frame[field].cat.codes.to_numpy(), self.frame[field].cat.categories)
+                         for field in DISPLAY_FIELDS}
+
+    def __getitem__(self, position):
+        """Display strings for a dataset position, keyed like st.session_state.verified_fields."""
+        return {field: categories[codes[position]] for field, (codes, categories) in self._columns.items()}
+
+    def __len__(self):
+        return len(self.frame)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_receipt_fields(_receipts_data, dataset_key):
+    """
+    Normalized fields shared by every session, built once per dataset version.
+
+    Args:
+        _receipts_data (pandas.DataFrame): The receipt data (not hashed)
+        dataset_key (hashable): Identifies the dataset version
+
+    Returns:
+        ReceiptFields: The display strings for the dataset
+    """
+    return ReceiptFields(_receipts_data)
+
+# Receipts listed per page of the receipt picker
+PICKER_PAGE_SIZE = 50
+
+class ReceiptSearchIndex:
+    """
+    In-memory search over the filenames and store names of a dataset.
+
+    Results are dataset positions (stable row IDs), so the picker never has to
+    parse them back out of option labels. Matching is a case-insensitive
+    substring search, vectorized over Arrow-backed string columns.
+    """
+
+    def __init__(self, receipts_data):
+        # The dataset's own column, not a copy
+        self.filenames = receipts_data['Source JSON File']
+        self._filenames_lower = self.filenames.astype("string[pyarrow]").str.lower()
+        # Store names repeat; only the distinct ones are searched, rows refer to them by code
+        self._store_codes, store_names = pd.factorize(receipts_data['Store name'])
+        self._store_names_lower = pd.Series(store_names.astype(str), dtype="string[pyarrow]").str.lower()
+
+    def label(self, position):
+        """Option label for a dataset position."""
+        return f"{position + 1}. {self.filenames.iat[position]}"
+
+    def search(self, query, candidates):
+        """
+        Filter candidate positions by a search query.
+
+        Args:
+            query (str): Text to look for in the filename or store name
+            candidates (numpy.ndarray): Sorted dataset positions to search within
+
+        Returns:
+            numpy.ndarray: Matching positions, in dataset order
+        """
+        query = query.strip().lower()
+        if not query:
+            return candidates
+        store_matches = self._store_names_lower.str.contains(query, regex=False).to_numpy(dtype=bool)
+        # Code -1 (no store name) picks the trailing False
+        store_matches = np.append(store_matches, False)[self._store_codes]
+        matches = self._filenames_lower.str.contains(query, regex=False).to_numpy(dtype=bool) | store_matches
+        return candidates[matches[candidates]]
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_search_index(_receipts_data, dataset_key):
+    """
+    Search index shared by every session, built once per dataset version.
+
+    Args:
+        _receipts_data (pandas.DataFrame): The receipt data (not hashed)
+        dataset_key (hashable): Identifies the dataset version
+
+    Returns:
+        ReceiptSearchIndex: The index for the dataset
+    """
+    return ReceiptSearchIndex(_receipts_data)
+
+# Image extensions accepted when matching a receipt ID against a directory listing
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+class ReceiptImageIndex:
+    """
+    In-memory index of the files in one receipt image directory.
+
+    Replaces the per-lookup os.path.exists / os.listdir calls. The directory is
+    listed once and re-listed only when its mtime changes (checked at most once
+    every check_interval seconds). Partial ID matches are memoized per ID and
+    only the entries affected by added or removed files are dropped on rescan,
+    so repeated lookups are O(1).
+
+    Matching follows get_receipt_image: exact filename first, then every image
+    file whose name contains the ID, in os.listdir order.
+    """
+
+    def __init__(self, directory, check_interval=1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.rescans = 0
+        self._lock = threading.Lock()
+        self._names = []
+        self._name_set = set()
+        self._partial = {}
+        self._dir_mtime_ns = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        # Caller must hold self._lock
+        now = time.monotonic()
+        if self._dir_mtime_ns is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            mtime_ns = -1
+        if mtime_ns == self._dir_mtime_ns:
+            return
+
+        names = os.listdir(self.directory) if mtime_ns != -1 else []
+        new_set = set(names)
+        added = [name for name in names if name not in self._name_set]
+        removed = self._name_set - new_set
+        if self._partial and (added or removed):
+            self._partial = {
+                base: matches for base, matches in self._partial.items()
+                if not removed.intersection(matches) and not any(base in name for name in added)
+            }
+        self._names = names
+        self._name_set = new_set
+        self._dir_mtime_ns = mtime_ns
+        self.rescans += 1
+
+    def exact(self, filename):
+        """
+        Look up a file by its exact name.
+
+        Returns:
+            str or None: Path to the file if it exists in the directory
+        """
+        with self._lock:
+            self._refresh()
+            if filename in self._name_set:
+                return os.path.join(self.directory, filename)
+        return None
+
+    def partial_matches(self, base_filename):
+        """
+        Find image files whose name contains base_filename.
+
+        Returns:
+            tuple: Matching filenames, best match first (see rank_partial_matches)
+        """
+        with self._lock:
+            self._refresh()
+            matches = self._partial.get(base_filename)
+            if matches is None:
+                matches = tuple(rank_partial_matches(base_filename, (
+                    name for name in self._names
+                    if name.lower().endswith(IMAGE_EXTENSIONS) and base_filename in name
+                )))
+                self._partial[base_filename] = matches
+            return matches
+
+    def add(self, filename):
+        """Register a file the app just wrote, without waiting for a rescan."""
+        with self._lock:
+            if filename in self._name_set:
+                return
+            self._names.append(filename)
+            self._name_set.add(filename)
+            self._partial = {
+                base: matches for base, matches in self._partial.items() if base not in filename
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_image_index(directory):
+    """
+    Process-wide image index for a directory, shared by every session.
+
+    Args:
+        directory (str): Directory containing receipt images
+
+    Returns:
+        ReceiptImageIndex: The index for the directory
+    """
+    return ReceiptImageIndex(directory)
+
+# Downscaled, orientation-normalized JPEG renditions of receipt images
+PREVIEW_CACHE_DIR = os.path.join(DATASET_CACHE_DIR, "previews")
+
+# Rendition name -> longest edge in pixels
+PREVIEW_SIZES = {
+    'view': 1200,
+    'zoom': 2400,
+}
+
+PREVIEW_JPEG_QUALITY = 85
+
+# Builds of the same image wait for each other instead of decoding it twice (striped by content hash)
+_PREVIEW_BUILD_LOCKS = [threading.Lock() for _ in range(64)]
+
+# Where receipt images come from, and where uploaded ones are kept
+RECEIPTS_RAW_DIR = os.path.join("data", "receipts_raw")
+RECEIPTS_DIR = "receipts"
+
+# Image directory or http(s) URL prefix of the main dataset's images (see image_sources.py)
+IMAGE_SOURCE = os.environ.get("RECEIPT_IMAGE_SOURCE", RECEIPTS_RAW_DIR)
+
+# Receipt -> image mapping written by reconcile.py
+IMAGE_MANIFEST_PATH = os.path.join(DATASET_CACHE_DIR, "image_manifest.parquet")
+
+# Parquet schema metadata key holding the raw image directory's mtime at reconciliation
+MANIFEST_RAW_MTIME_KEY = b'raw_dir_mtime_ns'
+
+def receipt_base_id(json_filename):
+    """
+    The ID part of a receipt's JSON filename, used for partial image matches.
+
+    Example: '17386590297053997295044438274399 - Victor Lee.json' -> '17386590297053997295044438274399'
+    """
+    return json_filename.split(' - ')[0] if ' - ' in json_filename else json_filename.split('.')[0]
+
+def rank_partial_matches(base_id, names):
+    """
+    Order the image names containing a receipt's ID, the one to show first.
+
+    Names of that receipt's own image (its ID, then ' - ' or an extension)
+    come before names that merely contain the ID; each group is in name
+    order, so the same image wins however the names were listed.
+
+    Args:
+        base_id (str): The receipt's ID, from receipt_base_id()
+        names (iterable): Image filenames containing it
+
+    Returns:
+        list: The names, best match first
+    """
+    return sorted(names, key=lambda name: (receipt_base_id(name) != base_id and not name.startswith(base_id + '.'),
+                                           name))
+
+class ImageManifest:
+    """
+    Receipt images resolved up front by reconcile.py.
+
+    The manifest file is re-read when it changes (checked at most once every
+    check_interval seconds). A listed image is only used while it still
+    exists, and "no image" is only trusted while the raw image directory is
+    unchanged since reconciliation; otherwise lookups fall back to searching
+    the image directories.
+    """
+
+    def __init__(self, path=IMAGE_MANIFEST_PATH, raw_dir=RECEIPTS_RAW_DIR, local_dir=RECEIPTS_DIR,
+                 check_interval=1.0):
+        self.path = path
+        self.raw_dir = raw_dir
+        self.local_dir = local_dir
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._images = {}
+        self._matches = {}
+        self._raw_dir_mtime_ns = None
+        self._signature = None
+        self._checked_at = 0.0
+
+    def _refresh(self):
+        # Caller must hold self._lock
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            signature = _file_signature(self.path)
+        except OSError:
+            signature = (-1, -1)
+        if signature == self._signature:
+            return
+        self._signature = signature
+        self._images, self._matches, self._raw_dir_mtime_ns = {}, {}, None
+        if signature == (-1, -1):
+            return
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(self.path, columns=['json_file', 'image', 'match'])
+        json_files = table.column('json_file').to_pylist()
+        self._images = dict(zip(json_files, table.column('image').to_pylist()))
+        self._matches = dict(zip(json_files, table.column('match').to_pylist()))
+        raw_mtime = (table.schema.metadata or {}).get(MANIFEST_RAW_MTIME_KEY)
+        self._raw_dir_mtime_ns = int(raw_mtime) if raw_mtime else None
+
+    def lookup(self, json_filename):
+        """
+        Returns:
+            tuple: (match, path). match is how reconcile.py resolved the receipt
+            ('exact', 'receipts', 'partial', 'ambiguous', 'missing' or
+            'unreadable'), or None
+            if the manifest can't answer; path is None when there is no image
+        """
+        with self._lock:
+            self._refresh()
+            if json_filename not in self._images:
+                return None, None
+            path, match = self._images[json_filename], self._matches[json_filename]
+            raw_dir_mtime_ns = self._raw_dir_mtime_ns
+        if path is None:
+            try:
+                unchanged = os.stat(self.raw_dir).st_mtime_ns == raw_dir_mtime_ns
+            except OSError:
+                unchanged = False
+            # An image uploaded since then is in the receipts directory
+            uploaded = get_image_index(self.local_dir).exact(json_filename.replace('.json', '.jpg'))
+            return (match, None) if unchanged and not uploaded else (None, None)
+        if get_image_index(os.path.dirname(path)).exact(os.path.basename(path)):
+            return match, path
+        return None, None
+
+@st.cache_resource(show_spinner=False)
+def get_image_manifest(path=IMAGE_MANIFEST_PATH):
+    """
+    Process-wide image manifest, shared by every session.
+
+    Returns:
+        ImageManifest: The manifest at path (empty until reconcile.py has run)
+    """
+    return ImageManifest(path)
+
+def _resolve_local_image_path(json_filename, resolve, raw_dir=RECEIPTS_RAW_DIR):
+    """Image path for a receipt in a local image directory (or None), recording how it was found on the resolve span."""
+    manifest = get_image_manifest()
+    # reconcile.py only covers the main image directory, not those of other shards
+    match, path = manifest.lookup(json_filename) if raw_dir == manifest.raw_dir else (None, None)
+    if match is not None:
+        resolve.set(outcome=match, manifest=True)
+        return path
+
+    img_filename = json_filename.replace('.json', '.jpg')
+    raw_index = get_image_index(raw_dir)
+    path = raw_index.exact(img_filename)
+    if path:
+        resolve.set(outcome="exact")
+        return path
+    path = get_image_index(RECEIPTS_DIR).exact(img_filename)
+    if path:
+        resolve.set(outcome="receipts")
+        return path
+
+    matches = raw_index.partial_matches(receipt_base_id(json_filename))
+    if matches:
+        resolve.set(outcome="partial")
+        return os.path.join(raw_dir, matches[0])
+    resolve.set(outcome="missing")
+    return None
+
+def _resolve_image_path(json_filename, resolve, image_source=IMAGE_SOURCE):
+    """Local image path for a receipt (or None), fetching it first if the source is remote."""
+    from image_sources import get_image_source
+
+    return get_image_source(image_source).find(json_filename, resolve)
+
+def find_receipt_image_path(json_filename, image_source=IMAGE_SOURCE):
+    """
+    Resolve the image file for a receipt without opening it.
+
+    Uses the image manifest when it can answer. Otherwise searches: exact
+    name in data/receipts_raw, exact name in receipts, then the best partial
+    ID match in data/receipts_raw. A remote source is searched the same way,
+    and the image downloaded into its disk cache (see image_sources.py).
+
+    Args:
+        json_filename (str): The JSON filename from the Excel data
+        image_source (str): Image directory or URL of the receipt's shard (see shards.py)
+
+    Returns:
+        str or None: Path to the image file if found, None otherwise
+    """
+    with metrics.span("image_resolve", source="preview") as resolve:
+        return _resolve_image_path(json_filename, resolve, image_source)
+
+@functools.lru_cache(maxsize=65536)
+def _content_digest(path, size, mtime_ns):
+    """SHA-1 of a file's content, memoized per (path, size, mtime)."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def normalize_orientation(image):
+    """
+    Apply the EXIF orientation and force portrait mode.
+
+    Landscape scans that carry no EXIF rotation are rotated 270 degrees, the
+    same way the review page always displayed them.
+    """
+    from PIL import ImageOps
+
+    with metrics.span("image_rotate"):
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        if width > height:
+            image = image.rotate(270, expand=True)
+    return image
+
+def build_previews(source_path, cache_dir=PREVIEW_CACHE_DIR):
+    """
+    Create (or reuse) the preview renditions of a receipt image.
+
+    Renditions are keyed by the source file's content hash, so they are shared
+    by every receipt pointing at the same image and survive restarts. The
+    source is decoded at most once per new image, using JPEG draft mode to
+    decode directly at a reduced scale when possible.
+
+    Args:
+        source_path (str): Path to the original receipt image
+        cache_dir (str): Directory holding the renditions
+
+    Returns:
+        dict: Rendition name (see PREVIEW_SIZES) -> path of the JPEG file
+    """
+    digest = _content_digest(source_path, *_file_signature(source_path))
+    paths = {name: os.path.join(cache_dir, f"{digest}-{name}.jpg") for name in PREVIEW_SIZES}
+    if all(os.path.exists(path) for path in paths.values()):
+        return paths
+
+    with _PREVIEW_BUILD_LOCKS[int(digest[:8], 16) % len(_PREVIEW_BUILD_LOCKS)]:
+        if all(os.path.exists(path) for path in paths.values()):
+            return paths
+        os.makedirs(cache_dir, exist_ok=True)
+        _render_previews(source_path, paths)
+    return paths
+
+def _render_previews(source_path, paths):
+    """Decode the source once and write every rendition in paths."""
+    from PIL import Image
+
+    with metrics.span("preview_build"):
+        with Image.open(source_path) as source:
+            largest = max(PREVIEW_SIZES.values())
+            # Lets libjpeg decode at 1/2, 1/4 or 1/8 scale when the source is much larger
+            source.draft('RGB', (largest, largest))
+            image = normalize_orientation(source)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            # Largest rendition first so each smaller one is resampled from it
+            for name, max_edge in sorted(PREVIEW_SIZES.items(), key=lambda item: -item[1]):
+                image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+                tmp_path = f"{paths[name]}.{os.getpid()}.{threading.get_ident()}.tmp"
+                image.save(tmp_path, 'JPEG', quality=PREVIEW_JPEG_QUALITY, optimize=True, progressive=True)
+                os.replace(tmp_path, paths[name])
+
+def get_receipt_previews(json_filename, image_source=IMAGE_SOURCE):
+    """
+    Get the preview renditions for a receipt.
+
+    Args:
+        json_filename (str): The JSON filename from the Excel data
+        image_source (str): Image directory or URL of the receipt's shard
+
+    Returns:
+        dict or None: Rendition name -> JPEG path, or None when the image
+        can't be found or decoded (callers then fall back to get_receipt_image)
+    """
+    source_path = find_receipt_image_path(json_filename, image_source)
+    if source_path is None:
+        return None
+    try:
+        return build_previews(source_path)
+    except Exception:
+        return None
+
+# Byte budget of the process-wide image cache, overridable per deployment
+IMAGE_CACHE_MAX_BYTES = int(os.environ.get("RECEIPT_IMAGE_CACHE_MB", "256")) * 1024 * 1024
+
+class ImageCache:
+    """
+    Thread-safe LRU cache of image data with a byte-based eviction budget.
+
+    Values are loaded outside the lock, so a slow decode in one session does
+    not block cache hits in others. Entries larger than the whole budget are
+    returned but not stored.
+    """
+
+    def __init__(self, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key, loader):
+        """
+        Return the cached value for key, loading it on a miss.
+
+        Args:
+            key (hashable): Cache key, e.g. (kind, path, size, mtime_ns)
+            loader (callable): Returns (value, size in bytes) on a miss
+
+        Returns:
+            object: The cached or freshly loaded value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        value, nbytes = loader()
+
+        with self._lock:
+            if key in self._entries or nbytes > self.max_bytes:
+                return value
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        """
+        Returns:
+            dict: hits, misses, evictions, entries, bytes and max_bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+@st.cache_resource(show_spinner=False)
+def get_image_cache():
+    """
+    Image cache shared by every session in this process.
+
+    Returns:
+        ImageCache: The process-wide cache
+    """
+    cache = ImageCache()
+    metrics.REGISTRY.register_collector("image_cache", cache.stats)
+    return cache
+
+def read_image_bytes(path):
+    """
+    Read an encoded image file through the shared image cache.
+
+    Args:
+        path (str): Path to the image file
+
+    Returns:
+        bytes: The file content
+    """
+    size, mtime_ns = _file_signature(path)
+
+    def _load():
+        with metrics.span("image_read"):
+            with open(path, 'rb') as f:
+                data = f.read()
+        return data, len(data)
+
+    return get_image_cache().get(('bytes', path, size, mtime_ns), _load)
+
+def open_image(path):
+    """
+    Decode an image file through the shared image cache.
+
+    The returned image is shared with other sessions; callers must not modify
+    it in place (rotate/resize return new images and are fine).
+
+    Args:
+        path (str): Path to the image file
+
+    Returns:
+        PIL.Image: The decoded image
+    """
+    from PIL import Image
+
+    size, mtime_ns = _file_signature(path)
+
+    def _load():
+        with metrics.span("image_decode"):
+            image = Image.open(path)
+            image.load()
+        return image, image.width * image.height * len(image.getbands())
+
+    return get_image_cache().get(('decoded', path, size, mtime_ns), _load)
+
+def get_receipt_preview_bytes(json_filename, image_source=IMAGE_SOURCE):
+    """
+    Get the encoded preview renditions for a receipt from the shared cache.
+
     Args:
         json_filename (str): The JSON filename from the Excel data
+        image_source (str): Image directory or URL of the receipt's shard
+
+    Returns:
+        dict or None: Rendition name -> JPEG bytes, or None (see get_receipt_previews)
+    """
+    previews = get_receipt_previews(json_filename, image_source)
+    if previews is None:
+        return None
+    try:
+        return {name: read_image_bytes(path) for name, path in previews.items()}
+    except OSError:
+        return None
+
+def get_receipt_image(json_filename, image_source=IMAGE_SOURCE):
+    """
+    Get receipt image based on JSON filename from its image source.
+
+    Nothing is written while looking: a missing image gets an in-memory
+    placeholder (run reconcile.py to find and report them up front). Only an
+    image the user uploads is saved, to the receipts directory.
+    
+    Args:
+        json_filename (str): The JSON filename from the Excel data
+        image_source (str): Image directory or URL of the receipt's shard
     
     Returns:
         PIL.Image or None: The receipt image if found, None otherwise
     """
-    # Convert JSON filename to image filename
-    img_filename = json_filename.replace('.json', '.jpg')
+    from PIL import Image
+
+    with metrics.span("image_resolve", source="original") as resolve:
+        # Convert JSON filename to image filename
+        img_filename = json_filename.replace('.json', '.jpg')
     
-    # First check in the data/receipts_raw directory
-    receipts_raw_dir = "data/receipts_raw"
-    if os.path.exists(receipts_raw_dir):
-        raw_image_path = os.path.join(receipts_raw_dir, img_filename)
-        if os.path.exists(raw_image_path):
+        image_path = _resolve_image_path(json_filename, resolve, image_source)
+        if image_path:
             try:
-                return Image.open(raw_image_path)
+                return open_image(image_path)
             except Exception as e:
-                st.error(f"เกิดข้อผิดพลาดในการเปิดรูปภาพจาก receipts_raw: {str(e)}")
+                st.error(f"เกิดข้อผิดพลาดในการเปิดรูปภาพ {image_path}: {str(e)}")
     
-    # Check if we already have a receipts directory and the image exists locally as fallback
-    receipts_dir = "receipts"
-    if not os.path.exists(receipts_dir):
-        os.makedirs(receipts_dir)
-        
-    local_path = os.path.join(receipts_dir, img_filename)
-    if os.path.exists(local_path):
+        # Allow user to upload image manually as a last resort
+        st.warning(f"ไม่พบรูปภาพใบเสร็จสำหรับ {img_filename}")
+        st.write("คุณสามารถอัปโหลดรูปภาพได้ที่นี่:")
+        uploaded_image = st.file_uploader(f"อัปโหลดรูปภาพสำหรับ {img_filename}", type=["jpg", "jpeg", "png"])
+    
+        if uploaded_image is not None:
+            # Keep the uploaded file as-is for future use (no re-encode)
+            os.makedirs(RECEIPTS_DIR, exist_ok=True)
+            image_path = os.path.join(RECEIPTS_DIR, img_filename)
+            uploaded_image.seek(0)
+            with open(image_path, 'wb') as f:
+                shutil.copyfileobj(uploaded_image, f, UPLOAD_CHUNK_BYTES)
+            get_image_index(RECEIPTS_DIR).add(img_filename)
+            resolve.set(outcome="upload")
+            return open_image(image_path)
+    
+        # Or the images of many receipts at once
+        from uploads import upload_files, archive_image_dir, ARCHIVE_TYPES
+        upload_files("หรืออัปโหลดไฟล์ ZIP ที่มีรูปภาพใบเสร็จหลายรายการ", ARCHIVE_TYPES, key="image_archive_upload",
+                     image_dir=archive_image_dir(image_source))
+    
+        # Create a simple receipt placeholder if all else fails
+        width, height = 600, 800
+        placeholder_image = Image.new('RGB', (width, height), color=(245, 245, 245))
+    
+        # Add text to the placeholder image
+        import PIL.ImageDraw
+        import PIL.ImageFont
+        draw = PIL.ImageDraw.Draw(placeholder_image)
         try:
-            return Image.open(local_path)
-        except Exception as e:
-            st.error(f"เกิดข้อผิดพลาดในการเปิดรูปภาพจาก receipts: {str(e)}")
-    
-    # If the exact filename doesn't exist, try partial matching for the ID part
-    # Extract base filename without extension
-    # Example: '17386590297053997295044438274399 - Victor Lee.json' -> '17386590297053997295044438274399'
-    base_filename = json_filename.split(' - ')[0] if ' - ' in json_filename else json_filename.split('.')[0]
-    
-    # Try to find a matching file in receipts_raw
-    if os.path.exists(receipts_raw_dir):
-        for filename in os.listdir(receipts_raw_dir):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png')) and base_filename in filename:
-                try:
-                    image_path = os.path.join(receipts_raw_dir, filename)
-                    receipt_image = Image.open(image_path)
-                    
-                    # Save a copy to the standard receipts directory for future use
-                    receipt_image.save(local_path)
-                    
-                    return receipt_image
-                except Exception as e:
-                    st.error(f"เกิดข้อผิดพลาดในการเปิดรูปภาพที่ตรงกัน: {str(e)}")
-    
-    # Allow user to upload image manually as a last resort
-    st.warning(f"ไม่พบรูปภาพใบเสร็จสำหรับ {img_filename}")
-    st.write("คุณสามารถอัปโหลดรูปภาพได้ที่นี่:")
-    uploaded_image = st.file_uploader(f"อัปโหลดรูปภาพสำหรับ {img_filename}", type=["jpg", "jpeg", "png"])
-    
-    if uploaded_image is not None:
-        image = Image.open(uploaded_image)
-        # Save uploaded image for future use
-        image.save(local_path)
-        return image
-    
-    # Create a simple receipt placeholder if all else fails
-    width, height = 600, 800
-    placeholder_image = Image.new('RGB', (width, height), color=(245, 245, 245))
-    
-    # Add text to the placeholder image
-    import PIL.ImageDraw
-    import PIL.ImageFont
-    draw = PIL.ImageDraw.Draw(placeholder_image)
-    try:
-        # Try to use a system font
-        font = PIL.ImageFont.truetype("Arial", 20)
-    except:
-        # Fall back to default
-        font = PIL.ImageFont.load_default()
+            # Try to use a system font
+            font = PIL.ImageFont.truetype("Arial", 20)
+        except:
+            # Fall back to default
+            font = PIL.ImageFont.load_default()
         
-    draw.text((width/2-150, height/2-50), f"ไม่พบรูปภาพใบเสร็จ", fill=(0, 0, 0), font=font)
-    draw.text((width/2-150, height/2), f"ID: {base_filename}", fill=(0, 0, 0), font=font)
+        draw.text((width/2-150, height/2-50), f"ไม่พบรูปภาพใบเสร็จ", fill=(0, 0, 0), font=font)
+        draw.text((width/2-150, height/2), f"ID: {receipt_base_id(json_filename)}", fill=(0, 0, 0), font=font)
     
-    # Save the placeholder image for future use
-    placeholder_image.save(local_path)
-    return placeholder_image
+        resolve.set(outcome="placeholder")
+        return placeholder_image
@@ -0,0 +1,207 @@
+"""
+Rule-based checks of the extracted fields, run over a whole dataset at once.
+
+Every field of every receipt gets a confidence between 0 and 1 from format
+and plausibility rules (the Thai Tax ID checksum, dates in a plausible range,
+parseable amounts, ...) and from cross-field consistency within the dataset.
+The verdict store uses each receipt's triage priority to decide which
+receipts reviewers get first, and the review page can pre-tick the fields
+that pass (RECEIPT_PRETICK=1).
+"""
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils import get_receipt_fields, MISSING_VALUE
+from verification_store import VERIFIED_FIELDS
+
+# Triage order on the review page; RECEIPT_TRIAGE=0 turns it (and pre-ticking) off
+TRIAGE_ENABLED = os.environ.get("RECEIPT_TRIAGE", "1").lower() not in ("", "0", "false", "no")
+
+# Pre-ticking fields that pass on the review page. Off unless RECEIPT_PRETICK=1:
+# verdicts don't record which fields started ticked, so a pre-ticked field a
+# reviewer let through counts as checked in the accuracy reports.
+PRETICK_ENABLED = TRIAGE_ENABLED and os.environ.get("RECEIPT_PRETICK", "0").lower() not in ("", "0", "false", "no")
+
+# Fields at or above this confidence start out ticked
+PRETICK_CONFIDENCE = 0.8
+
+# Fields below this confidence are flagged on the review page
+FLAG_CONFIDENCE = 0.5
+
+# Receipts with at least this many missing fields are reviewed last
+SKIP_MISSING_FIELDS = 4
+
+# Values of the verdict store's priority column; leases go to higher priorities first
+PRIORITY_SKIP = 0      # (nearly) nothing was extracted
+PRIORITY_REVIEW = 1    # some fields need a careful look
+PRIORITY_CONFIRM = 2   # every field passes its checks; one click to confirm
+
+# Receipt dates older than this many days (or in the future) are implausible
+DATE_MAX_AGE_DAYS = 5 * 365
+
+# Totals outside this range (in baht) are implausible
+AMOUNT_RANGE = (0.01, 1000000)
+
+# What extraction writes when it found nothing
+_EMPTY_MARKERS = ['none', 'null', 'nan', 'n/a', '-', '']
+
+# Confidence of a value that passes every check of its field. Receipt
+# numbers and store names can only be checked for shape, so they get less.
+_PASS = {
+    'tax_id': 0.95,
+    'receipt_number': 0.8,
+    'date': 0.9,
+    'time': 0.9,
+    'total_amount': 0.9,
+    'store_name': 0.8,
+}
+
+def thai_tax_id_valid(tax_ids):
+    """
+    Check Thai 13-digit Tax IDs against their check digit.
+
+    The check digit is (11 - sum(digit[i] * (13 - i) for the first 12 digits) mod 11) mod 10.
+
+    Args:
+        tax_ids (pandas.Series): Tax ID strings (anything but 13 digits fails)
+
+    Returns:
+        numpy.ndarray: bool per value
+    """
+    text = tax_ids.astype(object).where(tax_ids.notna(), "")
+    is_digits = text.str.fullmatch(r'\d{13}').fillna(False).to_numpy(dtype=bool)
+    valid = np.zeros(len(text), dtype=bool)
+    if is_digits.any():
+        digits = np.frombuffer("".join(text[is_digits]).encode("ascii"), dtype=np.uint8).reshape(-1, 13) - ord("0")
+        check = (11 - (digits[:, :12].astype(np.int64) @ np.arange(13, 1, -1)) % 11) % 10
+        valid[is_digits] = check == digits[:, 12]
+    return valid
+
+def validate_receipt_fields(fields, today=None):
+    """
+    Confidence that each extracted field is right, from rules alone.
+
+    - Tax ID: 13 digits with a valid check digit.
+    - Receipt Number: present, not a placeholder like "None", contains a digit.
+    - Date: parsed, not in the future, not older than DATE_MAX_AGE_DAYS.
+    - Time: parsed as a time of day; exactly midnight is suspect (a default, not a reading).
+    - Total Amount: parsed, within AMOUNT_RANGE.
+    - Store name: present and contains letters.
+
+    Cross-field checks lower confidence further: a receipt number repeated
+    for the same Tax ID in another file, and a store name that differs from
+    the one most receipts with the same Tax ID carry.
+
+    Args:
+        fields (pandas.DataFrame): normalize_receipt_fields() output
+        today (datetime.date): Reference date for plausibility (default: today)
+
+    Returns:
+        pandas.DataFrame: One float32 column per field in VERIFIED_FIELDS, in dataset order
+    """
+    today = pd.Timestamp(today or datetime.date.today())
+    missing = {field: (fields[field] == MISSING_VALUE).to_numpy() for field in VERIFIED_FIELDS}
+    confidence = {}
+
+    tax_id_valid = thai_tax_id_valid(fields['tax_id'])
+    tax_id_digits = fields['tax_id'].str.fullmatch(r'\d{13}').fillna(False).to_numpy(dtype=bool)
+    confidence['tax_id'] = np.select([tax_id_valid, tax_id_digits], [_PASS['tax_id'], 0.2], 0.1)
+
+    receipt_number = fields['receipt_number'].astype(str)
+    placeholder = receipt_number.str.strip().str.lower().isin(_EMPTY_MARKERS).to_numpy()
+    has_digit = receipt_number.str.contains(r'\d').to_numpy(dtype=bool)
+    plausible_length = receipt_number.str.len().between(2, 40).to_numpy()
+    confidence['receipt_number'] = np.select(
+        [placeholder, has_digit & plausible_length], [0.0, _PASS['receipt_number']], 0.4)
+
+    date_value = fields['date_value']
+    date_parsed = date_value.notna().to_numpy()
+    date_plausible = (date_value <= today) & (date_value >= today - pd.Timedelta(days=DATE_MAX_AGE_DAYS))
+    confidence['date'] = np.select([date_plausible.to_numpy(), date_parsed], [_PASS['date'], 0.2], 0.1)
+
+    # Parsed times are shown as HH:MM:SS; anything else is as extracted
+    receipt_time = fields['time'].astype(str)
+    time_parsed = receipt_time.str.fullmatch(r'\d{2}:\d{2}:\d{2}').to_numpy(dtype=bool)
+    confidence['time'] = np.select([time_parsed & (receipt_time != "00:00:00").to_numpy(), time_parsed],
+                                   [_PASS['time'], 0.5], 0.1)
+
+    amount = fields['total_amount_value']
+    amount_plausible = amount.between(*AMOUNT_RANGE).to_numpy()
+    confidence['total_amount'] = np.select([amount_plausible, amount.notna().to_numpy()],
+                                           [_PASS['total_amount'], 0.2], 0.1)
+
+    has_letters = fields['store_name'].astype(str).str.contains(r'[^\W\d_]').to_numpy(dtype=bool)
+    confidence['store_name'] = np.where(has_letters, _PASS['store_name'], 0.2)
+
+    # Cross-field: within one company (a valid Tax ID), receipt numbers are
+    # unique and the store name is usually the same
+    company = pd.Series(np.where(tax_id_valid, fields['tax_id'].to_numpy(), None), dtype=object)
+    repeated = (company.notna() & ~missing['receipt_number']
+                & pd.DataFrame({'company': company, 'number': fields['receipt_number'].to_numpy()})
+                .duplicated(keep=False)).to_numpy()
+    confidence['receipt_number'] = np.where(repeated, confidence['receipt_number'] * 0.5,
+                                            confidence['receipt_number'])
+    store_counts = (pd.DataFrame({'company': company, 'store': fields['store_name'].to_numpy()})
+                    .loc[company.notna() & ~missing['store_name']].value_counts())
+    usual_store = store_counts.reset_index().drop_duplicates('company').set_index('company')['store']
+    unusual_store = (company.notna() & ~missing['store_name']
+                     & (company.map(usual_store) != fields['store_name'].to_numpy())).to_numpy()
+    confidence['store_name'] = np.where(unusual_store, confidence['store_name'] * 0.5, confidence['store_name'])
+
+    return pd.DataFrame({
+        field: np.where(missing[field], 0.0, confidence[field]).astype(np.float32) for field in VERIFIED_FIELDS
+    })
+
+def triage_priority(confidence):
+    """
+    Review priority of each receipt (PRIORITY_CONFIRM, PRIORITY_REVIEW or PRIORITY_SKIP).
+
+    Args:
+        confidence (pandas.DataFrame): validate_receipt_fields() output
+
+    Returns:
+        numpy.ndarray: int8 per receipt
+    """
+    values = confidence[VERIFIED_FIELDS].to_numpy()
+    return np.select([(values == 0).sum(axis=1) >= SKIP_MISSING_FIELDS, (values >= PRETICK_CONFIDENCE).all(axis=1)],
+                     [PRIORITY_SKIP, PRIORITY_CONFIRM], PRIORITY_REVIEW).astype(np.int8)
+
+class ReceiptTriage:
+    """
+    Field confidences and review priorities of a dataset, computed once per dataset.
+    """
+
+    def __init__(self, receipts_data, fields):
+        self.confidence = validate_receipt_fields(fields.frame)
+        self.priority = triage_priority(self.confidence)
+        self._confidence = self.confidence[VERIFIED_FIELDS].to_numpy()
+
+    def confidence_at(self, position):
+        """Field key -> confidence for a dataset position."""
+        return dict(zip(VERIFIED_FIELDS, self._confidence[position].tolist()))
+
+    def preticked(self, position):
+        """Field key -> whether the field starts out ticked, like st.session_state.verified_fields."""
+        return {field: value >= PRETICK_CONFIDENCE for field, value in self.confidence_at(position).items()}
+
+    def flagged(self, position):
+        """Field keys whose values failed their checks."""
+        return {field for field, value in self.confidence_at(position).items() if value < FLAG_CONFIDENCE}
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_receipt_triage(_receipts_data, dataset_key):
+    """
+    Triage shared by every session, built once per dataset version.
+
+    Args:
+        _receipts_data (pandas.DataFrame): The receipt data (not hashed)
+        dataset_key (hashable): Identifies the dataset version
+
+    Returns:
+        ReceiptTriage: The confidences and priorities for the dataset
+    """
+    return ReceiptTriage(_receipts_data, get_receipt_fields(_receipts_data, dataset_key))
@@ -0,0 +1,596 @@
+"""
+SQLite store of review verdicts and leases, shared by every session and process.
+
+The review page only clears a reviewer's own verdicts. Clearing everyone's
+is an administrative step, from the command line:
+
+Usage:
+    python verification_store.py reset [--reviewer ID] [--db data/verification.db] [--yes]
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# Review progress shared by every session and kept across restarts
+VERIFICATION_DB_PATH = os.path.join("data", "verification.db")
+
+# Checkbox keys in st.session_state.verified_fields, in display order
+VERIFIED_FIELDS = ['tax_id', 'receipt_number', 'date', 'time', 'total_amount', 'store_name']
+
+# Columns added after the first release of the schema, for existing databases
+_ADDED_COLUMNS = {
+    'reviewer': 'TEXT',
+    'lease_owner': 'TEXT',
+    'lease_expires': 'REAL',
+    'priority': 'INTEGER',
+    'verdict_seq': 'INTEGER',
+    'shard': "TEXT NOT NULL DEFAULT ''",
+}
+
+# Values of receipts.status
+STATUS_UNVERIFIED = 0
+STATUS_VERIFIED = 1
+STATUS_CANCELLED = 2
+
+# How many receipts a session holds at once, and how long a lease lives
+# without being renewed (each rerun of the session renews it)
+LEASE_BATCH_SIZE = 5
+LEASE_SECONDS = 10 * 60
+
+# Buckets shown in the summary panel; 'true0' counts "Yes" with nothing ticked
+SUMMARY_BUCKETS = ['true6', 'true5', 'true4', 'true3', 'true2', 'true1', 'true0', 'cancel']
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS receipts (
+    json_file TEXT PRIMARY KEY,
+    position INTEGER,
+    status INTEGER NOT NULL DEFAULT {STATUS_UNVERIFIED},
+    checked_count INTEGER,
+    {', '.join(f'{field} INTEGER' for field in VERIFIED_FIELDS)},
+    verified_at REAL,
+    reviewer TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    priority INTEGER,
+    verdict_seq INTEGER,
+    shard TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS receipts_status_position ON receipts (status, position);
+CREATE INDEX IF NOT EXISTS receipts_status_priority ON receipts (status, priority DESC, position);
+CREATE INDEX IF NOT EXISTS receipts_lease_owner ON receipts (lease_owner);
+CREATE INDEX IF NOT EXISTS receipts_verdict_seq ON receipts (verdict_seq);
+CREATE INDEX IF NOT EXISTS receipts_shard_status_priority ON receipts (shard, status, priority DESC, position);
+CREATE TABLE IF NOT EXISTS summary (
+    bucket TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shards (
+    name TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    rows INTEGER NOT NULL
+);
+"""
+
+# Unverified and not held by another reviewer's live lease (parameters: owner, now)
+_AVAILABLE_TO = f"""
+    status = {STATUS_UNVERIFIED} AND position IS NOT NULL
+    AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)
+"""
+
+# Next value of receipts.verdict_seq, which orders status changes so other processes can catch up on them
+_NEXT_VERDICT_SEQ = "(SELECT COALESCE(MAX(verdict_seq), 0) + 1 FROM receipts)"
+
+def _bucket(status, checked_count):
+    """Summary bucket a receipt counts towards, or None while unverified."""
+    if status == STATUS_CANCELLED:
+        return 'cancel'
+    if status == STATUS_VERIFIED:
+        return f'true{checked_count}'
+    return None
+
+class VerificationStore:
+    """
+    SQLite (WAL mode) store of per-receipt, per-field review verdicts.
+
+    Receipts are registered with their dataset position by sync(). Progress
+    queries use the (status, position) index or the summary counters, which
+    are updated in the same transaction as each verdict, so none of them
+    scan the dataset. Several sessions or processes may write at once;
+    writes take SQLite's write lock up front (BEGIN IMMEDIATE).
+
+    Reviewers working in parallel lease batches of unverified receipts with
+    lease_batch(), highest triage priority first. A leased receipt is hidden
+    from other reviewers until its lease expires or a verdict is recorded for it.
+
+    Which receipts are unverified is also kept as a process-wide bitmap over
+    dataset positions, shared by every session. It is brought up to date from
+    the status changes since it was last read (numbered by verdict_seq), so
+    listing what a reviewer can pick doesn't read the whole table.
+
+    Given a verdict log (export.VerdictLog), every verdict recorded and every
+    reset is also appended to it once committed.
+    """
+
+    def __init__(self, db_path=VERIFICATION_DB_PATH, verdict_log=None):
+        self.db_path = db_path
+        self.verdict_log = verdict_log
+        self._local = threading.local()
+        self._synced_keys = {}
+        self._sync_lock = threading.Lock()
+        self._unverified_lock = threading.Lock()
+        self._unverified = None
+        self._unverified_seq = 0
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(receipts)")}
+        for column, column_type in _ADDED_COLUMNS.items():
+            if existing and column not in existing:
+                conn.execute(f"ALTER TABLE receipts ADD COLUMN {column} {column_type}")
+        conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads; Streamlit runs
+        # each rerun on its own thread, so keep one connection per thread.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, func):
+        """Run func(conn) in an immediate transaction."""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _rebuild_summary(conn):
+        conn.execute("DELETE FROM summary")
+        conn.executemany("INSERT INTO summary (bucket, count) VALUES (?, 0)",
+                         [(bucket,) for bucket in SUMMARY_BUCKETS + ['remaining']])
+        conn.execute(f"""
+            UPDATE summary SET count = (
+                SELECT COUNT(*) FROM receipts
+                WHERE position IS NOT NULL AND (
+                    (summary.bucket = 'remaining' AND status = {STATUS_UNVERIFIED})
+                    OR (summary.bucket = 'cancel' AND status = {STATUS_CANCELLED})
+                    OR (status = {STATUS_VERIFIED} AND summary.bucket = 'true' || checked_count)
+                )
+            )
+        """)
+
+    def sync(self, json_files, key=None, priorities=None, shard=None, offset=0):
+        """
+        Register the dataset's receipts, their positions and triage priorities.
+
+        Receipts already in the store keep their verdicts. Receipts no longer
+        in the dataset are kept but excluded from every query. Runs once per
+        key (e.g. one dataset version), so it can be called on every rerun.
+
+        A sharded dataset (see shards.py) is registered one shard at a time:
+        positions are offset to the shard's place in the dataset, only the
+        shard's own receipts are retired, and its key is kept in the store
+        (see shard_versions()) so a restart doesn't have to register it again.
+
+        Args:
+            json_files (iterable): 'Source JSON File' values in dataset order
+            key (hashable): Identifies this dataset version; None always syncs
+            priorities (iterable): Review priority per receipt, in dataset order
+                (higher is leased first); None leases in dataset order
+            shard (str): Shard being registered; None for a dataset that is one piece
+            offset (int): Dataset position of the shard's first receipt
+        """
+        if key is not None and key == self._synced_keys.get(shard):
+            return
+        # Concurrent first reruns (or the startup warm-up) wait for one sync instead of each running it
+        with self._sync_lock:
+            if key is not None and key == self._synced_keys.get(shard):
+                return
+            rows_priorities = itertools.repeat(None) if priorities is None else (int(value) for value in priorities)
+
+            def _sync(conn):
+                conn.execute("CREATE TEMP TABLE IF NOT EXISTS incoming "
+                             "(json_file TEXT PRIMARY KEY, position INTEGER, priority INTEGER)")
+                conn.execute("DELETE FROM incoming")
+                conn.executemany("INSERT OR IGNORE INTO incoming (json_file, position, priority) VALUES (?, ?, ?)",
+                                 ((json_file, offset + position, priority) for position, (json_file, priority)
+                                  in enumerate(zip(json_files, rows_priorities))))
+                # Receipts that move get a new verdict_seq, so other processes notice (see _unverified_mask)
+                conn.execute(f"""
+                    UPDATE receipts SET position = NULL, verdict_seq = {_NEXT_VERDICT_SEQ}
+                    WHERE position IS NOT NULL AND json_file NOT IN (SELECT json_file FROM incoming)
+                        {"" if shard is None else "AND shard = ?"}
+                """, [] if shard is None else [shard])
+                conn.execute(f"""
+                    INSERT INTO receipts (json_file, position, priority, verdict_seq, shard)
+                    SELECT json_file, position, priority, {_NEXT_VERDICT_SEQ}, ? FROM incoming WHERE true
+                    ON CONFLICT (json_file) DO UPDATE SET position = excluded.position, priority = excluded.priority,
+                        shard = excluded.shard,
+                        verdict_seq = CASE WHEN position IS excluded.position THEN verdict_seq
+                                           ELSE excluded.verdict_seq END
+                """, (shard or '',))
+                rows = conn.execute("SELECT COUNT(*) FROM incoming").fetchone()[0]
+                conn.execute("DELETE FROM incoming")
+                if shard is None:
+                    conn.execute("DELETE FROM shards")
+                else:
+                    conn.execute("INSERT OR REPLACE INTO shards (name, key, position, rows) VALUES (?, ?, ?, ?)",
+                                 (shard, str(key), offset, rows))
+                self._rebuild_summary(conn)
+
+            self._write(_sync)
+            if shard is None:
+                self._synced_keys = {None: key}
+            else:
+                # A whole-dataset sync retired this shard's receipts; the next one has to run again
+                self._synced_keys.pop(None, None)
+                self._synced_keys[shard] = key
+            # Positions may have moved
+            with self._unverified_lock:
+                self._unverified = None
+
+    def shard_versions(self):
+        """
+        Shards registered by sync(), as last registered by any process.
+
+        Returns:
+            dict: Shard name -> (key as a string, offset, number of receipts)
+        """
+        return {name: (key, position, rows) for name, key, position, rows
+                in self._connect().execute("SELECT name, key, position, rows FROM shards")}
+
+    def move_shard(self, shard, offset):
+        """
+        Shift a registered shard's receipts to start at another dataset position.
+
+        For a shard whose extract is unchanged but whose place in the dataset
+        moved, so it doesn't have to be registered again. Verdicts are kept.
+
+        Args:
+            shard (str): Shard name, as registered by sync()
+            offset (int): Dataset position of the shard's first receipt
+        """
+        def _move(conn):
+            row = conn.execute("SELECT position FROM shards WHERE name = ?", (shard,)).fetchone()
+            if row is None or row[0] == offset:
+                return
+            # New verdict_seq values, so other processes notice the move (see _unverified_mask)
+            conn.execute(f"UPDATE receipts SET position = position + ?, verdict_seq = {_NEXT_VERDICT_SEQ} "
+                         f"WHERE shard = ? AND position IS NOT NULL", (offset - row[0], shard))
+            conn.execute("UPDATE shards SET position = ? WHERE name = ?", (offset, shard))
+
+        self._write(_move)
+        with self._unverified_lock:
+            self._unverified = None
+
+    def retire_shards(self, keep):
+        """
+        Take the receipts of every shard not in keep out of the dataset.
+
+        Their verdicts are kept, as for receipts that leave a dataset in sync().
+
+        Args:
+            keep (iterable): Names of the shards still in the dataset
+        """
+        keep = list(keep)
+
+        def _retire(conn):
+            placeholders = ", ".join("?" * len(keep))
+            retired = conn.execute(f"""
+                UPDATE receipts SET position = NULL, verdict_seq = {_NEXT_VERDICT_SEQ}
+                WHERE position IS NOT NULL AND shard NOT IN ({placeholders})
+            """, keep).rowcount
+            conn.execute(f"DELETE FROM shards WHERE name NOT IN ({placeholders})", keep)
+            if retired:
+                self._rebuild_summary(conn)
+            return retired
+
+        if self._write(_retire):
+            self._synced_keys = {shard: key for shard, key in self._synced_keys.items() if shard in keep}
+            with self._unverified_lock:
+                self._unverified = None
+
+    def record_verdict(self, json_file, verified_fields=None, cancelled=False, reviewer=None, only_unverified=False):
+        """
+        Store the review result for one receipt and release its lease.
+
+        Recording a verdict for an already reviewed receipt replaces it,
+        unless only_unverified is set.
+
+        Args:
+            json_file (str): The receipt's 'Source JSON File'
+            verified_fields (dict): Field key -> ticked, as in st.session_state.verified_fields
+            cancelled (bool): True for the "cancel" button
+            reviewer (str): Lease owner recording the verdict
+            only_unverified (bool): Record nothing if the receipt already has a
+                verdict (checked in the same transaction as the write)
+
+        Returns:
+            bool: False if another reviewer holds a live lease on the receipt,
+            or only_unverified is set and it has a verdict (nothing is
+            recorded), True otherwise
+        """
+        verified_fields = verified_fields or {}
+        checks = [1 if verified_fields.get(field) else 0 for field in VERIFIED_FIELDS]
+        status = STATUS_CANCELLED if cancelled else STATUS_VERIFIED
+        checked_count = None if cancelled else sum(checks)
+        now = time.time()
+
+        def _record(conn):
+            row = conn.execute(
+                "SELECT status, checked_count, position, lease_owner, lease_expires FROM receipts WHERE json_file = ?",
+                (json_file,)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO receipts (json_file) VALUES (?)", (json_file,))
+                row = (STATUS_UNVERIFIED, None, None, None, None)
+            old_status, old_checked_count, position, lease_owner, lease_expires = row
+            if lease_owner is not None and lease_owner != reviewer and lease_expires >= now:
+                return False
+            if only_unverified and old_status != STATUS_UNVERIFIED:
+                return False
+
+            conn.execute(
+                f"UPDATE receipts SET status = ?, checked_count = ?, "
+                f"{', '.join(f'{field} = ?' for field in VERIFIED_FIELDS)}, verified_at = ?, "
+                f"reviewer = ?, lease_owner = NULL, lease_expires = NULL, verdict_seq = {_NEXT_VERDICT_SEQ} "
+                f"WHERE json_file = ?",
+                (status, checked_count, *([None] * len(checks) if cancelled else checks), now, reviewer,
+                 json_file))
+
+            if position is not None:
+                old_bucket = _bucket(old_status, old_checked_count) or 'remaining'
+                conn.execute("UPDATE summary SET count = count - 1 WHERE bucket = ?", (old_bucket,))
+                conn.execute("UPDATE summary SET count = count + 1 WHERE bucket = ?",
+                             (_bucket(status, checked_count),))
+            return True
+
+        recorded = self._write(_record)
+        if recorded and self.verdict_log is not None:
+            self.verdict_log.record_verdict(json_file, status, checked_count, None if cancelled else checks,
+                                            reviewer, now)
+        return recorded
+
+    def lease_batch(self, owner, size=LEASE_BATCH_SIZE, ttl=LEASE_SECONDS, shard=None):
+        """
+        Renew the owner's leases and top them up to size receipts.
+
+        New leases go to the highest-priority (then lowest-position) receipts
+        that are unverified and not under another live lease, so concurrent
+        reviewers never get the same receipt. Expired leases return to the pool automatically.
+
+        Args:
+            owner (str): Reviewer (session) id
+            size (int): Number of receipts to hold
+            ttl (float): Seconds until the leases expire unless renewed
+            shard (str): Lease only from this shard, giving up the owner's
+                leases in other shards (a reviewer works one shard at a time);
+                None leases from the whole dataset
+
+        Returns:
+            list: (json_file, position) of the owner's leased receipts, in lease order
+        """
+        # "+status" keeps SQLite on the lease_owner index: a reviewer's few
+        # leases, rather than every unverified receipt
+        held = self._connect().execute(
+            f"SELECT json_file, position, lease_expires, shard FROM receipts WHERE lease_owner = ? "
+            f"AND +status = {STATUS_UNVERIFIED} AND position IS NOT NULL ORDER BY priority DESC, position",
+            (owner,)).fetchall()
+        # A full batch renewed within the last half of its lifetime needs no
+        # write, so reruns don't queue for the write lock
+        if (len(held) >= size and all(expires >= time.time() + ttl / 2 for _, _, expires, _ in held)
+                and (shard is None or all(held_shard == shard for _, _, _, held_shard in held))):
+            return [(json_file, position) for json_file, position, _, _ in held]
+
+        def _lease(conn):
+            now = time.time()
+            if shard is not None:
+                conn.execute("UPDATE receipts SET lease_owner = NULL, lease_expires = NULL "
+                             "WHERE lease_owner = ? AND shard IS NOT ?", (owner, shard))
+            conn.execute(
+                f"UPDATE receipts SET lease_expires = ? WHERE lease_owner = ? AND +status = {STATUS_UNVERIFIED}",
+                (now + ttl, owner))
+            held = conn.execute(
+                f"SELECT COUNT(*) FROM receipts WHERE lease_owner = ? AND +status = {STATUS_UNVERIFIED} "
+                f"AND position IS NOT NULL", (owner,)).fetchone()[0]
+            if held < size:
+                # Spelled out rather than "? IS NULL OR", so SQLite can use the shard's index
+                in_shard = "" if shard is None else "AND shard = ?"
+                conn.execute(f"""
+                    UPDATE receipts SET lease_owner = ?, lease_expires = ? WHERE json_file IN (
+                        SELECT json_file FROM receipts
+                        WHERE {_AVAILABLE_TO} AND lease_owner IS NOT ? {in_shard}
+                        ORDER BY priority DESC, position LIMIT ?
+                    )
+                """, (owner, now + ttl, owner, now, owner, *([] if shard is None else [shard]), size - held))
+            return conn.execute(
+                f"SELECT json_file, position FROM receipts WHERE lease_owner = ? AND +status = {STATUS_UNVERIFIED} "
+                f"AND position IS NOT NULL ORDER BY priority DESC, position", (owner,)).fetchall()
+
+        return self._write(_lease)
+
+    def reset(self, reviewer=None):
+        """
+        Clear verdicts so their receipts are unverified again.
+
+        Args:
+            reviewer (str): Only clear the verdicts this reviewer recorded (and
+                give up their leases); None clears every verdict in the store
+        """
+        def _reset(conn):
+            conn.execute(f"""
+                UPDATE receipts SET status = {STATUS_UNVERIFIED}, checked_count = NULL,
+                    {', '.join(f'{field} = NULL' for field in VERIFIED_FIELDS)}, verified_at = NULL,
+                    reviewer = NULL, lease_owner = NULL, lease_expires = NULL, verdict_seq = {_NEXT_VERDICT_SEQ}
+                {"" if reviewer is None else "WHERE reviewer = ?"}
+            """, [] if reviewer is None else [reviewer])
+            if reviewer is not None:
+                conn.execute("UPDATE receipts SET lease_owner = NULL, lease_expires = NULL WHERE lease_owner = ?",
+                             (reviewer,))
+            self._rebuild_summary(conn)
+
+        self._write(_reset)
+        if self.verdict_log is not None:
+            self.verdict_log.record_reset(time.time(), reviewer)
+
+    def counts(self):
+        """
+        Returns:
+            dict: Summary bucket ('true6' ... 'true0', 'cancel', 'remaining') -> count
+        """
+        rows = self._connect().execute("SELECT bucket, count FROM summary").fetchall()
+        counts = {bucket: 0 for bucket in SUMMARY_BUCKETS + ['remaining']}
+        counts.update(rows)
+        return counts
+
+    def remaining(self):
+        """
+        Returns:
+            int: Number of unverified receipts in the dataset
+        """
+        row = self._connect().execute("SELECT count FROM summary WHERE bucket = 'remaining'").fetchone()
+        return row[0] if row else 0
+
+    def _unverified_mask(self, conn):
+        """The unverified bitmap, brought up to date (caller holds _unverified_lock)."""
+        if self._unverified is not None:
+            changes = conn.execute(
+                "SELECT verdict_seq, position, status FROM receipts WHERE verdict_seq > ?",
+                (self._unverified_seq,)).fetchall()
+            if changes:
+                seqs, positions, statuses = zip(*changes)
+                if None in positions or max(positions) >= len(self._unverified):
+                    # Another process synced a different version of the dataset; start over
+                    self._unverified = None
+                else:
+                    self._unverified[list(positions)] = np.array(statuses) == STATUS_UNVERIFIED
+                    self._unverified_seq = max(seqs)
+        if self._unverified is None:
+            # Read before the statuses, so a change in between is applied again next time rather than missed
+            self._unverified_seq = conn.execute("SELECT COALESCE(MAX(verdict_seq), 0) FROM receipts").fetchone()[0]
+            size = conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM receipts").fetchone()[0]
+            positions = np.fromiter((row[0] for row in conn.execute(
+                f"SELECT position FROM receipts WHERE status = {STATUS_UNVERIFIED} AND position IS NOT NULL")),
+                dtype=np.int64)
+            self._unverified = np.zeros(size, dtype=bool)
+            self._unverified[positions] = True
+        return self._unverified
+
+    def unverified_positions(self, owner=None):
+        """
+        Args:
+            owner (str): Reviewer id; receipts leased by other reviewers are skipped
+
+        Returns:
+            numpy.ndarray: Dataset positions of the unverified receipts, in order
+        """
+        conn = self._connect()
+        with self._unverified_lock:
+            positions = np.flatnonzero(self._unverified_mask(conn))
+        # "lease_owner > ''" (any owner) is a range on the lease_owner index; IS NOT NULL would scan
+        leased = [row[0] for row in conn.execute(
+            f"SELECT position FROM receipts WHERE lease_owner > '' AND lease_owner IS NOT ? "
+            f"AND lease_expires >= ? AND +status = {STATUS_UNVERIFIED} AND position IS NOT NULL",
+            (owner, time.time()))]
+        if leased:
+            positions = positions[~np.isin(positions, leased)]
+        return positions
+
+    def iter_verdicts(self, chunksize=100000):
+        """
+        Stream the verdict columns of every receipt in the dataset.
+
+        Args:
+            chunksize (int): Rows per chunk
+
+        Yields:
+            pandas.DataFrame: json_file, status, checked_count and one 0/1
+            column per field (NULL unless verified)
+        """
+        query = (f"SELECT json_file, status, checked_count, {', '.join(VERIFIED_FIELDS)} "
+                 f"FROM receipts WHERE position IS NOT NULL ORDER BY position")
+        yield from pd.read_sql_query(query, self._connect(), chunksize=chunksize)
+
+    def verdicts_for(self, json_files):
+        """
+        Verdict columns for the given receipts, in the given order.
+
+        Receipts the store doesn't know are returned as unverified.
+
+        Args:
+            json_files (list): 'Source JSON File' values
+
+        Returns:
+            pandas.DataFrame: Same columns as iter_verdicts()
+        """
+        conn = self._connect()
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lookup (seq INTEGER PRIMARY KEY, json_file TEXT)")
+        conn.execute("DELETE FROM lookup")
+        conn.executemany("INSERT INTO lookup (seq, json_file) VALUES (?, ?)", enumerate(json_files))
+        verdicts = pd.read_sql_query(
+            f"SELECT lookup.json_file, COALESCE(receipts.status, {STATUS_UNVERIFIED}) AS status, "
+            f"receipts.checked_count, {', '.join(f'receipts.{field}' for field in VERIFIED_FIELDS)} "
+            f"FROM lookup LEFT JOIN receipts ON receipts.json_file = lookup.json_file ORDER BY lookup.seq",
+            conn)
+        conn.execute("DELETE FROM lookup")
+        return verdicts
+
+@st.cache_resource(show_spinner=False)
+def get_verification_store(db_path=VERIFICATION_DB_PATH):
+    """
+    Verification store shared by every session in this process, logging
+    its verdicts to the process's verdict log.
+
+    Returns:
+        VerificationStore: The store for db_path
+    """
+    # Imported here because export imports this module
+    from export import get_verdict_log
+
+    return VerificationStore(db_path, get_verdict_log())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reset_parser = subparsers.add_parser("reset", help="clear review verdicts (everyone's unless --reviewer)")
+    reset_parser.add_argument("--reviewer", help="only clear this reviewer's verdicts")
+    reset_parser.add_argument("--db", default=VERIFICATION_DB_PATH)
+    reset_parser.add_argument("--yes", action="store_true", help="don't ask for confirmation")
+    args = parser.parse_args()
+
+    from export import VerdictLog, VERDICT_LOG_DIR, VERDICT_LOG_ENABLED
+
+    verdict_log = VerdictLog(VERDICT_LOG_DIR) if VERDICT_LOG_ENABLED else None
+    store = VerificationStore(args.db, verdict_log)
+    query, params = f"SELECT COUNT(*) FROM receipts WHERE status != {STATUS_UNVERIFIED}", []
+    if args.reviewer is not None:
+        query, params = query + " AND reviewer = ?", [args.reviewer]
+    count = store._connect().execute(query, params).fetchone()[0]
+    whose = "every reviewer's" if args.reviewer is None else f"reviewer {args.reviewer}'s"
+    if not args.yes and input(f"Clear {whose} {count} verdicts in {args.db}? Type 'reset' to confirm: ") != "reset":
+        print("nothing changed")
+        return
+    store.reset(args.reviewer)
+    if verdict_log is not None:
+        verdict_log.close()
+    print(f"cleared {count} verdicts")
+
+if __name__ == "__main__":
+    main()